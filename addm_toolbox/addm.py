@@ -35,10 +35,10 @@ import numpy as np
 from builtins import range, str, zip
 from datetime import datetime
 from matplotlib.backends.backend_pdf import PdfPages
-from multiprocessing import Pool
-from scipy.stats import norm
 
-from .ddm import DDMTrial, DDM
+from .ddm import ChoiceRTDistribution, DDMTrial, DDM, SimulationBatch
+from .parallel import WorkerPool
+from .rng import get_generator
 
 
 class FixationData:
@@ -74,6 +74,220 @@ class FixationData:
         self.transitions = transitions
         self.fixations = fixations
         self.fixDistType = fixDistType
+        # Compiled fixation distributions, built on first use by
+        # get_fixation_table().
+        self.fixationTables = dict()
+        self.fixationDist = None
+        self.fixationDistTables = dict()
+
+
+    def get_fixation_table(self, fixNumber, valueDiff, fixationDist=None,
+                           timeBins=None):
+        """
+        Returns the distribution of item fixation durations for a fixation
+        type and value difference, compiled into arrays that can be sampled
+        from directly. Tables are built the first time they are requested and
+        cached; the tables for a fixationDist are kept until a different
+        fixationDist is used.
+        Args:
+          fixNumber: integer, fixation type (1st, 2nd, etc).
+          valueDiff: value difference indexing the distribution, as defined
+              by self.fixDistType (or the value difference between the
+              fixated and unfixated items, if fixationDist is provided).
+              Ignored for the 'simple' type.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of self.fixations. See aDDM.simulate_trial() for
+              the expected format.
+          timeBins: list containing the time bins used in fixationDist.
+        Returns:
+          A tuple (fixTimes, cumProbs). fixTimes is a numpy array of fixation
+          durations in milliseconds, and cumProbs is a numpy array with their
+          normalized cumulative probabilities, or None if all entries in
+          fixTimes are equally likely (i.e. for the empirical distributions).
+        """
+        if fixationDist:
+            if fixationDist is not self.fixationDist:
+                self.fixationDist = fixationDist
+                self.fixationDistTables = dict()
+            key = (fixNumber, valueDiff)
+            if key not in self.fixationDistTables:
+                dist = fixationDist[fixNumber][valueDiff]
+                probs = [prob for (timeBin, prob) in
+                         sorted(list(dist.items()))]
+                cumProbs = np.cumsum(probs)
+                self.fixationDistTables[key] = (np.array(timeBins),
+                                                cumProbs / cumProbs[-1])
+            return self.fixationDistTables[key]
+
+        if self.fixDistType == u"simple":
+            valueDiff = 0
+        key = (fixNumber, valueDiff)
+        if key not in self.fixationTables:
+            if self.fixDistType == u"simple":
+                fixTimes = self.fixations[fixNumber]
+            else:
+                fixTimes = self.fixations[fixNumber][valueDiff]
+            self.fixationTables[key] = (np.array(fixTimes), None)
+        return self.fixationTables[key]
+
+
+    def sample_from_table(self, fixTimes, cumProbs, size=None, rng=None):
+        """
+        Samples fixation durations from a table returned by
+        get_fixation_table().
+        Args:
+          fixTimes: numpy array of fixation durations in milliseconds.
+          cumProbs: numpy array with the cumulative probabilities of the
+              entries in fixTimes, ending in 1, or None if they are equally
+              likely.
+          size: integer, number of samples. If None, a single sample is
+              returned.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A fixation duration, or a numpy array of fixation durations if size
+          is provided.
+        """
+        rng = get_generator(rng)
+        if cumProbs is None:
+            return rng.choice(fixTimes, size)
+        indices = cumProbs.searchsorted(rng.uniform(size=size), side=u"right")
+        if size is None:
+            return fixTimes[min(indices, fixTimes.size - 1)]
+        return fixTimes[np.minimum(indices, fixTimes.size - 1)]
+
+
+    def sample_fixation_time(self, fixNumber, fixatedItem, valueLeft,
+                             valueRight, fixationDist=None, timeBins=None,
+                             rng=None):
+        """
+        Samples the duration of an item fixation.
+        Args:
+          fixNumber: integer, fixation type (1st, 2nd, etc).
+          fixatedItem: integer, 1 for the left item or 2 for the right item.
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of self.fixations. See aDDM.simulate_trial() for
+              the expected format.
+          timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          The duration of the fixation in milliseconds.
+        """
+        if fixationDist or self.fixDistType == u"fixation":
+            if fixatedItem == 1:
+                valueDiff = valueLeft - valueRight
+            else:
+                valueDiff = valueRight - valueLeft
+        elif self.fixDistType == u"difficulty":
+            valueDiff = np.absolute(valueLeft - valueRight)
+        else:
+            valueDiff = 0
+        fixTimes, cumProbs = self.get_fixation_table(
+            fixNumber, valueDiff, fixationDist, timeBins)
+        return self.sample_from_table(fixTimes, cumProbs, rng=rng)
+
+
+    def sample_fixation_times(self, fixNumbers, fixatedItems, valuesLeft,
+                              valuesRight, fixationDist=None, timeBins=None,
+                              rng=None):
+        """
+        Samples the durations of a batch of item fixations. Fixations which
+        share the same distribution are sampled together.
+        Args:
+          fixNumbers: numpy array of fixation types (1st, 2nd, etc).
+          fixatedItems: numpy array where each entry is 1 for the left item or
+              2 for the right item.
+          valuesLeft: numpy array with the values of the left items.
+          valuesRight: numpy array with the values of the right items.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of self.fixations. See aDDM.simulate_trial() for
+              the expected format.
+          timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A numpy array with the duration of each fixation in milliseconds.
+        """
+        rng = get_generator(rng)
+        fixUnfixValueDiffs = np.where(fixatedItems == 1,
+                                      valuesLeft - valuesRight,
+                                      valuesRight - valuesLeft)
+        if fixationDist or self.fixDistType == u"fixation":
+            valueDiffs = fixUnfixValueDiffs
+        elif self.fixDistType == u"difficulty":
+            valueDiffs = np.absolute(valuesLeft - valuesRight)
+        else:
+            valueDiffs = np.zeros(fixNumbers.size)
+
+        fixTimes = np.zeros(fixNumbers.size, dtype=int)
+        for (fixNumber, valueDiff) in sorted(set(zip(fixNumbers.tolist(),
+                                                     valueDiffs.tolist()))):
+            group = (fixNumbers == fixNumber) & (valueDiffs == valueDiff)
+            table, cumProbs = self.get_fixation_table(
+                fixNumber, valueDiff, fixationDist, timeBins)
+            fixTimes[group] = self.sample_from_table(
+                table, cumProbs, np.count_nonzero(group), rng)
+        return fixTimes
+
+
+    def sample_fixations(self, valueLeft, valueRight, minTime, numFixDists=3,
+                         fixationDist=None, timeBins=None, rng=None):
+        """
+        Samples a sequence of fixations for a trial, independently of any
+        decision process, following the same rules used in
+        aDDM.simulate_trial(): a latency, followed by alternating item
+        fixations and transitions.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          minTime: integer, the sequence is extended until its total duration
+              reaches this value, in milliseconds.
+          numFixDists: integer, number of fixation types to use in the fixation
+              distributions.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of self.fixations.
+          timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (fixItem, fixTime) of numpy arrays, with the same format as
+          the corresponding aDDMTrial fields.
+        """
+        rng = get_generator(rng)
+        fixItem = [0]
+        fixTime = [rng.choice(self.latencies)]
+        totalTime = fixTime[0]
+        fixNumber = 1
+        prevFixatedItem = -1
+        currFixLocation = 0
+        while totalTime < minTime:
+            if currFixLocation == 0:
+                if prevFixatedItem == -1:
+                    currFixLocation = rng.choice(
+                        [1, 2], p=np.array([self.probFixLeftFirst,
+                                            1 - self.probFixLeftFirst]))
+                else:
+                    currFixLocation = 3 - prevFixatedItem
+                prevFixatedItem = currFixLocation
+                currFixTime = self.sample_fixation_time(
+                    fixNumber, currFixLocation, valueLeft, valueRight,
+                    fixationDist, timeBins, rng)
+                if fixNumber < numFixDists:
+                    fixNumber += 1
+            else:
+                currFixLocation = 0
+                currFixTime = rng.choice(self.transitions)
+            fixItem.append(currFixLocation)
+            fixTime.append(currFixTime)
+            totalTime += currFixTime
+        return np.array(fixItem), np.array(fixTime)
 
 
 class aDDMTrial(DDMTrial):
@@ -217,10 +431,6 @@ class aDDM(DDM):
 
         time = 1
 
-        changeMatrix = np.subtract(states.reshape(states.size, 1), states)
-        changeUp = np.subtract(barrierUp, states.reshape(states.size, 1))
-        changeDown = np.subtract(barrierDown, states.reshape(states.size, 1))
-
         # Iterate over all fixations in this trial.
         for fItem, fTime in zip(correctedFixItem, correctedFixTime):
             # We use a normal distribution to model changes in RDV
@@ -236,6 +446,13 @@ class aDDM(DDM):
             else:
                 mean = 0
 
+            # Get the transition kernel and the barrier crossing probabilities
+            # for this drift (precomputed, shared across time steps, fixations
+            # and trials).
+            transitionMatrix, upCrossingTable, downCrossingTable = (
+                self.get_transition_tables(mean, states, stateStep, barrierUp,
+                                           barrierDown))
+
             # Iterate over the time interval of this fixation.
             for t in range(int(fTime // timeStep)):
                 # Update the probability of the states that remain inside the
@@ -246,10 +463,7 @@ class aDDM(DDM):
                 # that the area under the curves for the probability
                 # distributions probUpCrossing and probDownCrossing add up to
                 # 1.
-                prStatesNew = (
-                    stateStep *
-                    np.dot(norm.pdf(changeMatrix, mean, self.sigma),
-                           prStates[:, time-1]))
+                prStatesNew = np.dot(transitionMatrix, prStates[:, time-1])
                 prStatesNew[(states >= barrierUp[time]) |
                             (states <= barrierDown[time])] = 0
 
@@ -258,12 +472,10 @@ class aDDM(DDM):
                 # A, of the probability of being in A at the previous timestep
                 # times the probability of crossing the barrier if A is the
                 # previous state.
-                tempUpCross = np.dot(
-                    prStates[:, time-1],
-                    (1 - norm.cdf(changeUp[:, time], mean, self.sigma)))
-                tempDownCross = np.dot(
-                    prStates[:, time-1],
-                    norm.cdf(changeDown[:, time], mean, self.sigma))
+                tempUpCross = np.dot(prStates[:, time-1],
+                                     upCrossingTable[:, time])
+                tempDownCross = np.dot(prStates[:, time-1],
+                                       downCrossingTable[:, time])
 
                 # Renormalize to cope with numerical approximations.
                 sumIn = np.sum(prStates[:, time-1])
@@ -300,32 +512,158 @@ class aDDM(DDM):
         return likelihood
 
 
+    def get_trial_cost(self, trial, timeStep=10, approxStateStep=0.1):
+        """
+        Estimates the computational cost of get_trial_likelihood() for a
+        single aDDM trial, as the number of state transitions evaluated. Each
+        fixation adds roughly the cost of one time step, for setting up its
+        transition tables.
+        Args:
+          trial: aDDMTrial object.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          The expected cost of the likelihood computation for the trial.
+        """
+        numStates = 2 * np.ceil(self.barrier / approxStateStep) + 1
+        numTimeSteps = max(trial.RT // timeStep, 1)
+        return numStates ** 2 * (numTimeSteps + len(trial.fixItem))
+
+
     def parallel_get_likelihoods(self, trials=None, timeStep=10, stateStep=0.1,
-                                 numThreads=4):
+                                 numThreads=4, pool=None, backend=u"process"):
         """
         Uses a threadpool to computes the likelihood of the data from a set of
         aDDM trials for these particular aDDM parameters.
         Args:
-          addmTrials: list of aDDMTrial objects.
+          trials: list of aDDMTrial objects. If not provided, the
+              trials installed in the workers of pool are used.
           timeStep: integer, value in milliseconds to be used for binning the
               time axis.
           stateStep: float, to be used for binning the RDV axis.
           numThreads: int, number of threads to be used in the threadpool.
+              Ignored if pool is provided.
+          pool: a WorkerPool object. If provided, its workers are used and
+              left running, so that the same pool can be reused across many
+              models. Otherwise, a pool is created for this call only.
+          backend: string, one of {'process', 'thread'}, type of the workers
+              of the pool created when no pool is provided.
         Returns:
-          A list of likelihoods obtained for the given trials and model.
+          A list of likelihoods obtained for the given trials and model. If
+              no trials are given, the trials installed in the pool's workers
+              are used, and the list follows their order.
         """
-        pool = Pool(numThreads)
+        if trials is None:
+            if pool is None:
+                raise RuntimeError(u"Either a list of trials or a worker "
+                                   "pool with installed trials must be "
+                                   "provided.")
+            return pool.get_resident_likelihoods(self, timeStep, stateStep)
+        if pool is None:
+            with WorkerPool(numThreads, backend=backend) as pool:
+                return self.parallel_get_likelihoods(
+                    trials, timeStep, stateStep, pool=pool)
         likelihoods = pool.map(unwrap_addm_get_trial_likelihood,
                                zip([self] * len(trials),
                                    trials,
                                    [timeStep] * len(trials),
                                    [stateStep] * len(trials)))
-        pool.close()
         return likelihoods
 
 
+    def get_fixation_drifts(self, valueLeft, valueRight, fixItem, fixTime,
+                            numTimeSteps, timeStep=10):
+        """
+        Obtains the mean of the change in RDV at each time step of a sequence
+        of fixations.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          fixItem: list of items fixated in chronological order.
+          fixTime: list of fixation durations (in milliseconds) in
+              chronological order.
+          numTimeSteps: integer, number of time steps to be covered. If the
+              fixations are shorter than this, the last one is extended.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+        Returns:
+          A numpy array with size numTimeSteps.
+        """
+        fixItem = np.asarray(fixItem)
+        fixTime = np.asarray(fixTime)
+        itemDrifts = np.zeros(fixItem.size)
+        itemDrifts[fixItem == 1] = self.d * (valueLeft -
+                                             (self.theta * valueRight))
+        itemDrifts[fixItem == 2] = self.d * ((self.theta * valueLeft) -
+                                             valueRight)
+        drifts = np.repeat(itemDrifts, (fixTime // timeStep).astype(int))
+        if drifts.size < numTimeSteps:
+            drifts = np.concatenate(
+                (drifts,
+                 itemDrifts[-1] * np.ones(numTimeSteps - drifts.size)))
+        drifts = drifts[:numTimeSteps]
+        drifts[:int(self.nonDecisionTime // timeStep)] = 0
+        return drifts
+
+
+    def predict_distribution(self, valueLeft, valueRight, fixationData=None,
+                             fixationSchedules=None, numFixationSamples=100,
+                             maxRT=10000, timeStep=10, approxStateStep=0.1,
+                             numFixDists=3, rng=None):
+        """
+        Obtains the joint distribution of choices and response times predicted
+        by the model for a trial condition. The RDV distribution is propagated
+        forward for a set of fixation sequences (all of them in a single
+        batch), and the resulting distributions are averaged. The only source
+        of sampling noise is therefore the fixation process.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          fixationData: a FixationData object, used to sample the fixation
+              sequences when fixationSchedules is not provided.
+          fixationSchedules: list of tuples (fixItem, fixTime), corresponding
+              to the fixation sequences to be used.
+          numFixationSamples: integer, number of fixation sequences to sample
+              from fixationData.
+          maxRT: integer, maximum response time in milliseconds covered by the
+              distribution.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+          numFixDists: integer, number of fixation types to use in the fixation
+              distributions.
+          rng: source of random numbers used to sample the fixation
+              sequences, as accepted by rng.get_generator(). If not provided,
+              the global numpy random state is used.
+        Returns:
+          A ChoiceRTDistribution object.
+        """
+        if fixationSchedules is None:
+            rng = get_generator(rng)
+            if fixationData is None:
+                raise RuntimeError(u"Either fixationData or "
+                                   "fixationSchedules must be provided.")
+            fixationSchedules = [
+                fixationData.sample_fixations(valueLeft, valueRight, maxRT,
+                                              numFixDists, rng=rng)
+                for s in range(numFixationSamples)]
+
+        numTimeSteps = int(maxRT // timeStep)
+        drifts = np.array(
+            [self.get_fixation_drifts(valueLeft, valueRight, fixItem,
+                                      fixTime, numTimeSteps, timeStep)
+             for (fixItem, fixTime) in fixationSchedules])
+        probUpCrossing, probDownCrossing = self.get_crossing_probabilities(
+            drifts, approxStateStep)
+        return ChoiceRTDistribution(valueLeft, valueRight, timeStep,
+                                    np.mean(probUpCrossing, 0),
+                                    np.mean(probDownCrossing, 0))
+
+
     def simulate_trial(self, valueLeft, valueRight, fixationData, timeStep=10,
-                       numFixDists=3, fixationDist=None, timeBins=None):
+                       numFixDists=3, fixationDist=None, timeBins=None,
+                       rng=None, simulationMethod=u"steps"):
         """
         Generates an aDDM trial given the item values and some empirical
         fixation data, which are used to generate the simulated fixations.
@@ -349,11 +687,23 @@ class aDDM(DDM):
               particular time bin (i.e. given a particular fixation type and
               value difference, probabilities for all bins should add up to 1).
           timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'bridge'}. If 'steps',
+              the RDV is updated at every time step. If 'bridge', the RDV
+              jumps from the end of one fixation to the end of the next,
+              with barrier crossings detected through Brownian bridge
+              crossing probabilities. 'bridge' is approximate: its
+              distribution of choices and response times is close to, but
+              not exactly the same as, the one from 'steps'. For a single
+              trial it is not faster than 'steps'; use
+              aDDM.simulate_conditions() to simulate many trials with it.
+              See DDM.advance_rdvs().
         Returns:
           An aDDMTrial object resulting from the simulation.
         """
-        fixUnfixValueDiffs = {1: valueLeft - valueRight,
-                              2: valueRight - valueLeft}
+        rng = get_generator(rng)
         fixItem = list()
         fixTime = list()
         fixRDV = list()
@@ -361,26 +711,25 @@ class aDDM(DDM):
         trialTime = 0
 
         # Sample and iterate over the latency for this trial.
-        latency = np.random.choice(fixationData.latencies)
+        latency = rng.choice(fixationData.latencies)
         remainingNDT = self.nonDecisionTime - latency
-        for t in range(int(latency // timeStep)):
-            # Sample the change in RDV from the distribution.
-            RDV += np.random.normal(0, self.sigma)
-
-            # If the RDV hit one of the barriers, the trial is over.
-            if RDV >= self.barrier or RDV <= -self.barrier:
-                if RDV >= self.barrier:
-                    choice = -1
-                elif RDV <= -self.barrier:
-                    choice = 1
-                fixRDV.append(RDV)
-                fixItem.append(0)
-                fixTime.append((t + 1) * timeStep)
-                trialTime += ((t + 1) * timeStep)
-                RT = trialTime
-                uninterruptedLastFixTime = latency
-                return aDDMTrial(RT, choice, valueLeft, valueRight, fixItem,
-                                 fixTime, fixRDV, uninterruptedLastFixTime)
+        RDV, crossingStep = self.advance_rdv(
+            RDV, 0, int(latency // timeStep), simulationMethod, rng)
+
+        # If the RDV hit one of the barriers, the trial is over.
+        if crossingStep is not None:
+            if RDV >= self.barrier:
+                choice = -1
+            elif RDV <= -self.barrier:
+                choice = 1
+            fixRDV.append(RDV)
+            fixItem.append(0)
+            fixTime.append(crossingStep * timeStep)
+            trialTime += crossingStep * timeStep
+            RT = trialTime
+            uninterruptedLastFixTime = latency
+            return aDDMTrial(RT, choice, valueLeft, valueRight, fixItem,
+                             fixTime, fixRDV, uninterruptedLastFixTime)
 
         # Add latency to this trial's data.
         fixRDV.append(RDV)
@@ -391,7 +740,6 @@ class aDDM(DDM):
         fixNumber = 1
         prevFixatedItem = -1
         currFixLocation = 0
-        decisionReached = False
 
         while True:
             if currFixLocation == 0:
@@ -401,98 +749,49 @@ class aDDM(DDM):
                     probLeftRight = np.array(
                         [fixationData.probFixLeftFirst,
                          1 - fixationData.probFixLeftFirst])
-                    currFixLocation = np.random.choice([1, 2], p=probLeftRight)
+                    currFixLocation = rng.choice([1, 2], p=probLeftRight)
                 elif prevFixatedItem == 1:
                     currFixLocation = 2
                 elif prevFixatedItem == 2:
                     currFixLocation = 1
                 prevFixatedItem = currFixLocation
                 # Sample the duration of this item fixation.
-                if not fixationDist:
-                    if fixationData.fixDistType == u"simple":
-                        currFixTime = np.random.choice(
-                            fixationData.fixations[fixNumber])
-                    elif fixationData.fixDistType == u"difficulty":
-                        valueDiff = np.absolute(valueLeft - valueRight)
-                        currFixTime = np.random.choice(
-                            fixationData.fixations[fixNumber][valueDiff])
-                    elif fixationData.fixDistType == u"fixation":
-                        valueDiff = fixUnfixValueDiffs[currFixLocation]
-                        currFixTime = np.random.choice(
-                            fixationData.fixations[fixNumber][valueDiff])
-                else:
-                    valueDiff = fixUnfixValueDiffs[currFixLocation]
-                    currFixTime = np.random.choice(
-                        timeBins, p=[value for (key, value) in 
-                        sorted(list(
-                            fixationDist[fixNumber][valueDiff].items()))])
+                currFixTime = fixationData.sample_fixation_time(
+                    fixNumber, currFixLocation, valueLeft, valueRight,
+                    fixationDist, timeBins, rng)
                 if fixNumber < numFixDists:
                     fixNumber += 1
             else:
                 # This is a transition.
                 currFixLocation = 0
                 # Sample the duration of this transition.
-                currFixTime = np.random.choice(fixationData.transitions)
+                currFixTime = rng.choice(fixationData.transitions)
 
             # Iterate over the remaining non-decision time.
             if remainingNDT > 0:
-                for t in range(int(remainingNDT // timeStep)):
-                    # Sample the change in RDV from the distribution.
-                    RDV += np.random.normal(0, self.sigma)
-
-                    # If the RDV hit one of the barriers, the trial is over.
-                    if RDV >= self.barrier or RDV <= -self.barrier:
-                        if RDV >= self.barrier:
-                            choice = -1
-                        elif RDV <= -self.barrier:
-                            choice = 1
-                        fixRDV.append(RDV)
-                        fixItem.append(currFixLocation)
-                        fixTime.append((t + 1) * timeStep)
-                        trialTime += ((t + 1) * timeStep)
-                        RT = trialTime
-                        uninterruptedLastFixTime = currFixTime
-                        decisionReached = True
-                        break
-
-            if decisionReached:
-                break
+                RDV, crossingStep = self.advance_rdv(
+                    RDV, 0, int(remainingNDT // timeStep), simulationMethod,
+                    rng)
+                if crossingStep is not None:
+                    break
 
             remainingFixTime = max(0, currFixTime - max(0, remainingNDT))
             remainingNDT -= currFixTime
 
-            # Iterate over the duration of the current fixation.
-            for t in range(int(remainingFixTime // timeStep)):
-                # We use a distribution to model changes in RDV
-                # stochastically. The mean of the distribution (the change
-                # most likely to occur) is calculated from the model
-                # parameters and from the values of the two items.
-                if currFixLocation == 0:  # Transition.
-                    mean = 0
-                elif currFixLocation == 1:  # Subject is looking left.
-                    mean = self.d * (valueLeft - (self.theta * valueRight))
-                elif currFixLocation == 2:  # Subject is looking right.
-                    mean = self.d * ((self.theta * valueLeft) - valueRight)
-
-                # Sample the change in RDV from the distribution.
-                RDV += np.random.normal(mean, self.sigma)
-
-                # If the RDV hit one of the barriers, the trial is over.
-                if RDV >= self.barrier or RDV <= -self.barrier:
-                    if RDV >= self.barrier:
-                        choice = -1
-                    elif RDV <= -self.barrier:
-                        choice = 1
-                    fixRDV.append(RDV)
-                    fixItem.append(currFixLocation)
-                    fixTime.append((t + 1) * timeStep)
-                    trialTime += (t + 1) * timeStep
-                    RT = trialTime
-                    uninterruptedLastFixTime = currFixTime
-                    decisionReached = True
-                    break
-
-            if decisionReached:
+            # Iterate over the duration of the current fixation. We use a
+            # distribution to model changes in RDV stochastically. The mean of
+            # the distribution (the change most likely to occur) is calculated
+            # from the model parameters and from the values of the two items.
+            if currFixLocation == 0:  # Transition.
+                mean = 0
+            elif currFixLocation == 1:  # Subject is looking left.
+                mean = self.d * (valueLeft - (self.theta * valueRight))
+            elif currFixLocation == 2:  # Subject is looking right.
+                mean = self.d * ((self.theta * valueLeft) - valueRight)
+            RDV, crossingStep = self.advance_rdv(
+                RDV, mean, int(remainingFixTime // timeStep), simulationMethod,
+                rng)
+            if crossingStep is not None:
                 break
 
             # Add fixation to this trial's data.
@@ -501,5 +800,232 @@ class aDDM(DDM):
             fixTime.append(currFixTime - (currFixTime % timeStep))
             trialTime += currFixTime - (currFixTime % timeStep)
 
+        # The RDV hit one of the barriers, so the trial is over.
+        if RDV >= self.barrier:
+            choice = -1
+        elif RDV <= -self.barrier:
+            choice = 1
+        fixRDV.append(RDV)
+        fixItem.append(currFixLocation)
+        fixTime.append(crossingStep * timeStep)
+        trialTime += crossingStep * timeStep
+        RT = trialTime
+        uninterruptedLastFixTime = currFixTime
         return aDDMTrial(RT, choice, valueLeft, valueRight, fixItem, fixTime,
                          fixRDV, uninterruptedLastFixTime)
+
+
+    def simulate_trials(self, valueLeft, valueRight, fixationData, numTrials,
+                        timeStep=10, numFixDists=3, fixationDist=None,
+                        timeBins=None, rng=None, simulationMethod=u"steps"):
+        """
+        Generates a batch of aDDM trials for a single trial condition. The
+        trials follow the same rules as aDDM.simulate_trial(), but are
+        advanced together using array operations.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          fixationData: a FixationData object.
+          numTrials: integer, number of trials to be generated.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          numFixDists: integer, number of fixation types to use in the fixation
+              distributions.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of fixationData.fixations. See
+              aDDM.simulate_trial() for the expected format.
+          timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'bridge'}. See
+              aDDM.simulate_conditions().
+        Returns:
+          A SimulationBatch object with numTrials trials.
+        """
+        return self.simulate_conditions(
+            [(valueLeft, valueRight)], fixationData, numTrials, timeStep,
+            numFixDists, fixationDist, timeBins, rng, simulationMethod)
+
+
+    def simulate_conditions(self, trialConditions, fixationData,
+                            trialsPerCondition, timeStep=10, numFixDists=3,
+                            fixationDist=None, timeBins=None, rng=None,
+                            simulationMethod=u"steps"):
+        """
+        Generates a batch of aDDM trials for several trial conditions at
+        once. All trials are advanced in lockstep, one time step (or, with
+        the 'bridge' method, one fixation phase) at a time, and trials are
+        dropped from the computation as soon as they reach a barrier.
+        Fixations are sampled in batches whenever trials move on to a new
+        fixation.
+        Args:
+          trialConditions: list of pairs (valueLeft, valueRight).
+          fixationData: a FixationData object.
+          trialsPerCondition: integer, number of trials to be generated for
+              each trial condition.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          numFixDists: integer, number of fixation types to use in the fixation
+              distributions.
+          fixationDist: distribution of fixations which, when provided, will be
+              used instead of fixationData.fixations. See
+              aDDM.simulate_trial() for the expected format.
+          timeBins: list containing the time bins used in fixationDist.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'bridge'}. If
+              'steps', the RDVs are updated at every time step. If 'bridge',
+              each iteration jumps all trials to the end of their current
+              fixation phase, with barrier crossings detected through
+              Brownian bridge crossing probabilities (see
+              DDM.advance_rdvs()), so the number of iterations grows with the
+              number of fixations rather than with the number of time steps.
+              'bridge' is approximate: its distribution of choices and
+              response times is close to, but not exactly the same as, the
+              one from 'steps'.
+        Returns:
+          A SimulationBatch object, with the trials ordered by trial
+              condition.
+        """
+        rng = get_generator(rng)
+        if simulationMethod not in (u"steps", u"bridge"):
+            raise RuntimeError(u"Argument simulationMethod must be one of "
+                               "{steps, bridge}.")
+        valuesLeft = np.repeat(
+            np.array([valueLeft for (valueLeft, valueRight)
+                      in trialConditions]), trialsPerCondition)
+        valuesRight = np.repeat(
+            np.array([valueRight for (valueLeft, valueRight)
+                      in trialConditions]), trialsPerCondition)
+        numTrials = valuesLeft.size
+        driftLeft = self.d * (valuesLeft - (self.theta * valuesRight))
+        driftRight = self.d * ((self.theta * valuesLeft) - valuesRight)
+        probLeftRight = np.array([fixationData.probFixLeftFirst,
+                                  1 - fixationData.probFixLeftFirst])
+
+        RDV = np.full(numTrials, self.bias, dtype=float)
+        RT = np.zeros(numTrials, dtype=int)
+        choice = np.zeros(numTrials, dtype=int)
+        uninterruptedLastFixTime = np.zeros(numTrials, dtype=int)
+        trialTime = np.zeros(numTrials, dtype=int)
+
+        # State of the current fixation of each trial. Each fixation goes
+        # through two phases: the remaining non-decision time, during which
+        # the RDV has no drift (phase 1), and the rest of the fixation
+        # (phase 2). The latency is treated as phase 0.
+        currFixLocation = np.zeros(numTrials, dtype=int)
+        currFixTime = rng.choice(fixationData.latencies,
+                                 numTrials).astype(int)
+        remainingNDT = self.nonDecisionTime - currFixTime
+        phase = np.zeros(numTrials, dtype=int)
+        stepsLeft = currFixTime // timeStep
+        phaseSteps = np.zeros(numTrials, dtype=int)
+        mean = np.zeros(numTrials)
+        fixNumber = np.ones(numTrials, dtype=int)
+        prevFixatedItem = np.full(numTrials, -1, dtype=int)
+
+        # Fixations are recorded as they end, for all trials together.
+        fixTrials = list()
+        fixItems = list()
+        fixTimes = list()
+        fixRDVs = list()
+
+        active = np.arange(numTrials)
+        while active.size:
+            # Move the trials whose current phase is over to their next phase.
+            ended = active[stepsLeft[active] == 0]
+            while ended.size:
+                decisionPhase = ended[phase[ended] == 1]
+                over = ended[phase[ended] != 1]
+
+                # Start the decision phase of the current fixation.
+                remainingFixTime = np.maximum(
+                    0, currFixTime[decisionPhase] -
+                    np.maximum(0, remainingNDT[decisionPhase]))
+                remainingNDT[decisionPhase] -= currFixTime[decisionPhase]
+                phase[decisionPhase] = 2
+                stepsLeft[decisionPhase] = remainingFixTime // timeStep
+                phaseSteps[decisionPhase] = 0
+                location = currFixLocation[decisionPhase]
+                mean[decisionPhase] = np.where(
+                    location == 1, driftLeft[decisionPhase],
+                    np.where(location == 2, driftRight[decisionPhase], 0))
+
+                # Add the fixations which are over to the trials' data.
+                overFixTime = (currFixTime[over] -
+                               (currFixTime[over] % timeStep))
+                fixTrials.append(over)
+                fixItems.append(currFixLocation[over])
+                fixTimes.append(overFixTime)
+                fixRDVs.append(RDV[over])
+                trialTime[over] += overFixTime
+
+                # An item fixation follows the latency and each transition,
+                # and a transition follows each item fixation.
+                item = over[currFixLocation[over] == 0]
+                transition = over[currFixLocation[over] != 0]
+                location = 3 - prevFixatedItem[item]
+                first = prevFixatedItem[item] == -1
+                location[first] = rng.choice([1, 2], np.count_nonzero(first),
+                                             p=probLeftRight)
+                currFixLocation[item] = location
+                prevFixatedItem[item] = location
+                currFixTime[item] = fixationData.sample_fixation_times(
+                    fixNumber[item], location, valuesLeft[item],
+                    valuesRight[item], fixationDist, timeBins, rng)
+                fixNumber[item] = np.minimum(fixNumber[item] + 1, numFixDists)
+
+                currFixLocation[transition] = 0
+                currFixTime[transition] = rng.choice(fixationData.transitions,
+                                                     transition.size)
+
+                phase[over] = 1
+                stepsLeft[over] = np.where(remainingNDT[over] > 0,
+                                           remainingNDT[over] // timeStep, 0)
+                phaseSteps[over] = 0
+                mean[over] = 0
+
+                ended = active[stepsLeft[active] == 0]
+
+            if simulationMethod == u"bridge":
+                # Jump to the end of the current phase, or to the barrier
+                # crossing within it.
+                RDV[active], crossingSteps = self.advance_rdvs(
+                    RDV[active], mean[active], stepsLeft[active], rng)
+                hit = crossingSteps > 0
+                numSteps = np.where(hit, crossingSteps, stepsLeft[active])
+            else:
+                # Sample the change in RDV from the distribution.
+                RDV[active] += rng.normal(mean[active], self.sigma)
+                hit = ((RDV[active] >= self.barrier) |
+                       (RDV[active] <= -self.barrier))
+                numSteps = 1
+            phaseSteps[active] += numSteps
+            stepsLeft[active] -= numSteps
+
+            # Trials whose RDV hit one of the barriers are over.
+            done = active[hit]
+            if done.size:
+                choice[done] = np.where(RDV[done] >= self.barrier, -1, 1)
+                elapsedTime = phaseSteps[done] * timeStep
+                fixTrials.append(done)
+                fixItems.append(currFixLocation[done])
+                fixTimes.append(elapsedTime)
+                fixRDVs.append(RDV[done])
+                RT[done] = trialTime[done] + elapsedTime
+                uninterruptedLastFixTime[done] = currFixTime[done]
+                active = active[~hit]
+
+        # Fixations were recorded in chronological order, so a stable sort by
+        # trial keeps them in order within each trial.
+        fixTrials = np.concatenate(fixTrials)
+        order = np.argsort(fixTrials, kind=u"stable")
+        fixOffsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(fixTrials, minlength=numTrials))))
+        return SimulationBatch(RT, choice, valuesLeft, valuesRight,
+                               fixOffsets, np.concatenate(fixItems)[order],
+                               np.concatenate(fixTimes)[order],
+                               np.concatenate(fixRDVs)[order],
+                               uninterruptedLastFixTime)
@@ -34,8 +34,10 @@ import numpy as np
 
 from builtins import range, str
 
+from . import addm
 from .addm import aDDMTrial
-from .ddm_mla import DDM
+from .ddm_mla import DDM, simulate_from_bank
+from .rng import get_generator
 
 
 class aDDM(DDM):
@@ -65,7 +67,7 @@ class aDDM(DDM):
 
 
     def simulate_trial(self, valueLeft, valueRight, fixationData, timeStep=10,
-                       numFixDists=3):
+                       numFixDists=3, rng=None):
         """
         Generates an aDDM trial given the item values and some empirical
         fixation data, which are used to generate the simulated fixations.
@@ -79,9 +81,13 @@ class aDDM(DDM):
               distributions. For instance, if numFixDists equals 3, then 3
               separate fixation types will be used, corresponding to the 1st,
               2nd and other (3rd and up) fixations in each trial.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
         Returns:
           An aDDMTrial object resulting from the simulation.
         """
+        rng = get_generator(rng)
         RDV = self.bias
         RT = 0
         trialTime = 0
@@ -91,11 +97,11 @@ class aDDM(DDM):
         fixRDV = list()
 
         # Sample and iterate over the latency for this trial.
-        latency = np.random.choice(fixationData.latencies)
+        latency = rng.choice(fixationData.latencies)
         remainingNDT = self.nonDecisionTime - latency
         for t in range(int(latency // timeStep)):
             # Sample the change in RDV from the distribution.
-            RDV += np.random.normal(0, self.sigma)
+            RDV += rng.normal(0, self.sigma)
 
             # If the RDV hit one of the barriers, the trial is over.
             if RDV >= self.barrier or RDV <= -self.barrier:
@@ -117,9 +123,6 @@ class aDDM(DDM):
         fixTime.append(latency - (latency % timeStep))
         trialTime += latency - (latency % timeStep)
 
-        fixUnfixValueDiffs = {1: valueLeft - valueRight,
-                              2: valueRight - valueLeft}
-
         fixNumber = 1
         prevFixatedItem = -1
         currFixLocation = 0
@@ -133,29 +136,29 @@ class aDDM(DDM):
                     probLeftRight = np.array(
                         [fixationData.probFixLeftFirst,
                          1 - fixationData.probFixLeftFirst])
-                    currFixLocation = np.random.choice([1, 2], p=probLeftRight)
+                    currFixLocation = rng.choice([1, 2], p=probLeftRight)
                 elif prevFixatedItem == 1:
                     currFixLocation = 2
                 elif prevFixatedItem == 2:
                     currFixLocation = 1
                 prevFixatedItem = currFixLocation
                 # Sample the duration of this item fixation.
-                valueDiff = fixUnfixValueDiffs[currFixLocation]
-                currFixTime = np.random.choice(
-                    fixationData.fixations[fixNumber][valueDiff])
+                currFixTime = fixationData.sample_fixation_time(
+                    fixNumber, currFixLocation, valueLeft, valueRight,
+                    rng=rng)
                 if fixNumber < numFixDists:
                     fixNumber += 1
             else:
                 # This is a transition.
                 currFixLocation = 0
                 # Sample the duration of this transition.
-                currFixTime = np.random.choice(fixationData.transitions)
+                currFixTime = rng.choice(fixationData.transitions)
 
             # Iterate over the remaining non-decision time.
             if remainingNDT > 0:
                 for t in range(int(remainingNDT // timeStep)):
                     # Sample the change in RDV from the distribution.
-                    RDV += np.random.normal(0, self.sigma)
+                    RDV += rng.normal(0, self.sigma)
 
                     # If the RDV hit one of the barriers, the trial is over.
                     if RDV >= self.barrier or RDV <= -self.barrier:
@@ -180,7 +183,7 @@ class aDDM(DDM):
 
             # Iterate over the duration of the current fixation.
             for t in range(int(remainingFixTime // timeStep)):
-                epsilon = np.random.normal(0, self.sigma)
+                epsilon = rng.normal(0, self.sigma)
                 if currFixLocation == 0:
                     RDV += epsilon
                 elif currFixLocation == 1:
@@ -216,9 +219,38 @@ class aDDM(DDM):
                          fixRDV)
 
 
+    def simulate_trials(self, valueLeft, valueRight, fixationData, numTrials,
+                        timeStep=10, numFixDists=3, rng=None):
+        """
+        Generates a batch of trials for a single trial condition, using the
+        lockstep simulator from addm.aDDM.simulate_conditions().
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          fixationData: a FixationData object.
+          numTrials: integer, number of trials to be generated.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          numFixDists: integer, number of fixation types to use in the fixation
+              distributions.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A ddm.SimulationBatch object with numTrials trials.
+        """
+        model = addm.aDDM(self.d, self.sigma, self.theta, self.barrier,
+                          self.nonDecisionTime, self.bias)
+        return model.simulate_trials(valueLeft, valueRight, fixationData,
+                                     numTrials, timeStep, numFixDists,
+                                     rng=rng)
+
+
     def get_model_log_likelihood(self, fixationData, trialConditions,
                              numSimulations, histBins, dataHistLeft,
-                             dataHistRight):
+                             dataHistRight, histogramMethod=u"simulation",
+                             fixationSchedules=None, randomNumberBank=None,
+                             rng=None):
         """
         Computes the log-likelihood of a data set given the parameters of the
         aDDM. Data set is provided in the form of response time histograms
@@ -229,7 +261,10 @@ class aDDM(DDM):
               conditions. Each pair contains the values of left and right
               items.
           numSimulations: integer, number of simulations per trial condition to
-              be generated when creating response time histograms.
+              be generated when creating response time histograms. When
+              histogramMethod is 'propagation', this is the number of fixation
+              sequences sampled per trial condition (unless fixationSchedules
+              is provided).
           histBins: list of numbers corresponding to the time bins used to
               create the response time histograms.
           dataHistLeft: dict indexed by trial condition (where each trial
@@ -240,45 +275,270 @@ class aDDM(DDM):
               histBins.
           dataHistRight: same as dataHistLeft, except that the response time
               histograms are conditioned on right choice.
+          histogramMethod: string, one of {'simulation', 'propagation'}. If
+              'simulation', the model histograms are estimated from simulated
+              trials. If 'propagation', the histogram bin probabilities are
+              computed by propagating the RDV distribution forward in time for
+              each fixation sequence, and averaging the resulting barrier
+              crossing distributions.
+          fixationSchedules: dict indexed by trial condition, where each entry
+              is a list of fixation sequences (tuples (fixItem, fixTime)), as
+              returned by sample_fixation_schedules(). Only used when
+              histogramMethod is 'propagation'. Providing the same sequences
+              to all models in a grid search makes their log-likelihoods
+              directly comparable.
+          randomNumberBank: dict indexed by trial condition, as returned by
+              sample_random_number_bank(). Only used when histogramMethod is
+              'simulation': if provided, the simulated trials follow the
+              fixation sequences and noise in the bank instead of fresh
+              draws, and numSimulations is not used. As with
+              fixationSchedules, sharing one bank across a grid search makes
+              the log-likelihoods of its models directly comparable.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
           Returns:
               The log-likelihood for the given data and model.
         """
+        histogramMethod = str(histogramMethod)
+        if (histogramMethod != u"simulation" and
+            histogramMethod != u"propagation"):
+            raise RuntimeError(u"Argument histogramMethod must be one of "
+                               "{simulation, propagation}")
+
+        rng = get_generator(rng)
         logLikelihood = 0
         for trialCondition in trialConditions:
-            RTsLeft = list()
-            RTsRight = list()
-            sim = 0
-            while sim < numSimulations:
-                try:
-                    addmTrial = self.simulate_trial(
-                        trialCondition[0], trialCondition[1], fixationData)
-                except:
-                    print(u"An exception occurred while generating "
-                          "artificial trial " + str(sim) + u" for condition " +
-                          str(trialCondition) + u", during the "
-                          "log-likelihood computation for model " +
-                          str(self.params) + u".")
-                    raise
-                if addmTrial.choice == -1:
-                    RTsLeft.append(addmTrial.RT)
-                elif addmTrial.choice == 1:
-                    RTsRight.append(addmTrial.RT)
-                sim += 1
-
-            simulLeft = np.histogram(RTsLeft, bins=histBins)[0]
-            if np.sum(simulLeft) != 0:
-                simulLeft = simulLeft / np.sum(simulLeft)
+            if histogramMethod == u"propagation":
+                if fixationSchedules:
+                    schedules = fixationSchedules[trialCondition]
+                else:
+                    schedules = sample_fixation_schedules(
+                        fixationData, [trialCondition], numSimulations,
+                        histBins[-1], rng=rng)[trialCondition]
+                simulLeft, simulRight = self.get_propagation_histograms(
+                    trialCondition[0], trialCondition[1], histBins,
+                    schedules)
+            elif randomNumberBank:
+                fixLocations, noise = randomNumberBank[trialCondition]
+                simulLeft, simulRight = self.get_bank_histograms(
+                    trialCondition[0], trialCondition[1], histBins,
+                    fixLocations, noise)
+            else:
+                simulLeft, simulRight = self.get_simulation_histograms(
+                    trialCondition[0], trialCondition[1], numSimulations,
+                    histBins, fixationData, rng)
+
             with np.errstate(divide=u"ignore"):
                 logSimulLeft = np.where(simulLeft > 0, np.log(simulLeft), 0)
             dataLeft = np.array(dataHistLeft[trialCondition])
             logLikelihood += np.dot(logSimulLeft, dataLeft)
 
-            simulRight = np.histogram(RTsRight, bins=histBins)[0]
-            if np.sum(simulRight) != 0:
-                simulRight = simulRight / np.sum(simulRight)
             with np.errstate(divide=u"ignore"):
                 logSimulRight = np.where(simulRight > 0, np.log(simulRight), 0)
             dataRight = np.array(dataHistRight[trialCondition])
             logLikelihood += np.dot(logSimulRight, dataRight)
 
         return logLikelihood
+
+
+    def get_simulation_histograms(self, valueLeft, valueRight, numSimulations,
+                                  histBins, fixationData, rng=None):
+        """
+        Estimates the response time histograms conditioned on choice for a
+        trial condition by generating simulations.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          numSimulations: integer, number of simulations to be generated.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          fixationData: a FixationData object.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        try:
+            batch = self.simulate_trials(valueLeft, valueRight, fixationData,
+                                         numSimulations, rng=rng)
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials for condition " + str((valueLeft, valueRight)) +
+                  u", during the log-likelihood computation for model " +
+                  str(self.params) + u".")
+            raise
+        return batch.get_histograms(histBins)
+
+
+    def get_bank_histograms(self, valueLeft, valueRight, histBins,
+                            fixLocations, noise, timeStep=10):
+        """
+        Estimates the response time histograms conditioned on choice for a
+        trial condition from trials simulated with pre-drawn fixation
+        sequences and noise.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          fixLocations: numpy array with the fixated item (0, 1 or 2) at
+              each time step of each simulated trial, as in the entries
+              returned by sample_random_number_bank().
+          noise: numpy array of standard normals, of the same shape as
+              fixLocations.
+          timeStep: integer, value in milliseconds which determines how often
+              the RDV signal is updated.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        stepDrifts = np.array(
+            [0, self.d * (valueLeft - (self.theta * valueRight)),
+             self.d * ((self.theta * valueLeft) - valueRight)])
+        drift = stepDrifts[fixLocations]
+        drift[:, :int(self.nonDecisionTime // timeStep)] = 0
+        batch = simulate_from_bank(valueLeft, valueRight, drift, noise,
+                                   self.sigma, self.barrier, self.bias,
+                                   timeStep)
+        return batch.get_histograms(histBins)
+
+
+    def get_propagation_histograms(self, valueLeft, valueRight, histBins,
+                                   fixationSchedules, timeStep=10,
+                                   approxStateStep=0.1):
+        """
+        Computes the response time histograms conditioned on choice for a
+        trial condition by averaging the barrier crossing distributions of the
+        model over a set of fixation sequences.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          fixationSchedules: list of tuples (fixItem, fixTime), corresponding
+              to the fixation sequences to be used.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        model = addm.aDDM(self.d, self.sigma, self.theta, self.barrier,
+                          self.nonDecisionTime, self.bias)
+        distribution = model.predict_distribution(
+            valueLeft, valueRight, fixationSchedules=fixationSchedules,
+            maxRT=histBins[-1] + timeStep, timeStep=timeStep,
+            approxStateStep=approxStateStep)
+        return distribution.get_histograms(histBins)
+
+
+def sample_fixation_schedules(fixationData, trialConditions, numSchedules,
+                              maxTime, numFixDists=3, rng=None):
+    """
+    Samples a fixed set of fixation sequences for each trial condition, which
+    can be shared by all models when computing histograms through propagation.
+    Args:
+      fixationData: a FixationData object.
+      trialConditions: list of pairs corresponding to the different trial
+          conditions. Each pair contains the values of left and right items.
+      numSchedules: integer, number of fixation sequences per trial condition.
+      maxTime: integer, minimum total duration of each sequence, in
+          milliseconds.
+      numFixDists: integer, number of fixation types to use in the fixation
+          distributions.
+      rng: source of random numbers, as accepted by rng.get_generator(). If
+          not provided, the global numpy random state is used.
+    Returns:
+      A dict indexed by trial condition, where each entry is a list of tuples
+          (fixItem, fixTime).
+    """
+    rng = get_generator(rng)
+    fixationSchedules = dict()
+    for (valueLeft, valueRight) in trialConditions:
+        fixationSchedules[(valueLeft, valueRight)] = [
+            fixationData.sample_fixations(valueLeft, valueRight, maxTime,
+                                          numFixDists, rng=rng)
+            for s in range(numSchedules)]
+    return fixationSchedules
+
+
+def sample_random_number_bank(fixationData, trialConditions, numSimulations,
+                              maxRT, timeStep=10, numFixDists=3, rng=None):
+    """
+    Samples a bank of fixation sequences and noise for each trial condition,
+    which can be shared by all models in a grid search when computing
+    histograms from simulations (common random numbers). Fixations in the
+    aDDM do not depend on the decision process, so each simulated trial can
+    be described in advance by the item fixated and the noise drawn at each
+    time step.
+    Args:
+      fixationData: a FixationData object.
+      trialConditions: list of pairs corresponding to the different trial
+          conditions. Each pair contains the values of left and right items.
+      numSimulations: integer, number of simulated trials per trial
+          condition.
+      maxRT: integer, maximum response time in milliseconds covered by the
+          bank. Trials which have not reached a barrier by then are left out
+          of the histograms.
+      timeStep: integer, value in milliseconds which determines how often
+          the RDV signal is updated.
+      numFixDists: integer, number of fixation types to use in the fixation
+          distributions.
+      rng: source of random numbers, as accepted by rng.get_generator(). If
+          not provided, the global numpy random state is used.
+    Returns:
+      A dict indexed by trial condition, where each entry is a tuple
+          (fixLocations, noise) of numpy arrays of shape
+          (numSimulations, maxRT // timeStep): the item fixated (0 for the
+          latency and transitions, 1 for left, 2 for right) and the standard
+          normal noise at each time step of each simulated trial.
+    """
+    rng = get_generator(rng)
+    numSteps = int(maxRT // timeStep)
+    randomNumberBank = dict()
+    for (valueLeft, valueRight) in trialConditions:
+        # Fixations are sampled for all simulations together, following the
+        # same rules as fixationData.sample_fixations(): a latency, then
+        # alternating item fixations and transitions, until every simulation
+        # covers numSteps time steps. As in the simulations, each fixation
+        # lasts for a whole number of time steps. The fixated item is
+        # recorded as a change at the step where each fixation starts, and
+        # the changes are accumulated over time at the end.
+        changes = np.zeros((numSimulations, numSteps), dtype=np.int8)
+        currItems = np.zeros(numSimulations, dtype=np.int8)
+        nextItems = rng.choice(
+            [1, 2], size=numSimulations,
+            p=np.array([fixationData.probFixLeftFirst,
+                        1 - fixationData.probFixLeftFirst])).astype(np.int8)
+        steps = (rng.choice(fixationData.latencies, numSimulations) //
+                 timeStep).astype(int)
+        fixNumber = 1
+        isItemFixation = True
+        active = np.flatnonzero(steps < numSteps)
+        while active.size > 0:
+            if isItemFixation:
+                items = nextItems[active]
+                fixTime = fixationData.sample_fixation_times(
+                    np.full(active.size, fixNumber), items,
+                    np.full(active.size, valueLeft),
+                    np.full(active.size, valueRight), rng=rng)
+                nextItems[active] = 3 - items
+                if fixNumber < numFixDists:
+                    fixNumber += 1
+            else:
+                items = np.zeros(active.size, dtype=np.int8)
+                fixTime = rng.choice(fixationData.transitions, active.size)
+            # Several fixations may start at the same step if some of them
+            # are shorter than a time step.
+            np.add.at(changes, (active, steps[active]),
+                      items - currItems[active])
+            currItems[active] = items
+            steps[active] += (fixTime // timeStep).astype(int)
+            active = active[steps[active] < numSteps]
+            isItemFixation = not isItemFixation
+        fixLocations = np.cumsum(changes, axis=1, dtype=np.int8)
+        noise = rng.normal(size=(numSimulations, numSteps)).astype(
+            np.float32)
+        randomNumberBank[(valueLeft, valueRight)] = (fixLocations, noise)
+    return randomNumberBank
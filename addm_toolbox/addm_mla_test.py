@@ -35,10 +35,12 @@ from __future__ import absolute_import
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
-from multiprocessing import Pool
+from builtins import range, str, zip
 
-from .addm_mla import aDDM
+from .addm_mla import (aDDM, sample_fixation_schedules,
+                       sample_random_number_bank)
+from .parallel import WorkerPool, get_resident_data
+from .rng import get_generator, spawn_seeds
 from .util import (load_trial_conditions_from_csv, load_data_from_csv,
                    get_empirical_distributions, convert_item_values)
 
@@ -46,22 +48,27 @@ from .util import (load_trial_conditions_from_csv, load_data_from_csv,
 def wrap_addm_get_model_log_likelihood(args):
     """
     Wrapper for aDDM.get_model_log_likelihood(), intended for parallel
-    computation using a threadpool.
+    computation using a worker pool. The arguments shared by all models,
+    which include the fixation sequences and random number banks, are
+    resident in the workers under the name 'modelArgs', so each task only
+    carries its model.
     Args:
-      args: a tuple where the first item is an aDDM object, and the remaining
-          item are the same arguments required by
-          aDDM.get_model_log_likelihood().
+      args: a tuple (poolId, model, rng), where poolId is the id of the
+          worker pool, model is an aDDM object and rng is the source of
+          random numbers for the model.
     Returns:
       The output of aDDM.get_model_log_likelihood().
     """
-    model = args[0]
-    return model.get_model_log_likelihood(*args[1:])
+    poolId, model, rng = args
+    return model.get_model_log_likelihood(
+        *get_resident_data(u"modelArgs", poolId), rng=rng)
 
 
 def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
          expdataFileName=None, fixationsFileName=None, numTrials=10,
          numSimulations=10, subjectIds=[], binStep=100, maxRT=8000,
-         numThreads=9, verbose=False):
+         numThreads=9, verbose=False, histogramMethod=u"simulation",
+         threadBudget=None, seed=None, commonRandomNumbers=False):
     """
     Args:
       d: float, aDDM parameter for generating artificial data.
@@ -83,9 +90,24 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
       maxRT: int, maximum RT to be used in the RT histograms.
       numThreads: int, size of the thread pool.
       verbose: boolean, whether or not to increase output verbosity.
+      histogramMethod: string, one of {'simulation', 'propagation'}, method
+          used to compute the model RT histograms. With 'propagation', a
+          single bank of numSimulations fixation sequences per trial condition
+          is sampled and shared by all models.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
+      seed: int, seed of the random streams used to generate the artificial
+          data, the fixation sequences and the model simulations. Each model
+          in the grid draws from its own stream, so the log-likelihoods do
+          not depend on the number of workers. If not provided, the streams
+          are seeded with fresh entropy.
+      commonRandomNumbers: boolean, whether all models in the grid simulate
+          their trials from a single bank of numSimulations fixation
+          sequences and noise sequences per trial condition, instead of
+          drawing their own. Only used when histogramMethod is 'simulation'.
     """
-    pool = Pool(numThreads)
-
     # Load experimental data from CSV file.
     if verbose:
         print(u"Loading experimental data...")
@@ -111,7 +133,10 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
             u"addm_toolbox", u"test_data/test_trial_conditions.csv")
     trialConditions = load_trial_conditions_from_csv(trialsFileName)
 
+    dataSeed, schedulesSeed, modelsSeed = spawn_seeds(seed, 3)
+
     # Generate histograms for artificial data.
+    rng = get_generator(dataSeed)
     dataHistLeft = dict()
     dataHistRight = dict()
     model = aDDM(d, sigma, theta)
@@ -122,7 +147,8 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
         while t < numTrials:
             try:
                 trial = model.simulate_trial(
-                    trialCondition[0], trialCondition[1], fixationData)
+                    trialCondition[0], trialCondition[1], fixationData,
+                    rng=rng)
             except:
                 print(u"An exception occurred while generating artificial "
                       "trial " + str(t) + u" for condition " +
@@ -141,21 +167,38 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     if verbose:
         print(u"Done generating histograms of artificial data!")
     
+    fixationSchedules = None
+    randomNumberBank = None
+    if histogramMethod == u"propagation":
+        fixationSchedules = sample_fixation_schedules(
+            fixationData, trialConditions, numSimulations, maxRT,
+            rng=schedulesSeed)
+    elif commonRandomNumbers:
+        randomNumberBank = sample_random_number_bank(
+            fixationData, trialConditions, numSimulations, maxRT,
+            rng=schedulesSeed)
+
     # Grid search on the parameters of the model.
     if verbose:
         print(u"Performing grid search over the model parameters...")
-    listParams = list()
     models = list()
     for d in rangeD:
         for sigma in rangeSigma:
             for theta in rangeTheta:
-                model = aDDM(d, sigma, theta)
-                models.append(model)
-                listParams.append((model, fixationData, trialConditions,
-                                   numSimulations, histBins, dataHistLeft,
-                                   dataHistRight))
-    logLikelihoods = pool.map(wrap_addm_get_model_log_likelihood, listParams)
-    pool.close()
+                models.append(aDDM(d, sigma, theta))
+    modelSeeds = spawn_seeds(modelsSeed, len(models))
+    # The arguments shared by all models are installed in each worker once.
+    modelArgs = (fixationData, trialConditions, numSimulations, histBins,
+                 dataHistLeft, dataHistRight, histogramMethod,
+                 fixationSchedules, randomNumberBank)
+    with WorkerPool(numThreads, threadBudget=threadBudget,
+                    residentData={u"modelArgs": modelArgs}) as pool:
+        if verbose:
+            print(u"Worker layout: " + pool.get_layout_description())
+        logLikelihoods = pool.map(
+            wrap_addm_get_model_log_likelihood,
+            [(pool.poolId, model, modelSeed)
+             for model, modelSeed in zip(models, modelSeeds)])
 
     if verbose:
         for i, model in enumerate(models):
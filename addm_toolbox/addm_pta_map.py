@@ -38,21 +38,27 @@ from __future__ import absolute_import, division
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
+from builtins import range, str, zip
 from datetime import datetime
 from matplotlib.backends.backend_pdf import PdfPages
 
 from .addm import aDDM
+from .ddm import SimulationBatch, concatenate_batches
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
 from .util import (load_trial_conditions_from_csv, load_data_from_csv,
-                   get_empirical_distributions, save_simulations_to_csv,
-                   generate_choice_curves, generate_rt_curves,
-                   convert_item_values)
+                   get_empirical_distributions, generate_choice_curves,
+                   generate_rt_curves, convert_item_values,
+                   SimulationWriter)
 
 
 def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
          expdataFileName=None, fixationsFileName=None, trialsPerSubject=100,
          numSamples=100, numSimulations=800, subjectIds=[], numThreads=9,
-         saveSimulations=False, saveFigures=False, verbose=False):
+         saveSimulations=False, saveFigures=False, verbose=False,
+         backend=u"process", threadBudget=None, seed=None,
+         simulExpdataFileName=None, simulFixationsFileName=None,
+         resumeSimulations=False):
     """
     Args:
       rangeD: list of floats, search range for parameter d.
@@ -71,11 +77,36 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
       subjectIds: list of strings corresponding to the subject ids. If not
           provided, all existing subjects will be used.
       numThreads: int, size of the thread pool.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
       saveSimulations: boolean, whether or not to save simulations to CSV.
       saveFigures: boolean, whether or not save figures comparing choice and RT
           curves for data and simulations.
       verbose: boolean, whether or not to increase output verbosity.
+      seed: int, seed of the random streams used to select the data trials
+          and to generate the posterior simulations (one stream for the
+          posterior samples and one for each simulation task). If not
+          provided, the streams are seeded with fresh entropy.
+      simulExpdataFileName: string, path of the CSV file where simulated
+          trials are saved. If not provided, a name with the current time is
+          used.
+      simulFixationsFileName: string, path of the CSV file where simulated
+          fixations are saved. If not provided, a name with the current time
+          is used.
+      resumeSimulations: boolean, whether to resume saving simulations into
+          existing files left by an interrupted run with the same arguments
+          and seed, instead of overwriting them. Requires a seed, since the
+          saved trials are skipped by regenerating the same streams.
     """
+    if resumeSimulations and seed is None:
+        raise RuntimeError(u"Argument seed must be provided to resume "
+                           "simulations, so that the trials already saved "
+                           "can be reproduced and skipped.")
+
     # Load trial conditions.
     if not trialsFileName:
         trialsFileName = pkg_resources.resource_filename(
@@ -94,8 +125,11 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     data = load_data_from_csv(expdataFileName, fixationsFileName,
                               convertItemValues=convert_item_values)
 
+    subsetSeed, simulationSeed = spawn_seeds(seed, 2)
+
     # Begin posterior estimation using odd trials only.
     # Get correct subset of trials.
+    rng = get_generator(subsetSeed)
     dataTrials = list()
     subjectIds = ([str(subj) for subj in subjectIds] if subjectIds
                   else list(data))
@@ -104,7 +138,7 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
         numTrials = (trialsPerSubject
                      if 1 <= trialsPerSubject <= maxNumTrials
                      else maxNumTrials)
-        trialSet = np.random.choice(
+        trialSet = rng.choice(
             [trialId for trialId in range(len(data[subjectId]))
              if trialId % 2], numTrials, replace=False)
         dataTrials.extend([data[subjectId][t] for t in trialSet])
@@ -124,84 +158,122 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     if verbose:
         print(u"Starting grid search...")
     likelihoods = dict()
-    for model in models:
+    with WorkerPool(numThreads, trials=dataTrials, backend=backend,
+                    threadBudget=threadBudget) as pool:
         if verbose:
-            print(u"Computing likelihoods for model " + str(model.params) +
-                  u"...")
+            print(u"Worker layout: " + pool.get_layout_description())
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+            print(u"Estimated grid runtime: " + str(int(np.ceil(seconds))) +
+                  u" seconds, for " + str(int(totalCost)) + u" state "
+                  "transitions.")
         try:
-            likelihoods[model.params] = model.parallel_get_likelihoods(
-                dataTrials, numThreads=numThreads)
+            gridLikelihoods = pool.get_grid_likelihoods(models)
         except:
             print(u"An exception occurred during the likelihood "
-                  "computations for model " + str(model.params) + u".")
+                  "computations for the model grid.")
             raise
+        for m, model in enumerate(models):
+            likelihoods[model.params] = gridLikelihoods[m, :]
 
-    if verbose:
-        print(u"Finished grid search!")
+        if verbose:
+            print(u"Finished grid search!")
 
-    # Compute posterior distribution over all models.
-    for t in range(len(dataTrials)):
-        # Get the denominator for normalizing the posteriors.
-        denominator = 0
-        for model in models:
-            denominator += (posteriors[model.params] *
-                            likelihoods[model.params][t])
-        if denominator == 0:
-            continue
+        # Compute posterior distribution over all models.
+        for t in range(len(dataTrials)):
+            # Get the denominator for normalizing the posteriors.
+            denominator = 0
+            for model in models:
+                denominator += (posteriors[model.params] *
+                                likelihoods[model.params][t])
+            if denominator == 0:
+                continue
 
-        # Calculate the posteriors after this trial.
-        for model in models:
-            prior = posteriors[model.params]
-            posteriors[model.params] = (likelihoods[model.params][t] * prior /
-                                        denominator)
+            # Calculate the posteriors after this trial.
+            for model in models:
+                prior = posteriors[model.params]
+                posteriors[model.params] = (
+                    likelihoods[model.params][t] * prior / denominator)
 
-    if verbose:
+        if verbose:
+            for model in models:
+                print(u"P" + str(model.params) + u" = " +
+                      str(posteriors[model.params]))
+
+        # Get fixation distributions from even trials.
+        if verbose:
+            print(u"Getting fixation distributions from even trials...")
+        fixationData = get_empirical_distributions(
+            data, subjectIds=subjectIds, useOddTrials=False,
+            useEvenTrials=True, maxFixTime=3000)
+
+        # Get list of posterior distribution values.
+        posteriorsList = list()
         for model in models:
-            print(u"P" + str(model.params) + u" = " +
-                  str(posteriors[model.params]))
+            posteriorsList.append(posteriors[model.params])
 
-    # Get fixation distributions from even trials.
-    if verbose:
-        print(u"Getting fixation distributions from even trials...")
-    fixationData = get_empirical_distributions(
-        data, subjectIds=subjectIds, useOddTrials=False, useEvenTrials=True,
-        maxFixTime=3000)
-
-    # Get list of posterior distribution values.
-    posteriorsList = list()
-    for model in models:
-        posteriorsList.append(posteriors[model.params])
-
-    # Generate probabilistic set of simulations using the posterior
-    # distribution.
-    simulTrials = list()
-    for s in range(numSamples):
-        # Sample model from posteriors distribution.
-        modelIndex = np.random.choice(
-            np.array(list(range(numModels))), p=np.array(posteriorsList))
-        model = models[modelIndex]
-        for (valueLeft, valueRight) in trialConditions:
-            for t in range(numSimulations):
-                try:
-                    simulTrials.append(
-                        model.simulate_trial(valueLeft, valueRight,
-                                             fixationData))
-                except:
-                    print(u"An exception occurred while generating "
-                          "artificial trial " + str(t) + u" for "
-                          "condition (" + str(valueLeft) + u", " +
-                          str(valueRight) + u") and model " +
-                          str(model.params) + u" (sample " + str(s) + u").")
-                    raise
-
-    currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
-
-    if saveSimulations:
-        save_simulations_to_csv(simulTrials,
-                                u"simul_expdata_" + currTime + u".csv",
-                                u"simul_fixations_" + currTime + u".csv")
-
-    if saveFigures:
+        # Generate probabilistic set of simulations using the posterior
+        # distribution. All samples are drawn at once, as the number of
+        # samples of each model; models which were not sampled are skipped.
+        modelSeed, simulationSeed = spawn_seeds(simulationSeed, 2)
+        rng = get_generator(modelSeed)
+        posteriorsArray = np.array(posteriorsList)
+        sampleCounts = rng.multinomial(
+            numSamples, posteriorsArray / np.sum(posteriorsArray))
+        sampledModels = list()
+        modelSimulations = list()
+        for model, count in zip(models, sampleCounts):
+            if count > 0:
+                sampledModels.append(model)
+                modelSimulations.append(int(count) * numSimulations)
+        if verbose:
+            print(u"Sampled " + str(len(sampledModels)) + u" of " +
+                  str(numModels) + u" models.")
+
+        currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
+        writer = None
+        if saveSimulations:
+            if not simulExpdataFileName:
+                simulExpdataFileName = u"simul_expdata_" + currTime + u".csv"
+            if not simulFixationsFileName:
+                simulFixationsFileName = (u"simul_fixations_" + currTime +
+                                          u".csv")
+            writer = SimulationWriter(simulExpdataFileName,
+                                      simulFixationsFileName,
+                                      resume=resumeSimulations)
+            if verbose and writer.numTrials:
+                print(u"Resuming after " + str(writer.numTrials) +
+                      u" saved trials.")
+
+        # Work is split by sampled model, trial condition and chunks of at
+        # most 100 trials, so that a posterior concentrated on a few models
+        # still keeps all workers busy. The chunks, and therefore the seeded
+        # trials, do not depend on the number of workers. Batches are saved
+        # as they arrive; only the per-trial arrays needed for the figures
+        # are kept in memory.
+        curveBatches = list()
+        try:
+            for batch in pool.iter_simulations(
+                    sampledModels, trialConditions, modelSimulations,
+                    fixationData, trialsPerTask=100, seed=simulationSeed,
+                    numSkippedTrials=writer.numTrials if writer else 0):
+                if writer:
+                    writer.write(batch)
+                if saveFigures:
+                    curveBatches.append(SimulationBatch(
+                        batch.RT, batch.choice, batch.valueLeft,
+                        batch.valueRight))
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials.")
+            raise
+        finally:
+            if writer:
+                writer.close()
+
+    if saveFigures and curveBatches:
+        # When resuming, the figures only cover the trials generated in this
+        # run.
+        simulTrials = concatenate_batches(curveBatches)
         pdfPages = PdfPages(u"addm_fit_" + currTime + u".pdf")
         generate_choice_curves(dataTrials, simulTrials, pdfPages)
         generate_rt_curves(dataTrials, simulTrials, pdfPages)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: addm_pta_map_test.py
+
+
+Unit tests for the addm_pta_map.py module.
+"""
+
+from __future__ import absolute_import
+
+import unittest
+
+from .addm_pta_map import main
+
+
+class TestResumeSimulations(unittest.TestCase):
+    def test_resume_requires_seed(self):
+        self.assertRaises(RuntimeError, main, [0.005], [0.07], [0.5],
+                          saveSimulations=True, resumeSimulations=True)
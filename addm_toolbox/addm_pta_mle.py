@@ -29,6 +29,8 @@ from all subjects is pooled such that a single set of optimal parameters is
 estimated (or from a subset of subjects, when provided).
 
 aDDM simulations are generated for the model with maximum estimated likelihood.
+Figures compare the data with the choice and response time distributions
+predicted by that model.
 """
 
 from __future__ import absolute_import, division
@@ -36,21 +38,26 @@ from __future__ import absolute_import, division
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
+from builtins import range, str, zip
 from datetime import datetime
 from matplotlib.backends.backend_pdf import PdfPages
 
 from .addm import aDDM
+from .distributed import Coordinator
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
 from .util import (load_trial_conditions_from_csv, load_data_from_csv,
-                   get_empirical_distributions, save_simulations_to_csv,
+                   get_empirical_distributions, SimulationWriter,
                    generate_choice_curves, generate_rt_curves,
-                   convert_item_values)
+                   convert_item_values, predict_distributions)
 
 
 def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
          expdataFileName=None, fixationsFileName=None, trialsPerSubject=100,
          simulationsPerCondition=800, subjectIds=[], numThreads=9,
-         saveSimulations=False, saveFigures=False, verbose=False):
+         saveSimulations=False, saveFigures=False, verbose=False,
+         coordinatorPort=None, authKey=None, backend=u"process",
+         threadBudget=None, seed=None, coordinatorHost=u"localhost"):
     """
     Args:
       rangeD: list of floats, search range for parameter d.
@@ -62,14 +69,33 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
       trialsPerSubject: int, number of trials from each subject to be used in
           the analysis. If smaller than 1, all trials are used.
       simulationsPerCondition: int, number of simulations to be generated per
-          trial condition.
+          trial condition when saving simulations. Figures are generated from
+          the predicted distributions and do not use simulations.
       subjectIds: list of strings corresponding to the subject ids. If not
           provided, all existing subjects will be used.
       numThreads: int, size of the thread pool.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
       saveSimulations: boolean, whether or not to save simulations to CSV.
       saveFigures: boolean, whether or not save figures comparing choice and RT
           curves for data and simulations.
       verbose: boolean, whether or not to increase output verbosity.
+      coordinatorPort: int, if provided, likelihoods are computed by
+          distributed workers (started with addm_worker) which connect to a
+          coordinator listening on this port, instead of a local worker pool.
+      authKey: string, key shared with the distributed workers. If not
+          provided, a random key is generated and printed.
+      seed: int, seed of the random streams used to select the data trials,
+          to generate the model simulations (one stream for each trial
+          condition) and to sample the fixation sequences of the predicted
+          distributions. If not provided, the streams are seeded with fresh
+          entropy.
+      coordinatorHost: string, address on which the coordinator listens for
+          workers. By default, only workers on the same host can connect.
     """
     # Load trial conditions.
     if not trialsFileName:
@@ -89,8 +115,11 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     data = load_data_from_csv(expdataFileName, fixationsFileName,
                               convertItemValues=convert_item_values)
 
+    subsetSeed, simulationSeed, predictionSeed = spawn_seeds(seed, 3)
+
     # Begin maximum likelihood estimation using odd trials only.
     # Get correct subset of trials.
+    rng = get_generator(subsetSeed)
     dataTrials = list()
     subjectIds = ([str(subj) for subj in subjectIds] if subjectIds
                   else list(data))
@@ -99,7 +128,7 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
         numTrials = (trialsPerSubject
                      if 1 <= trialsPerSubject <= maxNumTrials
                      else maxNumTrials)
-        trialSet = np.random.choice(
+        trialSet = rng.choice(
             [trialId for trialId in range(len(data[subjectId]))
              if trialId % 2], numTrials, replace=False)
         dataTrials.extend([data[subjectId][t] for t in trialSet])
@@ -115,63 +144,78 @@ def main(rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     if verbose:
         print(u"Starting grid search...")
     likelihoods = dict()
-    for model in models:
-        if verbose:
-            print(u"Computing likelihoods for model " + str(model.params) +
-                  u"...")
+    if coordinatorPort:
+        pool = Coordinator(coordinatorHost, coordinatorPort, authKey,
+                           trials=dataTrials, verbose=verbose)
+    else:
+        pool = WorkerPool(numThreads, trials=dataTrials, backend=backend,
+                          threadBudget=threadBudget)
+    with pool:
+        if verbose and not coordinatorPort:
+            print(u"Worker layout: " + pool.get_layout_description())
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+            print(u"Estimated grid runtime: " + str(int(np.ceil(seconds))) +
+                  u" seconds, for " + str(int(totalCost)) + u" state "
+                  "transitions.")
         try:
-            likelihoods[model.params] = model.parallel_get_likelihoods(
-                dataTrials, numThreads=numThreads)
+            gridLikelihoods = pool.get_grid_likelihoods(models)
         except:
             print(u"An exception occurred during the likelihood "
-                  "computations for model " + str(model.params) + u".")
+                  "computations for the model grid.")
             raise
+        for m, model in enumerate(models):
+            likelihoods[model.params] = gridLikelihoods[m, :]
 
-    # Get negative log likelihoods and optimal parameters.
-    NLL = dict()
-    for model in models:
-        NLL[model.params] = - np.sum(np.log(likelihoods[model.params]))
-    optimalParams = min(NLL, key=NLL.get)
+        # Get negative log likelihoods and optimal parameters.
+        NLL = dict()
+        for model in models:
+            NLL[model.params] = - np.sum(np.log(likelihoods[model.params]))
+        optimalParams = min(NLL, key=NLL.get)
 
-    if verbose:
-        print(u"Finished grid search!")
-        print(u"Optimal d: " + str(optimalParams[0]))
-        print(u"Optimal sigma: " + str(optimalParams[1]))
-        print(u"Optimal theta: " + str(optimalParams[2]))
-        print(u"Min NLL: " + str(min(list(NLL.values()))))
-
-    # Get fixation distributions from even trials.
-    if verbose:
-        print(u"Getting fixation distributions from even trials...")
-    fixationData = get_empirical_distributions(
-        data, subjectIds=subjectIds, useOddTrials=False, useEvenTrials=True)
+        if verbose:
+            print(u"Finished grid search!")
+            print(u"Optimal d: " + str(optimalParams[0]))
+            print(u"Optimal sigma: " + str(optimalParams[1]))
+            print(u"Optimal theta: " + str(optimalParams[2]))
+            print(u"Min NLL: " + str(min(list(NLL.values()))))
 
-    # Generate simulations using the even trials fixation distributions and the
-    # estimated parameters.
-    if verbose:
-        print(u"Generating model simulations...")
-    model = aDDM(*optimalParams)
-    simulTrials = list()
-    for (valueLeft, valueRight) in trialConditions:
-        for s in range(simulationsPerCondition):
-            try:
-                simulTrials.append(
-                    model.simulate_trial(valueLeft, valueRight, fixationData))
-            except:
-                print(u"An exception occurred while generating artificial "
-                      "trial " + str(s) + u" for condition (" +
-                      str(valueLeft) + u", " + str(valueRight) + u").")
-                raise
-
-    currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
-
-    if saveSimulations:
-        save_simulations_to_csv(simulTrials,
-                                u"simul_expdata_" + currTime + u".csv",
-                                u"simul_fixations_" + currTime + u".csv")
+        # Get fixation distributions from even trials.
+        if verbose:
+            print(u"Getting fixation distributions from even trials...")
+        fixationData = get_empirical_distributions(
+            data, subjectIds=subjectIds, useOddTrials=False,
+            useEvenTrials=True)
+
+        model = aDDM(*optimalParams)
+        currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
+
+        if saveSimulations:
+            # Generate simulations using the even trials fixation distributions
+            # and the estimated parameters.
+            if verbose:
+                print(u"Generating model simulations...")
+            # Batches are saved as they arrive from the workers.
+            with SimulationWriter(
+                    u"simul_expdata_" + currTime + u".csv",
+                    u"simul_fixations_" + currTime + u".csv") as writer:
+                try:
+                    for batch in pool.iter_simulations(
+                            model, trialConditions, simulationsPerCondition,
+                            fixationData, seed=simulationSeed):
+                        writer.write(batch)
+                except:
+                    print(u"An exception occurred while generating "
+                          "artificial trials.")
+                    raise
 
     if saveFigures:
+        # Compare the data with the choice and RT distributions predicted by
+        # the estimated model, using the even trials fixation distributions.
+        if verbose:
+            print(u"Computing model predictions...")
+        predictions = predict_distributions(model, trialConditions,
+                                            fixationData, rng=predictionSeed)
         pdfPages = PdfPages(u"addm_fit_" + currTime + u".pdf")
-        generate_choice_curves(dataTrials, simulTrials, pdfPages)
-        generate_rt_curves(dataTrials, simulTrials, pdfPages)
+        generate_choice_curves(dataTrials, predictions, pdfPages)
+        generate_rt_curves(dataTrials, predictions, pdfPages)
         pdfPages.close()
@@ -35,16 +35,21 @@ from __future__ import absolute_import, division
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
+from builtins import range, str, zip
 
 from .addm import aDDM
+from .distributed import Coordinator
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
 from .util import (load_trial_conditions_from_csv, load_data_from_csv,
                    get_empirical_distributions, convert_item_values)
 
 
 def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
          expdataFileName=None, fixationsFileName=None, trialsPerCondition=800,
-         subjectIds=[], numThreads=9, verbose=False):
+         subjectIds=[], numThreads=9, verbose=False, coordinatorPort=None,
+         authKey=None, backend=u"process", threadBudget=None, seed=None,
+         coordinatorHost=u"localhost"):
     """
     Args:
       d: float, aDDM parameter for generating artificial data.
@@ -61,7 +66,25 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
       subjectIds: list of strings corresponding to the subject ids. If not
           provided, all existing subjects will be used.
       numThreads: int, size of the thread pool.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
       verbose: boolean, whether or not to increase output verbosity.
+      coordinatorPort: int, if provided, artificial data and likelihoods are
+          computed by distributed workers (started with addm_worker) which
+          connect to a coordinator listening on this port, instead of a local
+          worker pool.
+      authKey: string, key shared with the distributed workers. If not
+          provided, a random key is generated and printed.
+      seed: int, seed of the random streams used to generate the artificial
+          data, one for each trial condition (or, with distributed workers,
+          for each task). If not provided, the streams are seeded with
+          fresh entropy.
+      coordinatorHost: string, address on which the coordinator listens for
+          workers. By default, only workers on the same host can connect.
     """
     # Load trial conditions.
     if not trialsFileName:
@@ -90,17 +113,34 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
     if verbose:
         print(u"Generating artificial data...")
     model = aDDM(d, sigma, theta)
-    trials = list()
-    for (valueLeft, valueRight) in trialConditions:
-        for t in range(trialsPerCondition):
-            try:
-                trials.append(
-                    model.simulate_trial(valueLeft, valueRight, fixationData))
-            except:
-                print(u"An exception occurred while generating artificial "
-                      "trial " + str(t) + u" for condition (" +
-                      str(valueLeft) + u", " + str(valueRight) + u").")
-                raise
+    coordinator = None
+    if coordinatorPort:
+        coordinator = Coordinator(coordinatorHost, coordinatorPort, authKey,
+                                  verbose=verbose)
+        try:
+            trials = coordinator.simulate_trials(
+                model, trialConditions, trialsPerCondition, fixationData,
+                seed=seed).to_trials()
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials on the distributed workers.")
+            coordinator.close()
+            raise
+    else:
+        trials = list()
+        conditionSeeds = spawn_seeds(seed, len(trialConditions))
+        for (valueLeft, valueRight), conditionSeed in zip(trialConditions,
+                                                          conditionSeeds):
+            rng = get_generator(conditionSeed)
+            for t in range(trialsPerCondition):
+                try:
+                    trials.append(model.simulate_trial(
+                        valueLeft, valueRight, fixationData, rng=rng))
+                except:
+                    print(u"An exception occurred while generating "
+                          "artificial trial " + str(t) + u" for condition (" +
+                          str(valueLeft) + u", " + str(valueRight) + u").")
+                    raise
 
     # Get likelihoods for all models and all artificial trials.
     numModels = (len(rangeD) * len(rangeSigma) * len(rangeTheta))
@@ -111,18 +151,31 @@ def main(d, sigma, theta, rangeD, rangeSigma, rangeTheta, trialsFileName=None,
         for sigma in rangeSigma:
             for theta in rangeTheta:
                 model = aDDM(d, sigma, theta)
-                if verbose:
-                    print(u"Computing likelihoods for model " +
-                          str(model.params) + u"...")
-                try:
-                    likelihoods[model.params] = model.parallel_get_likelihoods(
-                        trials, numThreads=numThreads)
-                except:
-                    print(u"An exception occurred during the likelihood "
-                          "computations for model " + str(model.params) + u".")
-                    raise
                 models.append(model)
                 posteriors[model.params] = 1 / numModels
+    if verbose:
+        print(u"Computing likelihoods for " + str(numModels) + u" models...")
+    if coordinator:
+        coordinator.set_trials(trials)
+        pool = coordinator
+    else:
+        pool = WorkerPool(numThreads, trials=trials, backend=backend,
+                          threadBudget=threadBudget)
+    with pool:
+        if verbose and not coordinator:
+            print(u"Worker layout: " + pool.get_layout_description())
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+            print(u"Estimated grid runtime: " + str(int(np.ceil(seconds))) +
+                  u" seconds, for " + str(int(totalCost)) + u" state "
+                  "transitions.")
+        try:
+            gridLikelihoods = pool.get_grid_likelihoods(models)
+        except:
+            print(u"An exception occurred during the likelihood "
+                  "computations for the model grid.")
+            raise
+    for m, model in enumerate(models):
+        likelihoods[model.params] = gridLikelihoods[m, :]
 
     # Compute the posteriors.
     for t in range(len(trials)):
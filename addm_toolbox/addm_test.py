@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: addm_test.py
+
+Unit tests for the addm.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import unittest
+
+from .addm import FixationData, aDDM, aDDMTrial
+from .addm_mla import (aDDM as MLAaDDM, sample_fixation_schedules,
+                       sample_random_number_bank)
+from .ddm import DDM, get_batch_from_trials
+from .ddm_test import assert_same_distribution
+from .rng import get_generator
+
+
+def make_fixation_data():
+    fixations = dict()
+    for fixNumber in range(1, 4):
+        fixations[fixNumber] = np.array([200, 400, 600])
+    return FixationData(
+        probFixLeftFirst=0.7, latencies=np.array([100, 200]),
+        transitions=np.array([20, 40]), fixations=fixations,
+        fixDistType=u"simple")
+
+
+def get_runs(row):
+    """
+    Returns the values and lengths of the runs of equal entries in an array.
+    """
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(row)) + 1])
+    return row[starts], np.diff(np.concatenate([starts, [row.size]]))
+
+
+def make_deterministic_fixation_data(fixDistType):
+    """
+    Builds fixation data where each fixation distribution has a single
+    duration, 100 * fixNumber + valueDiff + 10, so that the distribution used
+    for each sample can be told apart from the sample itself.
+    """
+    fixations = dict()
+    for fixNumber in range(1, 4):
+        fixations[fixNumber] = dict()
+        for valueDiff in range(-3, 4):
+            fixations[fixNumber][valueDiff] = np.array(
+                [100 * fixNumber + valueDiff + 10])
+    return FixationData(
+        probFixLeftFirst=0.5, latencies=np.array([100, 200]),
+        transitions=np.array([20, 40]), fixations=fixations,
+        fixDistType=fixDistType)
+
+
+def make_fixation_dist():
+    timeBins = [100, 200, 300]
+    fixationDist = dict()
+    for fixNumber in range(1, 4):
+        fixationDist[fixNumber] = dict()
+        for valueDiff in range(-3, 4):
+            fixationDist[fixNumber][valueDiff] = {
+                100: 0.2, 200: 0.5 if valueDiff >= 0 else 0.1,
+                300: 0.3 if valueDiff >= 0 else 0.7}
+    return fixationDist, timeBins
+
+
+class TestFixationTables(unittest.TestCase):
+    def test_simple_table(self):
+        fixationData = make_fixation_data()
+        fixTimes, cumProbs = fixationData.get_fixation_table(2, 3)
+
+        np.testing.assert_array_equal([200, 400, 600], fixTimes)
+        self.assertIsNone(cumProbs)
+        self.assertIs(fixTimes, fixationData.get_fixation_table(2, -1)[0])
+
+    def test_table_from_fixation_dist(self):
+        fixationData = make_fixation_data()
+        fixationDist, timeBins = make_fixation_dist()
+        fixTimes, cumProbs = fixationData.get_fixation_table(
+            1, -2, fixationDist, timeBins)
+
+        np.testing.assert_array_equal([100, 200, 300], fixTimes)
+        np.testing.assert_allclose([0.2, 0.3, 1], cumProbs)
+
+    def test_tables_rebuilt_for_new_fixation_dist(self):
+        fixationData = make_fixation_data()
+        fixationDist1, timeBins = make_fixation_dist()
+        fixationDist2, timeBins = make_fixation_dist()
+        fixationDist2[1][0] = {100: 1, 200: 0, 300: 0}
+
+        cumProbs1 = fixationData.get_fixation_table(
+            1, 0, fixationDist1, timeBins)[1]
+        cumProbs2 = fixationData.get_fixation_table(
+            1, 0, fixationDist2, timeBins)[1]
+        np.testing.assert_allclose([0.2, 0.7, 1], cumProbs1)
+        np.testing.assert_allclose([1, 1, 1], cumProbs2)
+
+    def test_sample_from_table(self):
+        fixationData = make_fixation_data()
+        fixTimes = np.array([100, 200, 300])
+        cumProbs = np.array([0.2, 0.7, 1])
+        samples = fixationData.sample_from_table(fixTimes, cumProbs, 20000,
+                                                 rng=1)
+
+        for fixTime, prob in [(100, 0.2), (200, 0.5), (300, 0.3)]:
+            self.assertAlmostEqual(prob, np.mean(samples == fixTime),
+                                   delta=0.02)
+        self.assertIn(fixationData.sample_from_table(fixTimes, cumProbs,
+                                                     rng=2), fixTimes)
+
+    def test_sample_fixation_times_uses_fixation_distributions(self):
+        fixNumbers = np.array([1, 2, 3, 3, 1])
+        fixatedItems = np.array([1, 2, 1, 2, 2])
+        valuesLeft = np.array([3, 3, 0, 1, 2])
+        valuesRight = np.array([1, 1, 2, 1, 2])
+        for fixDistType, valueDiffs in [
+                (u"fixation", np.array([2, -2, -2, 0, 0])),
+                (u"difficulty", np.array([2, 2, 2, 0, 0]))]:
+            fixationData = make_deterministic_fixation_data(fixDistType)
+            fixTimes = fixationData.sample_fixation_times(
+                fixNumbers, fixatedItems, valuesLeft, valuesRight, rng=3)
+
+            np.testing.assert_array_equal(
+                100 * fixNumbers + valueDiffs + 10, fixTimes)
+            for i in range(fixNumbers.size):
+                fixTime = fixationData.sample_fixation_time(
+                    fixNumbers[i], fixatedItems[i], valuesLeft[i],
+                    valuesRight[i], rng=4)
+                self.assertEqual(fixTimes[i], fixTime)
+
+    def test_sample_fixation_times_matches_sample_fixation_time(self):
+        fixationData = make_fixation_data()
+        fixationDist, timeBins = make_fixation_dist()
+        rng = get_generator(5)
+        for fixatedItem, probs in [(1, [0.2, 0.1, 0.7]),
+                                   (2, [0.2, 0.5, 0.3])]:
+            samples1 = np.array([fixationData.sample_fixation_time(
+                2, fixatedItem, 0, 2, fixationDist, timeBins, rng)
+                for _ in range(10000)])
+            samples2 = fixationData.sample_fixation_times(
+                np.full(10000, 2), np.full(10000, fixatedItem),
+                np.full(10000, 0), np.full(10000, 2), fixationDist, timeBins,
+                rng)
+            for fixTime, prob in zip(timeBins, probs):
+                self.assertAlmostEqual(prob, np.mean(samples1 == fixTime),
+                                       delta=0.03)
+                self.assertAlmostEqual(prob, np.mean(samples2 == fixTime),
+                                       delta=0.03)
+
+
+class TestSimulateConditions(unittest.TestCase):
+    def setUp(self):
+        self.fixationData = make_fixation_data()
+        self.model = aDDM(d=0.006, sigma=0.07, theta=0.4, nonDecisionTime=100)
+
+    def simulate_by_trial(self, valueLeft, valueRight, numTrials, seed):
+        rng = get_generator(seed)
+        return get_batch_from_trials(
+            [self.model.simulate_trial(valueLeft, valueRight,
+                                       self.fixationData, rng=rng)
+             for _ in range(numTrials)])
+
+    def test_matches_simulate_trial(self):
+        for (valueLeft, valueRight) in [(3, 1), (2, 2)]:
+            batch = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], self.fixationData, 3000, rng=1)
+            assert_same_distribution(
+                self.simulate_by_trial(valueLeft, valueRight, 1500, 2),
+                batch)
+
+    def test_fixations_cover_response_times(self):
+        batch = self.model.simulate_conditions(
+            [(3, 1), (0, 2)], self.fixationData, 500, rng=3)
+
+        np.testing.assert_array_equal(
+            batch.RT, np.add.reduceat(batch.fixTime, batch.fixOffsets[:-1]))
+        for trial in batch:
+            # A latency, then alternating item fixations and transitions.
+            self.assertEqual(0, trial.fixItem[0])
+            self.assertTrue(np.all(trial.fixItem[2::2] == 0))
+            items = trial.fixItem[1::2]
+            self.assertTrue(np.all(np.diff(items) != 0))
+            self.assertTrue(np.all(np.isin(items, [1, 2])))
+            self.assertGreaterEqual(trial.uninterruptedLastFixTime,
+                                    trial.fixTime[-1])
+
+    def test_bridge_matches_steps(self):
+        for (valueLeft, valueRight) in [(3, 1), (2, 2)]:
+            batch1 = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], self.fixationData, 3000, rng=5)
+            batch2 = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], self.fixationData, 3000, rng=6,
+                simulationMethod=u"bridge")
+            assert_same_distribution(batch1, batch2)
+
+    def test_bridge_fixations_cover_response_times(self):
+        batch = self.model.simulate_conditions(
+            [(3, 1), (0, 2)], self.fixationData, 500, rng=7,
+            simulationMethod=u"bridge")
+
+        np.testing.assert_array_equal(
+            batch.RT, np.add.reduceat(batch.fixTime, batch.fixOffsets[:-1]))
+        self.assertTrue(np.all(np.absolute(
+            batch.fixRDV[batch.fixOffsets[1:] - 1]) >= self.model.barrier))
+
+    def test_seeded_batches_reproducible(self):
+        batch1 = self.model.simulate_conditions(
+            [(1, 2), (2, 1)], self.fixationData, 50, rng=4)
+        batch2 = self.model.simulate_conditions(
+            [(1, 2), (2, 1)], self.fixationData, 50, rng=4)
+
+        np.testing.assert_array_equal(batch1.RT, batch2.RT)
+        np.testing.assert_array_equal(batch1.fixTime, batch2.fixTime)
+        np.testing.assert_array_equal(np.repeat([1, 2], 50),
+                                      batch1.valueLeft)
+
+
+class TestPropagationHistograms(unittest.TestCase):
+    def setUp(self):
+        self.fixationData = make_fixation_data()
+        self.model = MLAaDDM(d=0.006, sigma=0.07, theta=0.4,
+                             nonDecisionTime=100)
+        self.histBins = list(range(0, 1001, 100))
+
+    def test_last_bin_includes_max_rt(self):
+        fixationSchedules = sample_fixation_schedules(
+            self.fixationData, [(3, 1)], 50, 5000, rng=9)[(3, 1)]
+        distribution = aDDM(d=0.006, sigma=0.07, theta=0.4,
+                            nonDecisionTime=100).predict_distribution(
+                                3, 1, fixationSchedules=fixationSchedules,
+                                maxRT=5000)
+        histLeft1, histRight1 = distribution.get_histograms(self.histBins)
+        histLeft2, histRight2 = self.model.get_propagation_histograms(
+            3, 1, self.histBins, fixationSchedules)
+
+        np.testing.assert_allclose(histLeft1, histLeft2)
+        np.testing.assert_allclose(histRight1, histRight2)
+
+    def test_matches_simulation_histograms(self):
+        numSchedules = 1000
+        for (valueLeft, valueRight) in [(3, 1), (2, 2)]:
+            fixationSchedules = sample_fixation_schedules(
+                self.fixationData, [(valueLeft, valueRight)], numSchedules,
+                self.histBins[-1], rng=10)[(valueLeft, valueRight)]
+            batch = aDDM(d=0.006, sigma=0.07, theta=0.4,
+                         nonDecisionTime=100).simulate_conditions(
+                             [(valueLeft, valueRight)], self.fixationData,
+                             20000, rng=11)
+            simulHists = batch.get_histograms(self.histBins)
+            propHists = self.model.get_propagation_histograms(
+                valueLeft, valueRight, self.histBins, fixationSchedules)
+
+            # Both histograms are subject to noise from the fixations.
+            for choice, simulHist, propHist in zip([-1, 1], simulHists,
+                                                   propHists):
+                inRange = ((batch.choice == choice) &
+                           (batch.RT <= self.histBins[-1]))
+                standardError = np.sqrt(
+                    propHist * (1 - propHist) *
+                    (1 / np.count_nonzero(inRange) + 1 / numSchedules))
+                np.testing.assert_array_less(np.absolute(simulHist -
+                                                         propHist),
+                                             4 * standardError + 1e-3)
+
+
+class TestTrialCost(unittest.TestCase):
+    def test_fixations_add_to_cost(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        trial = aDDMTrial(1000, -1, 3, 1, fixItem=np.array([0, 1, 2, 1]),
+                          fixTime=np.array([200, 300, 400, 100]))
+        ddmCost = DDM(d=0.006, sigma=0.07).get_trial_cost(trial)
+
+        self.assertEqual(ddmCost + 21 ** 2 * 4, model.get_trial_cost(trial))
+
+
+class TestRandomNumberBank(unittest.TestCase):
+    def setUp(self):
+        self.fixationData = make_fixation_data()
+        self.trialConditions = [(0, 0), (3, 1)]
+
+    def test_seeded_bank_reproducible(self):
+        bank1 = sample_random_number_bank(
+            self.fixationData, self.trialConditions, 20, 2000, rng=3)
+        bank2 = sample_random_number_bank(
+            self.fixationData, self.trialConditions, 20, 2000, rng=3)
+
+        for trialCondition in self.trialConditions:
+            fixLocations, noise = bank1[trialCondition]
+            self.assertEqual((20, 200), fixLocations.shape)
+            self.assertEqual((20, 200), noise.shape)
+            np.testing.assert_array_equal(fixLocations,
+                                          bank2[trialCondition][0])
+            np.testing.assert_array_equal(noise, bank2[trialCondition][1])
+
+    def test_fixation_sequences_follow_fixation_data(self):
+        bank = sample_random_number_bank(
+            self.fixationData, [(3, 1)], 200, 5000, rng=4)
+        fixLocations = bank[(3, 1)][0]
+
+        firstItems = list()
+        for row in fixLocations:
+            values, lengths = get_runs(row)
+            # A latency, then alternating item fixations and transitions,
+            # with the last one cut off at the end of the bank.
+            self.assertEqual(0, values[0])
+            self.assertIn(lengths[0], [10, 20])
+            items = values[1::2]
+            self.assertTrue(np.all(items > 0))
+            self.assertTrue(np.all(values[2::2] == 0))
+            self.assertTrue(np.all(np.diff(items) != 0))
+            for value, length in zip(values[1:-1], lengths[1:-1]):
+                if value == 0:
+                    self.assertIn(length, [2, 4])
+                else:
+                    self.assertIn(length, [20, 40, 60])
+            firstItems.append(items[0])
+        self.assertAlmostEqual(0.7, np.mean(np.array(firstItems) == 1),
+                               delta=0.1)
+
+    def test_same_bank_same_histograms(self):
+        bank = sample_random_number_bank(
+            self.fixationData, self.trialConditions, 200, 5000, rng=5)
+        model = MLAaDDM(d=0.006, sigma=0.07, theta=0.4, nonDecisionTime=100)
+        histBins = list(range(0, 5001, 100))
+
+        for (valueLeft, valueRight) in self.trialConditions:
+            fixLocations, noise = bank[(valueLeft, valueRight)]
+            hists1 = model.get_bank_histograms(
+                valueLeft, valueRight, histBins, fixLocations, noise)
+            hists2 = model.get_bank_histograms(
+                valueLeft, valueRight, histBins, fixLocations, noise)
+            np.testing.assert_array_equal(hists1[0], hists2[0])
+            np.testing.assert_array_equal(hists1[1], hists2[1])
+            # No decisions are made during the non-decision time.
+            self.assertEqual(0, hists1[0][0] + hists1[1][0])
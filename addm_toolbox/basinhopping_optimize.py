@@ -38,51 +38,19 @@ from builtins import range, str
 from scipy.optimize import basinhopping
 
 from .addm import aDDM
+from .parallel import NLLEvaluator, WorkerPool
+from .rng import get_generator, spawn_seeds
+from .surrogate import NLLSurrogate
 from .util import load_data_from_csv, convert_item_values
 
 
-# Global variables.
-dataTrials = []
-
-
-def get_model_nll(params):
-    """
-    Computes the negative log likelihood of the global data set given the
-    parameters of the aDDM.
-    Args:
-      params: list containing the 3 model parameters, in the following order:
-          d, theta, sigma.
-    Returns:
-      The negative log likelihood for the global data set and the given model.
-    """
-    d = params[0]
-    sigma = params[1]
-    theta = params[2]
-    model = aDDM(d, sigma, theta) 
-
-    logLikelihood = 0
-    for trial in dataTrials:
-        try:
-            likelihood = model.get_trial_likelihood(trial)
-        except:
-            print(u"An exception occurred during the likelihood " +
-                  "computations for model " + str(model.params) + u".")
-            raise
-        if likelihood != 0:
-            logLikelihood += np.log(likelihood)
-
-    print(u"NLL for " + str(params) + u": " + str(-logLikelihood))
-    if logLikelihood != 0:
-        return -logLikelihood
-    else:
-        return float("inf")
-
-
 def main(initialD, initialSigma, initialTheta, lowerBoundD=0.0001,
          upperBoundD=0.09, lowerBoundSigma=0.001, upperBoundSigma=0.9,
          lowerBoundTheta=0, upperBoundTheta=1, expdataFileName=None,
          fixationsFileName=None, trialsPerSubject=100, numIterations=100,
-         stepSize=0.001, subjectIds=[], verbose=False):
+         stepSize=0.001, subjectIds=[], verbose=False, useSurrogate=False,
+         numDesignPoints=30, numRefinements=10, numThreads=9,
+         threadBudget=None, seed=None):
     """
     Args:
       initialD: float, initial value for parameter d.
@@ -104,9 +72,22 @@ def main(initialD, initialSigma, initialTheta, lowerBoundD=0.0001,
       subjectIds: list of strings corresponding to the subject ids. If not
           provided, all existing subjects will be used.
       verbose: boolean, whether or not to increase output verbosity.
+      useSurrogate: boolean, whether or not to run the basin hopping algorithm
+          on a surrogate of the NLL surface. The true NLL is then only
+          computed on the surrogate design points, during refinement, and to
+          confirm the optimization result.
+      numDesignPoints: int, number of points in the initial surrogate design.
+      numRefinements: int, number of surrogate refinement iterations near its
+          minima.
+      numThreads: int, size of the worker pool used to compute the NLL.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
+      seed: int, seed of the random streams used to select the data trials
+          and to place the surrogate design and refinement points. If not
+          provided, the streams are seeded with fresh entropy.
     """
-    global dataTrials
-
     # Load experimental data from CSV file.
     if verbose:
         print(u"Loading experimental data...")
@@ -119,13 +100,17 @@ def main(initialD, initialSigma, initialTheta, lowerBoundD=0.0001,
     data = load_data_from_csv(expdataFileName, fixationsFileName,
                               convertItemValues=convert_item_values)
 
+    subsetSeed, surrogateSeed = spawn_seeds(seed, 2)
+
     # Get correct subset of trials.
+    rng = get_generator(subsetSeed)
+    dataTrials = list()
     subjectIds = ([str(subj) for subj in subjectIds] if subjectIds
                   else list(data))
     for subjectId in subjectIds:
         numTrials = (trialsPerSubject if trialsPerSubject >= 1
                      else len(data[subjectId]))
-        trialSet = np.random.choice(
+        trialSet = rng.choice(
             [trialId for trialId in range(len(data[subjectId]))],
             numTrials, replace=False)
         dataTrials.extend([data[subjectId][t] for t in trialSet])
@@ -139,9 +124,36 @@ def main(initialD, initialSigma, initialTheta, lowerBoundD=0.0001,
               (lowerBoundTheta, upperBoundTheta)
              ]
 
-    # Optimize using Basinhopping algorithm.
-    minimizerKwargs = dict(method=u"L-BFGS-B", bounds=bounds)
-    result = basinhopping(
-        get_model_nll, initialParams, minimizer_kwargs=minimizerKwargs,
-        niter=numIterations,stepsize=stepSize)
-    print(u"Optimization result: " + str(result))
+    # The NLL is computed in parallel over the data trials, which are
+    # installed in each worker once. Repeated parameters are served from
+    # cache.
+    with WorkerPool(numThreads, trials=dataTrials,
+                    threadBudget=threadBudget) as pool:
+        if verbose:
+            print(u"Worker layout: " + pool.get_layout_description())
+        getModelNLL = NLLEvaluator(pool, aDDM)
+
+        objective = getModelNLL
+        if useSurrogate:
+            surrogate = NLLSurrogate(getModelNLL, bounds, verbose=verbose)
+            surrogateRng = get_generator(surrogateSeed)
+            surrogate.build_design(numDesignPoints, rng=surrogateRng)
+            surrogate.refine(numRefinements, rng=surrogateRng)
+            objective = surrogate
+
+        # Optimize using Basinhopping algorithm.
+        minimizerKwargs = dict(method=u"L-BFGS-B", bounds=bounds)
+        result = basinhopping(
+            objective, initialParams, minimizer_kwargs=minimizerKwargs,
+            niter=numIterations,stepsize=stepSize)
+        print(u"Optimization result: " + str(result))
+
+        if useSurrogate:
+            trueNLL = surrogate.confirm(list(result.x))
+            print(u"True NLL at surrogate optimum: " + str(trueNLL))
+            bestParams, bestNLL = surrogate.get_best_point()
+            print(u"Best evaluated parameters: " + str(bestParams) +
+                  u", with NLL " + str(bestNLL))
+
+    if verbose:
+        print(getModelNLL.get_summary())
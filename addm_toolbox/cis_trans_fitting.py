@@ -27,8 +27,8 @@ Maximum likelihood estimation procedure for the attentional drift-diffusion
 model (aDDM), specific for perceptual decisions, allowing for analysis of cis
 trials or trans trials exclusively. A grid search is performed over the 3 free
 parameters of the model. Data from all subjects is pooled such that a single
-set of optimal parameters is estimated. aDDM simulations are generated for the
-model estimated.
+set of optimal parameters is estimated. aDDM simulations and predicted choice
+and response time distributions are generated for the model estimated.
 """
 
 from __future__ import absolute_import, division
@@ -36,21 +36,25 @@ from __future__ import absolute_import, division
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
+from builtins import range, str, zip
 from datetime import datetime
-from multiprocessing import Pool
+from matplotlib.backends.backend_pdf import PdfPages
 
 from .addm import aDDM
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
 from .util import (load_data_from_csv, get_empirical_distributions,
-                   save_simulations_to_csv, generate_choice_curves,
-                   generate_rt_curves, convert_item_values)
+                   SimulationWriter, generate_choice_curves,
+                   generate_rt_curves, convert_item_values,
+                   predict_distributions)
 
 
 def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
          fixationsFileName=None, trialsPerSubject=100,
          simulationsPerCondition=400, subjectIds=[], numThreads=9,
          useCisTrials=True, useTransTrials=True, saveSimulations=False,
-         saveFigures=False, verbose=False):
+         saveFigures=False, verbose=False, backend=u"process",
+         threadBudget=None, seed=None):
     """
     Args:
       rangeD: list of floats, search range for parameter d.
@@ -61,10 +65,17 @@ def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
       trialsPerSubject: int, number of trials from each subject to be used in
           the analysis. If smaller than 1, all trials are used.
       simulationsPerCondition: int, number of siulations to be generated per
-          trial condition.
+          trial condition when saving simulations. Figures are generated from
+          the predicted distributions and do not use simulations.
       subjectIds: list of strings corresponding to the subject ids. If not
           provided, all existing subjects will be used.
       numThreads: int, size of the thread pool.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
       useCisTrials: boolean, whether or not to use cis trials in the analysis.
       useTransTrials: boolean, whether or not to use trans trials in the
           analysis.
@@ -72,6 +83,11 @@ def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
       saveFigures: boolean, whether or not save figures comparing choice and RT
           curves for data and simulations.
       verbose: boolean, whether or not to increase output verbosity.
+      seed: int, seed of the random streams used to select the data trials,
+          to generate the model simulations (one stream for each trial
+          condition) and to sample the fixation sequences of the predicted
+          distributions. If not provided, the streams are seeded with fresh
+          entropy.
     """
     # Load experimental data from CSV file.
     if verbose:
@@ -85,8 +101,11 @@ def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
     data = load_data_from_csv(expdataFileName, fixationsFileName,
                               convertItemValues=convert_item_values)
 
+    subsetSeed, simulationSeed, predictionSeed = spawn_seeds(seed, 3)
+
     # Begin maximum likelihood estimation using odd trials only.
     # Get correct subset of trials.
+    rng = get_generator(subsetSeed)
     dataTrials = list()
     subjectIds = ([str(subj) for subj in subjectIds] if subjectIds
                   else list(data))
@@ -98,16 +117,16 @@ def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
         isTransTrial = [True if trial.valueLeft * trial.valueRight <= 0
                         else False for trial in data[subjectId]]
         if useCisTrials and useTransTrials:
-            trialSet = np.random.choice(
+            trialSet = rng.choice(
                 [trialId for trialId in list(range(len(data[subjectId])))
                  if trialId % 2], numTrials, replace=False)
         elif useCisTrials and not useTransTrials:
-            trialSet = np.random.choice(
+            trialSet = rng.choice(
                 [trialId for trialId in list(range(len(data[subjectId])))
                  if trialId % 2 and isCisTrial[trialId]], numTrials,
                 replace=False)
         elif not useCisTrials and useTransTrials:
-            trialSet = np.random.choice(
+            trialSet = rng.choice(
                 [trialId for trialId in list(range(len(data[subjectId])))
                  if trialId % 2 and isTransTrial[trialId]], numTrials,
                 replace=False)
@@ -126,71 +145,83 @@ def main(rangeD, rangeSigma, rangeTheta, expdataFileName=None,
     if verbose:
         print(u"Starting grid search...")
     likelihoods = dict()
-    for model in models:
+    with WorkerPool(numThreads, trials=dataTrials, backend=backend,
+                    threadBudget=threadBudget) as pool:
         if verbose:
-            print(u"Computing likelihoods for model " + str(model.params) +
-                  u"...")
+            print(u"Worker layout: " + pool.get_layout_description())
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+            print(u"Estimated grid runtime: " + str(int(np.ceil(seconds))) +
+                  u" seconds, for " + str(int(totalCost)) + u" state "
+                  "transitions.")
         try:
-            likelihoods[model.params] = model.parallel_get_likelihoods(
-                dataTrials, numThreads=numThreads)
+            gridLikelihoods = pool.get_grid_likelihoods(models)
         except:
             print(u"An exception occurred during the likelihood "
-                  "computations for model " + str(model.params) + u".")
+                  "computations for the model grid.")
             raise
+        for m, model in enumerate(models):
+            likelihoods[model.params] = gridLikelihoods[m, :]
 
-    # Get negative log likelihoods and optimal parameters.
-    NLL = dict()
-    for model in models:
-        NLL[model.params] = - np.sum(np.log(likelihoods[model.params]))
-    optimalParams = min(NLL, key=NLL.get)
+        # Get negative log likelihoods and optimal parameters.
+        NLL = dict()
+        for model in models:
+            NLL[model.params] = - np.sum(np.log(likelihoods[model.params]))
+        optimalParams = min(NLL, key=NLL.get)
 
-    if verbose:
-        print(u"Finished grid search!")
-        print(u"Optimal d: " + str(optimalParams[0]))
-        print(u"Optimal sigma: " + str(optimalParams[1]))
-        print(u"Optimal theta: " + str(optimalParams[2]))
-        print(u"Min NLL: " + str(min(list(NLL.values()))))
+        if verbose:
+            print(u"Finished grid search!")
+            print(u"Optimal d: " + str(optimalParams[0]))
+            print(u"Optimal sigma: " + str(optimalParams[1]))
+            print(u"Optimal theta: " + str(optimalParams[2]))
+            print(u"Min NLL: " + str(min(list(NLL.values()))))
 
-    # Get fixation distributions from even trials.
-    if verbose:
-        print(u"Getting fixation distributions from even trials...")
-    fixationData = get_empirical_distributions(
-        data, subjectIds=subjectIds, useOddTrials=False, useEvenTrials=True,
-        useCisTrials=useCisTrials, useTransTrials=useTransTrials)
-
-    # Generate simulations using the even trials fixation distributions and the
-    # estimated parameters.
-    model = aDDM(*optimalParams)
-    simulTrials = []
-    orientations = list(range(-15,20,5))
-    for orLeft in orientations:
-        for orRight in orientations:
-            if (orLeft == orRight or
-                (not useCisTrials and orLeft * orRight > 0) or
-                (not useTransTrials and orLeft * orRight < 0)):
-                continue
-            valueLeft = np.absolute((np.absolute(orLeft) - 15) / 5)
-            valueRight = np.absolute((np.absolute(orRight) - 15) / 5)
-            for s in range(simulationsPerCondition):
+        # Get fixation distributions from even trials.
+        if verbose:
+            print(u"Getting fixation distributions from even trials...")
+        fixationData = get_empirical_distributions(
+            data, subjectIds=subjectIds, useOddTrials=False,
+            useEvenTrials=True, useCisTrials=useCisTrials,
+            useTransTrials=useTransTrials)
+
+        # Get the trial conditions used in perceptual decisions.
+        trialConditions = list()
+        orientations = list(range(-15,20,5))
+        for orLeft in orientations:
+            for orRight in orientations:
+                if (orLeft == orRight or
+                    (not useCisTrials and orLeft * orRight > 0) or
+                    (not useTransTrials and orLeft * orRight < 0)):
+                    continue
+                valueLeft = np.absolute((np.absolute(orLeft) - 15) / 5)
+                valueRight = np.absolute((np.absolute(orRight) - 15) / 5)
+                trialConditions.append((valueLeft, valueRight))
+
+        model = aDDM(*optimalParams)
+        currTime = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+
+        if saveSimulations:
+            # Generate simulations using the even trials fixation distributions
+            # and the estimated parameters.
+            # Batches are saved as they arrive from the workers.
+            with SimulationWriter(
+                    u"simul_expdata_" + currTime + u".csv",
+                    u"simul_fixations_" + currTime + u".csv") as writer:
                 try:
-                    simulTrials.append(
-                        model.simulate_trial(valueLeft, valueRight,
-                                             fixationData))
+                    for batch in pool.iter_simulations(
+                            model, trialConditions, simulationsPerCondition,
+                            fixationData, seed=simulationSeed):
+                        writer.write(batch)
                 except:
                     print(u"An exception occurred while generating "
-                          "artificial trial " + str(s) + u" for condition (" +
-                          str(valueLeft) + u", " + str(valueRight) + u").")
+                          "artificial trials.")
                     raise
 
-    currTime = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-
-    if saveSimulations:
-        save_simulations_to_csv(simulTrials,
-                                u"simul_expdata_" + currTime + u".csv",
-                                u"simul_fixations_" + currTime + u".csv")
-
     if saveFigures:
+        # Compare the data with the choice and RT distributions predicted by
+        # the estimated model.
+        predictions = predict_distributions(model, trialConditions,
+                                            fixationData, rng=predictionSeed)
         pdfPages = PdfPages(u"addm_fit_" + currTime + u".pdf")
-        generate_choice_curves(dataTrials, simulTrials, pdfPages)
-        generate_rt_curves(dataTrials, simulTrials, pdfPages)
+        generate_choice_curves(dataTrials, predictions, pdfPages)
+        generate_rt_curves(dataTrials, predictions, pdfPages)
         pdfPages.close()
@@ -29,15 +29,25 @@ Ratcliff et al. (1998).
 
 from __future__ import absolute_import, division
 
+import math
 import matplotlib.pyplot as plt
 import numpy as np
 
 from builtins import range, str, zip
 from datetime import datetime
 from matplotlib.backends.backend_pdf import PdfPages
-from multiprocessing import Pool
 from scipy.stats import norm
 
+from .parallel import WorkerPool
+from .rng import get_generator
+
+
+# Shift applied to the barriers when crossings are detected continuously, so
+# that the results match those of a random walk which is only checked at the
+# end of each time step (Broadie, Glasserman & Kou, 1997). The constant is
+# -zeta(1/2) / sqrt(2 * pi), in units of the noise standard deviation.
+BARRIER_SHIFT = 0.5826
+
 
 class DDMTrial(object):
     def __init__(self, RT, choice, valueLeft, valueRight):
@@ -54,6 +64,279 @@ class DDMTrial(object):
         self.valueRight = valueRight
 
 
+class ChoiceRTDistribution(object):
+    def __init__(self, valueLeft, valueRight, timeStep, probLeft, probRight):
+        """
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          timeStep: integer, value in milliseconds used for binning the time
+              axis. Entry t of the probability arrays corresponds to a
+              response time of t * timeStep milliseconds.
+          probLeft: numpy array where each entry is the probability of
+              choosing the left item at the corresponding time step.
+          probRight: numpy array where each entry is the probability of
+              choosing the right item at the corresponding time step.
+        """
+        self.valueLeft = valueLeft
+        self.valueRight = valueRight
+        self.timeStep = timeStep
+        self.probLeft = probLeft
+        self.probRight = probRight
+        self.RTs = timeStep * np.arange(probLeft.size)
+
+
+    def get_prob_undecided(self):
+        """
+        Returns:
+          The probability that no decision is reached within the time span
+              covered by the distribution.
+        """
+        return max(0, 1 - np.sum(self.probLeft) - np.sum(self.probRight))
+
+
+    def get_choice_probability(self):
+        """
+        Returns:
+          The probability of choosing the left item, conditioned on a decision
+              being reached.
+        """
+        return np.sum(self.probLeft) / (np.sum(self.probLeft) +
+                                        np.sum(self.probRight))
+
+
+    def get_mean_rt(self):
+        """
+        Returns:
+          The mean response time in milliseconds, conditioned on a decision
+              being reached.
+        """
+        probRT = self.probLeft + self.probRight
+        return np.dot(self.RTs, probRT) / np.sum(probRT)
+
+
+    def get_histograms(self, histBins):
+        """
+        Obtains the response time histograms conditioned on choice, with the
+        same binning and normalization used for simulated response times in
+        the maximum likelihood algorithm (MLA).
+        Args:
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+        Returns:
+          A tuple (histLeft, histRight) of numpy arrays, corresponding to the
+          probability of each time bin conditioned on left choice and on right
+          choice, respectively.
+        """
+        histLeft = np.histogram(self.RTs, bins=histBins,
+                                weights=self.probLeft)[0]
+        if np.sum(histLeft) != 0:
+            histLeft = histLeft / np.sum(histLeft)
+        histRight = np.histogram(self.RTs, bins=histBins,
+                                 weights=self.probRight)[0]
+        if np.sum(histRight) != 0:
+            histRight = histRight / np.sum(histRight)
+        return histLeft, histRight
+
+
+class SimulationBatch(object):
+    def __init__(self, RT, choice, valueLeft, valueRight, fixOffsets=None,
+                 fixItem=None, fixTime=None, fixRDV=None,
+                 uninterruptedLastFixTime=None):
+        """
+        Array-backed set of simulated trials. Entry i of each per-trial array
+        corresponds to trial i. Fixations, which are only present for aDDM
+        simulations, are stored back to back for all trials: the fixations of
+        trial i are entries fixOffsets[i] to fixOffsets[i + 1] - 1 of the
+        fixation arrays.
+        A batch can also be used as a sequence of trials: indexing it with an
+        integer returns a trial object whose fixation fields are views into
+        the batch arrays, iterating over it yields one such trial at a time,
+        and indexing it with a slice, an index array or a boolean mask
+        returns a smaller batch.
+        Args:
+          RT: numpy array of response times in milliseconds.
+          choice: numpy array where each entry is either -1 (for left item) or
+              +1 (for right item).
+          valueLeft: numpy array with the values of the left items.
+          valueRight: numpy array with the values of the right items.
+          fixOffsets: numpy array with one entry per trial plus one, with the
+              position of the first fixation of each trial in the fixation
+              arrays.
+          fixItem: numpy array of fixated items, with the same coding used in
+              aDDMTrial.
+          fixTime: numpy array of fixation durations in milliseconds.
+          fixRDV: numpy array of RDV values at the end of each fixation.
+          uninterruptedLastFixTime: numpy array with the duration that the
+              last fixation of each trial would have if it had not been
+              interrupted when a decision was made.
+        """
+        self.RT = RT
+        self.choice = choice
+        self.valueLeft = valueLeft
+        self.valueRight = valueRight
+        self.fixOffsets = fixOffsets
+        self.fixItem = fixItem
+        self.fixTime = fixTime
+        self.fixRDV = fixRDV
+        self.uninterruptedLastFixTime = uninterruptedLastFixTime
+
+
+    def __len__(self):
+        return self.RT.size
+
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError(u"Trial index out of range.")
+            return self.get_trial(index)
+        return self.select(index)
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get_trial(i)
+
+
+    def get_trial(self, index):
+        """
+        Args:
+          index: integer, index of the trial in the batch.
+        Returns:
+          A DDMTrial object, or an aDDMTrial object if the batch has
+              fixations. The fixation fields are views into the batch arrays.
+        """
+        if self.fixOffsets is None:
+            return DDMTrial(self.RT[index], self.choice[index],
+                            self.valueLeft[index], self.valueRight[index])
+        # Imported here, since the addm module depends on this one.
+        from .addm import aDDMTrial
+        start = self.fixOffsets[index]
+        end = self.fixOffsets[index + 1]
+        return aDDMTrial(self.RT[index], self.choice[index],
+                         self.valueLeft[index], self.valueRight[index],
+                         self.fixItem[start:end], self.fixTime[start:end],
+                         self.fixRDV[start:end],
+                         self.uninterruptedLastFixTime[index])
+
+
+    def to_trials(self):
+        """
+        Returns:
+          A list of DDMTrial or aDDMTrial objects, one for each trial in the
+              batch.
+        """
+        return [self.get_trial(i) for i in range(len(self))]
+
+
+    def select(self, indices):
+        """
+        Args:
+          indices: a slice, a numpy array of trial indices or a boolean mask
+              over the trials in the batch.
+        Returns:
+          A SimulationBatch object with the selected trials, in the given
+              order.
+        """
+        indices = np.arange(len(self))[indices]
+        RT = self.RT[indices]
+        choice = self.choice[indices]
+        valueLeft = self.valueLeft[indices]
+        valueRight = self.valueRight[indices]
+        if self.fixOffsets is None:
+            return SimulationBatch(RT, choice, valueLeft, valueRight)
+
+        # Gather the fixation rows of the selected trials, trial by trial.
+        starts = self.fixOffsets[indices]
+        counts = self.fixOffsets[indices + 1] - starts
+        fixOffsets = np.concatenate([[0], np.cumsum(counts)])
+        rows = (np.repeat(starts - fixOffsets[:-1], counts) +
+                np.arange(fixOffsets[-1]))
+        return SimulationBatch(
+            RT, choice, valueLeft, valueRight, fixOffsets,
+            self.fixItem[rows], self.fixTime[rows], self.fixRDV[rows],
+            self.uninterruptedLastFixTime[indices])
+
+
+    def get_histograms(self, histBins):
+        """
+        Obtains the response time histograms conditioned on choice, with the
+        normalization used in the maximum likelihood algorithm (MLA).
+        Args:
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+        Returns:
+          A tuple (histLeft, histRight) of numpy arrays, corresponding to the
+          fraction of the trials with left choice and of the trials with
+          right choice, respectively, which fall in each time bin.
+        """
+        histLeft = np.histogram(self.RT[self.choice == -1], bins=histBins)[0]
+        if np.sum(histLeft) != 0:
+            histLeft = histLeft / np.sum(histLeft)
+        histRight = np.histogram(self.RT[self.choice == 1], bins=histBins)[0]
+        if np.sum(histRight) != 0:
+            histRight = histRight / np.sum(histRight)
+        return histLeft, histRight
+
+
+def concatenate_batches(batches):
+    """
+    Joins several simulation batches into one, keeping the order of the
+    trials.
+    Args:
+      batches: non-empty list of SimulationBatch objects, either all with or
+          all without fixations.
+    Returns:
+      A SimulationBatch object.
+    """
+    RT = np.concatenate([batch.RT for batch in batches])
+    choice = np.concatenate([batch.choice for batch in batches])
+    valueLeft = np.concatenate([batch.valueLeft for batch in batches])
+    valueRight = np.concatenate([batch.valueRight for batch in batches])
+    if batches[0].fixOffsets is None:
+        return SimulationBatch(RT, choice, valueLeft, valueRight)
+
+    # Shift the fixation offsets of each batch by the number of fixations in
+    # the batches before it.
+    fixCounts = np.cumsum([0] + [batch.fixOffsets[-1] for batch in batches])
+    fixOffsets = np.concatenate(
+        [[0]] + [batch.fixOffsets[1:] + fixCount
+                 for batch, fixCount in zip(batches, fixCounts)])
+    return SimulationBatch(
+        RT, choice, valueLeft, valueRight, fixOffsets,
+        np.concatenate([batch.fixItem for batch in batches]),
+        np.concatenate([batch.fixTime for batch in batches]),
+        np.concatenate([batch.fixRDV for batch in batches]),
+        np.concatenate([batch.uninterruptedLastFixTime
+                        for batch in batches]))
+
+
+def get_batch_from_trials(trials):
+    """
+    Packs a list of trials into a simulation batch.
+    Args:
+      trials: non-empty list of DDMTrial objects, or of aDDMTrial objects.
+    Returns:
+      A SimulationBatch object.
+    """
+    RT = np.array([trial.RT for trial in trials])
+    choice = np.array([trial.choice for trial in trials])
+    valueLeft = np.array([trial.valueLeft for trial in trials])
+    valueRight = np.array([trial.valueRight for trial in trials])
+    if not hasattr(trials[0], u"fixItem"):
+        return SimulationBatch(RT, choice, valueLeft, valueRight)
+    fixOffsets = np.cumsum([0] + [len(trial.fixItem) for trial in trials])
+    return SimulationBatch(
+        RT, choice, valueLeft, valueRight, fixOffsets,
+        np.concatenate([trial.fixItem for trial in trials]),
+        np.concatenate([trial.fixTime for trial in trials]),
+        np.concatenate([trial.fixRDV for trial in trials]),
+        np.array([trial.uninterruptedLastFixTime for trial in trials]))
+
+
 def unwrap_ddm_get_trial_likelihood(arg, **kwarg):
     """
     Wrapper for DDM.get_trial_likelihood(), intended for parallel computation
@@ -67,6 +350,47 @@ def unwrap_ddm_get_trial_likelihood(arg, **kwarg):
     return DDM.get_trial_likelihood(*arg, **kwarg)
 
 
+def get_bridge_crossing_probability(startRDV, endRDV, variance, barrier):
+    """
+    Computes the probability that a Brownian bridge, i.e. a Brownian motion
+    conditioned on its start and end points, touches one of the barriers
+    +barrier or -barrier. The drift of the motion does not change this
+    probability. Uses the method of images, summing enough image pairs for
+    the series to converge.
+    Args:
+      startRDV: number or numpy array, value of the RDV at the start.
+      endRDV: number or numpy array, value of the RDV at the end.
+      variance: positive number or numpy array, variance of the motion over
+          the whole interval (i.e. sigma ** 2 times the number of steps).
+      barrier: positive number, magnitude of the barriers.
+    Returns:
+      A float or numpy array with the crossing probabilities. If one of the
+          end points lies on or beyond a barrier, the probability is 1.
+    """
+    isArray = (isinstance(startRDV, np.ndarray) or
+               isinstance(endRDV, np.ndarray))
+    if not isArray and (abs(startRDV) >= barrier or abs(endRDV) >= barrier):
+        return 1
+    # Single values are much faster to handle with the math module.
+    exp = np.exp if isArray else math.exp
+    width = 2 * barrier
+    maxVariance = np.max(variance) if isArray else variance
+    numImages = 1 + int(3 * math.sqrt(maxVariance) / width)
+    diff = endRDV - startRDV
+    probStay = 0
+    for k in range(-numImages, numImages + 1):
+        probStay = probStay + exp(
+            -((diff - 2 * k * width) ** 2 - diff ** 2) / (2 * variance))
+        probStay = probStay - exp(
+            -((endRDV + startRDV - 2 * barrier - 2 * k * width) ** 2 -
+              diff ** 2) / (2 * variance))
+    if not isArray:
+        return 1 - min(max(probStay, 0), 1)
+    inside = ((np.absolute(startRDV) < barrier) &
+              (np.absolute(endRDV) < barrier))
+    return np.where(inside, 1 - np.clip(probStay, 0, 1), 1)
+
+
 class DDM(object):
     """
     Implementation of the traditional drift-diffusion model (DDM), as described
@@ -97,6 +421,89 @@ class DDM(object):
         self.nonDecisionTime = nonDecisionTime
         self.bias = bias
         self.params = (d, sigma)
+        self._transitionTables = dict()
+        self._firstPassageTables = dict()
+
+
+    def __getstate__(self):
+        # The transition and first-passage tables are cheap to rebuild, so
+        # they are not sent along with the model when it is pickled for a
+        # worker process.
+        state = self.__dict__.copy()
+        state[u"_transitionTables"] = dict()
+        state[u"_firstPassageTables"] = dict()
+        return state
+
+
+    def get_transition_tables(self, mean, states, stateStep, barrierUp,
+                              barrierDown):
+        """
+        Obtains the transition kernel and the barrier crossing probabilities
+        for a given drift. These depend only on the drift, on sigma, on the
+        state grid and on the barriers, so they are computed once and cached
+        in the model, where they are shared by all trials evaluated with it.
+        Args:
+          mean: float, mean of the normal distribution used to model changes
+              in the RDV.
+          states: numpy array with the values of the RDV states.
+          stateStep: float, distance between consecutive RDV states.
+          barrierUp: numpy array with size T, where T is the number of time
+              steps, containing the value of the up barrier at each time step.
+          barrierDown: same as barrierUp, but for the down barrier.
+        Returns:
+          A tuple (transitionMatrix, probUpCrossing, probDownCrossing).
+          transitionMatrix is a numpy array with size S x S, where S is the
+          number of states, such that transitionMatrix[B, A] is the
+          probability of changing from state A to state B, multiplied by the
+          state step. probUpCrossing and probDownCrossing are numpy arrays with
+          size S x T, where each value is the probability of crossing the
+          corresponding barrier at that time step from that state. When the
+          barriers are constant, these are read-only views of a single column.
+        """
+        numTimeSteps = barrierUp.size
+        constantBarriers = bool(np.all(barrierUp == barrierUp[0]) and
+                                np.all(barrierDown == barrierDown[0]))
+        key = (mean, self.sigma, stateStep, states.size, barrierUp[0],
+               barrierDown[0], constantBarriers)
+        tables = self._transitionTables.get(key, None)
+        if tables is not None and not constantBarriers:
+            # Collapsing barriers: the cached tables can only be used if they
+            # were computed for the same barriers over at least as many time
+            # steps.
+            cachedUp, cachedDown = tables[3:]
+            if (cachedUp.size < numTimeSteps or
+                not np.array_equal(cachedUp[:numTimeSteps], barrierUp) or
+                not np.array_equal(cachedDown[:numTimeSteps], barrierDown)):
+                tables = None
+        if tables is None:
+            changeMatrix = np.subtract(states.reshape(states.size, 1), states)
+            transitionMatrix = stateStep * norm.pdf(changeMatrix, mean,
+                                                    self.sigma)
+            if constantBarriers:
+                # Constant barriers: crossing probabilities are the same at
+                # every time step, so a single column is computed.
+                barrierUp = barrierUp[:1]
+                barrierDown = barrierDown[:1]
+            # With collapsing barriers, there is one column per time step,
+            # computed for the longest trial seen so far.
+            changeUp = np.subtract(barrierUp, states.reshape(states.size, 1))
+            changeDown = np.subtract(barrierDown,
+                                     states.reshape(states.size, 1))
+            tables = (transitionMatrix,
+                      1 - norm.cdf(changeUp, mean, self.sigma),
+                      norm.cdf(changeDown, mean, self.sigma),
+                      barrierUp.copy(), barrierDown.copy())
+            self._transitionTables[key] = tables
+
+        transitionMatrix, probUpCrossing, probDownCrossing = tables[:3]
+        if probUpCrossing.shape[1] == 1:
+            return (transitionMatrix,
+                    np.broadcast_to(probUpCrossing,
+                                    (states.size, numTimeSteps)),
+                    np.broadcast_to(probDownCrossing,
+                                    (states.size, numTimeSteps)))
+        return (transitionMatrix, probUpCrossing[:, :numTimeSteps],
+                probDownCrossing[:, :numTimeSteps])
 
 
     def get_trial_likelihood(self, trial, timeStep=10, approxStateStep=0.1,
@@ -149,24 +556,27 @@ class DDM(object):
         probUpCrossing = np.zeros(numTimeSteps)
         probDownCrossing = np.zeros(numTimeSteps)
 
-        changeMatrix = np.subtract(states.reshape(states.size, 1), states)
-        changeUp = np.subtract(barrierUp, states.reshape(states.size, 1))
-        changeDown = np.subtract(barrierDown, states.reshape(states.size, 1))
-
-        elapsedNDT = 0
+        # We use a normal distribution to model changes in RDV stochastically.
+        # The mean of the distribution (the change most likely to occur) is
+        # calculated from the model parameter d and from the item values,
+        # except during non-decision time, in which the mean is zero. Get the
+        # transition kernel and the barrier crossing probabilities for both
+        # drifts (precomputed, shared across time steps and trials).
+        ndtTables = self.get_transition_tables(0, states, stateStep,
+                                               barrierUp, barrierDown)
+        driftTables = self.get_transition_tables(
+            self.d * (trial.valueLeft - trial.valueRight), states, stateStep,
+            barrierUp, barrierDown)
+        numNDTSteps = self.nonDecisionTime // timeStep
 
         # Iterate over the time of this trial.
         for time in range(1, numTimeSteps):
-            # We use a normal distribution to model changes in RDV
-            # stochastically. The mean of the distribution (the change most
-            # likely to occur) is calculated from the model parameter d and
-            # from the item values, except during non-decision time, in which
-            # the mean is zero.
-            if elapsedNDT < self.nonDecisionTime // timeStep:
-                mean = 0
-                elapsedNDT += 1
+            if time <= numNDTSteps:
+                transitionMatrix, upCrossingTable, downCrossingTable = (
+                    ndtTables)
             else:
-                mean = self.d * (trial.valueLeft - trial.valueRight)
+                transitionMatrix, upCrossingTable, downCrossingTable = (
+                    driftTables)
 
             # Update the probability of the states that remain inside the
             # barriers. The probability of being in state B is the sum, over
@@ -175,9 +585,7 @@ class DDM(object):
             # multiply the probability by the stateStep to ensure that the area
             # under the curves for the probability distributions probUpCrossing
             # and probDownCrossing add up to 1.
-            prStatesNew = (stateStep *
-                           np.dot(norm.pdf(changeMatrix, mean, self.sigma),
-                           prStates[:,time-1]))
+            prStatesNew = np.dot(transitionMatrix, prStates[:,time-1])
             prStatesNew[(states >= barrierUp[time]) |
                         (states <= barrierDown[time])] = 0
 
@@ -185,12 +593,9 @@ class DDM(object):
             # down barrier. This is given by the sum, over all states A, of the
             # probability of being in A at the previous timestep times the
             # probability of crossing the barrier if A is the previous state.
-            tempUpCross = np.dot(
-                prStates[:,time-1],
-                (1 - norm.cdf(changeUp[:, time], mean, self.sigma)))
-            tempDownCross = np.dot(
-                prStates[:,time-1],
-                norm.cdf(changeDown[:, time], mean, self.sigma))
+            tempUpCross = np.dot(prStates[:,time-1], upCrossingTable[:, time])
+            tempDownCross = np.dot(prStates[:,time-1],
+                                   downCrossingTable[:, time])
 
             # Renormalize to cope with numerical approximations.
             sumIn = np.sum(prStates[:,time-1])
@@ -225,31 +630,422 @@ class DDM(object):
         return likelihood
 
 
-    def parallel_get_likelihoods(self, ddmTrials, timeStep=10, stateStep=0.1,
-                                 numThreads=4):
+    def get_trial_cost(self, trial, timeStep=10, approxStateStep=0.1):
+        """
+        Estimates the computational cost of get_trial_likelihood() for a
+        single DDM trial, as the number of state transitions evaluated.
+        Args:
+          trial: DDMTrial object.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          The expected cost of the likelihood computation for the trial.
+        """
+        numStates = 2 * np.ceil(self.barrier / approxStateStep) + 1
+        numTimeSteps = max(trial.RT // timeStep, 1)
+        return numStates ** 2 * numTimeSteps
+
+
+    def parallel_get_likelihoods(self, ddmTrials=None, timeStep=10,
+                                 stateStep=0.1, numThreads=4, pool=None,
+                                 backend=u"process"):
         """
         Uses a threadpool to compute the likelihood of the data from a set of
         DDM trials given the DDM parameters.
         Args:
-          ddmTrials: list of DDMTrial objects.
+          ddmTrials: list of DDMTrial objects. If not provided, the
+              trials installed in the workers of pool are used.
           timeStep: integer, value in milliseconds to be used for binning the
               time axis.
           stateStep: float, to be used for binning the RDV axis.
           numThreads: int, number of threads to be used in the threadpool.
+              Ignored if pool is provided.
+          pool: a WorkerPool object. If provided, its workers are used and
+              left running, so that the same pool can be reused across many
+              models. Otherwise, a pool is created for this call only.
+          backend: string, one of {'process', 'thread'}, type of the workers
+              of the pool created when no pool is provided.
         Returns:
-          A list of likelihoods obtained for the given trials and model.
+          A list of likelihoods obtained for the given trials and model. If
+              no trials are given, the trials installed in the pool's workers
+              are used, and the list follows their order.
         """
-        pool = Pool(numThreads)
+        if ddmTrials is None:
+            if pool is None:
+                raise RuntimeError(u"Either a list of trials or a worker "
+                                   "pool with installed trials must be "
+                                   "provided.")
+            return pool.get_resident_likelihoods(self, timeStep, stateStep)
+        if pool is None:
+            with WorkerPool(numThreads, backend=backend) as pool:
+                return self.parallel_get_likelihoods(
+                    ddmTrials, timeStep, stateStep, pool=pool)
         likelihoods = pool.map(unwrap_ddm_get_trial_likelihood,
                                zip([self] * len(ddmTrials),
                                    ddmTrials,
                                    [timeStep] * len(ddmTrials),
                                    [stateStep] * len(ddmTrials)))
-        pool.close()
         return likelihoods
 
 
-    def simulate_trial(self, valueLeft, valueRight, timeStep=10):
+    def get_crossing_probabilities(self, drifts, approxStateStep=0.1):
+        """
+        Propagates the distribution of the RDV forward in time for a batch of
+        drift sequences at once, and obtains the probability of crossing each
+        barrier at each time step.
+        Args:
+          drifts: numpy array with size K x T, where K is the number of
+              sequences and T is the number of time steps. Each value is the
+              mean of the change in RDV for that sequence at that time step.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A tuple (probUpCrossing, probDownCrossing), where each item is a
+          numpy array with size K x (T + 1). Entry [k, t] is the probability of
+          crossing the corresponding barrier at time step t for sequence k.
+        """
+        drifts = np.atleast_2d(drifts)
+        numSequences, numTimeSteps = drifts.shape
+        numTimeSteps += 1
+
+        # The values of the barriers can change over time.
+        decay = 0  # decay = 0 means barriers are constant.
+        barrierUp = self.barrier * np.ones(numTimeSteps)
+        barrierDown = -self.barrier * np.ones(numTimeSteps)
+        for t in range(1, numTimeSteps):
+            barrierUp[t] = self.barrier / (1 + (decay * t))
+            barrierDown[t] = -self.barrier / (1 + (decay * t))
+
+        # Obtain correct state step.
+        halfNumStateBins = np.ceil(self.barrier / approxStateStep)
+        stateStep = self.barrier / (halfNumStateBins + 0.5)
+
+        # The vertical axis is divided into states.
+        states = np.arange(barrierDown[0] + (stateStep / 2),
+                           barrierUp[0] - (stateStep / 2) + stateStep,
+                           stateStep)
+
+        # Find the state corresponding to the bias parameter.
+        biasState = np.argmin(np.absolute(states - self.bias))
+
+        # Get the transition tables for all distinct drifts in the batch.
+        uniqueDrifts, driftIndices = np.unique(drifts, return_inverse=True)
+        driftIndices = driftIndices.reshape(drifts.shape)
+        tables = [self.get_transition_tables(mean, states, stateStep,
+                                             barrierUp, barrierDown)
+                  for mean in uniqueDrifts]
+        # The crossing tables are kept as per-drift views, since stacking
+        # them would copy the broadcast constant-barrier tables in full.
+        transitionMatrices = [table[0] for table in tables]
+        upCrossingTables = [table[1] for table in tables]
+        downCrossingTables = [table[2] for table in tables]
+
+        prStates = np.zeros((states.size, numSequences))
+        prStates[biasState, :] = 1
+        probUpCrossing = np.zeros((numSequences, numTimeSteps))
+        probDownCrossing = np.zeros((numSequences, numTimeSteps))
+
+        for time in range(1, numTimeSteps):
+            # Group the sequences by their drift at this time step, so that
+            # each transition kernel is only applied to the sequences that
+            # use it.
+            currDrifts = driftIndices[:, time-1]
+            prStatesNew = np.empty_like(prStates)
+            tempUpCross = np.empty(numSequences)
+            tempDownCross = np.empty(numSequences)
+            currUniqueDrifts = np.unique(currDrifts)
+            for driftIndex in currUniqueDrifts:
+                if currUniqueDrifts.size == 1:
+                    columns = slice(None)
+                else:
+                    columns = np.flatnonzero(currDrifts == driftIndex)
+                prStatesGroup = prStates[:, columns]
+                prStatesNew[:, columns] = np.dot(
+                    transitionMatrices[driftIndex], prStatesGroup)
+                tempUpCross[columns] = np.dot(
+                    upCrossingTables[driftIndex][:, time], prStatesGroup)
+                tempDownCross[columns] = np.dot(
+                    downCrossingTables[driftIndex][:, time], prStatesGroup)
+            prStatesNew[(states >= barrierUp[time]) |
+                        (states <= barrierDown[time]), :] = 0
+
+            # Renormalize to cope with numerical approximations.
+            sumIn = np.sum(prStates, 0)
+            sumCurrent = np.sum(prStatesNew, 0) + tempUpCross + tempDownCross
+            with np.errstate(divide=u"ignore", invalid=u"ignore"):
+                normalization = np.where(sumCurrent > 0, sumIn / sumCurrent,
+                                         0)
+            prStates = prStatesNew * normalization
+            probUpCrossing[:, time] = tempUpCross * normalization
+            probDownCrossing[:, time] = tempDownCross * normalization
+
+        return probUpCrossing, probDownCrossing
+
+
+    def predict_distribution(self, valueLeft, valueRight, maxRT=10000,
+                             timeStep=10, approxStateStep=0.1):
+        """
+        Obtains the joint distribution of choices and response times predicted
+        by the model for a trial condition, through a single forward
+        propagation of the RDV distribution (no simulations are needed).
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          maxRT: integer, maximum response time in milliseconds covered by the
+              distribution.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A ChoiceRTDistribution object.
+        """
+        drifts = (self.d * (valueLeft - valueRight) *
+                  np.ones(int(maxRT // timeStep)))
+        drifts[:int(self.nonDecisionTime // timeStep)] = 0
+        probUpCrossing, probDownCrossing = self.get_crossing_probabilities(
+            drifts, approxStateStep)
+        return ChoiceRTDistribution(valueLeft, valueRight, timeStep,
+                                    probUpCrossing[0], probDownCrossing[0])
+
+
+    def get_first_passage_table(self, valueLeft, valueRight, timeStep=10,
+                                approxStateStep=0.02, maxProbUndecided=1e-4):
+        """
+        Tabulates the cumulative first-passage time distribution of the model
+        for a trial condition, i.e. the probability of having reached each
+        decision by each time step, using predict_distribution(). The time
+        span of the table is doubled until the probability of no decision
+        being reached falls below maxProbUndecided (up to 32 times the
+        initial 10 seconds). Tables are cached in the model.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis. It is
+              finer than the default used for likelihoods, since sampled
+              response times are compared directly with simulated ones.
+          maxProbUndecided: float, tolerance for the probability mass left
+              beyond the end of the table.
+        Returns:
+          A numpy array of length 2T, where T is the number of time steps
+          in the table, with the normalized cumulative probabilities of the
+          left choices at each time step, followed by those of the right
+          choices (i.e. the distribution is conditioned on a decision being
+          reached within the table).
+        """
+        key = (valueLeft - valueRight, timeStep, approxStateStep, self.d,
+               self.sigma, self.barrier, self.nonDecisionTime, self.bias)
+        if key not in self._firstPassageTables:
+            maxRT = 10000
+            distribution = self.predict_distribution(
+                valueLeft, valueRight, maxRT, timeStep, approxStateStep)
+            while (distribution.get_prob_undecided() > maxProbUndecided and
+                   maxRT < 320000):
+                maxRT *= 2
+                distribution = self.predict_distribution(
+                    valueLeft, valueRight, maxRT, timeStep, approxStateStep)
+            cumProbs = np.cumsum(np.concatenate((distribution.probLeft,
+                                                 distribution.probRight)))
+            self._firstPassageTables[key] = cumProbs / cumProbs[-1]
+        return self._firstPassageTables[key]
+
+
+    def sample_first_passage(self, valueLeft, valueRight, size=None,
+                             timeStep=10, rng=None):
+        """
+        Samples choices and response times directly from the first-passage
+        time distribution of the model, by inverting the table returned by
+        get_first_passage_table().
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          size: integer, number of samples. If None, a single sample is
+              returned.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (RT, choice), with a response time in milliseconds and a
+          choice (-1 for left, 1 for right), or numpy arrays of those if size
+          is provided.
+        """
+        rng = get_generator(rng)
+        cumProbs = self.get_first_passage_table(valueLeft, valueRight,
+                                                timeStep)
+        numTimeSteps = cumProbs.size // 2
+        indices = np.minimum(
+            cumProbs.searchsorted(rng.uniform(size=size), side=u"right"),
+            cumProbs.size - 1)
+        RT = (indices % numTimeSteps) * timeStep
+        choice = np.where(indices < numTimeSteps, -1, 1)
+        if size is None:
+            return int(RT), int(choice)
+        return RT, choice
+
+
+    def advance_rdv(self, RDV, mean, numSteps, simulationMethod=u"steps",
+                    rng=None):
+        """
+        Advances the RDV over a number of time steps during which its
+        expected change per step is constant, stopping at the first barrier
+        crossing.
+        Args:
+          RDV: number, current value of the RDV.
+          mean: number, expected change in RDV at each time step.
+          numSteps: integer, number of time steps.
+          simulationMethod: string, one of {'steps', 'bridge'}. If 'steps',
+              the RDV is updated at every time step. If 'bridge', the RDV is
+              advanced by DDM.advance_rdvs(), which jumps straight to the end
+              of the time steps. 'bridge' is approximate, and a single call
+              is not cheaper than 'steps'; it is meant for the batch
+              simulators, which jump over whole fixations for many trials at
+              once.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (RDV, crossingStep), where RDV is the value of the RDV at
+          the end of the time steps or at the barrier crossing, and
+          crossingStep is the (1-based) time step at which a barrier was
+          crossed, or None if no barrier was crossed.
+        """
+        rng = get_generator(rng)
+        if simulationMethod == u"steps":
+            for t in range(numSteps):
+                RDV += rng.normal(mean, self.sigma)
+                if RDV >= self.barrier or RDV <= -self.barrier:
+                    return RDV, t + 1
+            return RDV, None
+        elif simulationMethod != u"bridge":
+            raise RuntimeError(u"Argument simulationMethod must be one of "
+                               "{steps, bridge}.")
+        if numSteps <= 0:
+            return RDV, None
+        RDVs, crossingSteps = self.advance_rdvs(
+            np.array([RDV], dtype=float), np.array([mean], dtype=float),
+            np.array([numSteps]), rng)
+        if crossingSteps[0] == 0:
+            return float(RDVs[0]), None
+        return float(RDVs[0]), int(crossingSteps[0])
+
+
+    def advance_rdvs(self, RDVs, means, numSteps, rng=None, maxCopies=1000):
+        """
+        Advances several RDVs at once over a number of time steps during
+        which their expected changes per step are constant, jumping straight
+        to the end of the time steps. The RDV at the end is sampled directly,
+        and a crossing in between is detected using the crossing probability
+        of the Brownian bridge between the two values. When a crossing is
+        detected, it is located by bisecting the bridge, so the cost does
+        not grow with the number of time steps. Crossings are detected
+        continuously, with the barriers shifted outwards by
+        BARRIER_SHIFT * sigma to approximate the per-step detection of the
+        'steps' method; an RDV which ends between a barrier and its shifted
+        counterpart is counted as crossing at the last time step. The
+        resulting distribution is therefore close to, but not exactly the
+        same as, the one from stepping.
+        Args:
+          RDVs: numpy array, current values of the RDVs.
+          means: numpy array, expected change in each RDV at each time step.
+          numSteps: numpy array of positive integers, number of time steps
+              for each RDV.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          maxCopies: integer, maximum number of candidate values drawn at
+              once for each RDV when locating crossings.
+        Returns:
+          A tuple (RDVs, crossingSteps) of numpy arrays, where RDVs are the
+          values of the RDVs at the end of the time steps or at the barrier
+          crossings, and crossingSteps are the (1-based) time steps at which
+          a barrier was crossed, or 0 where no barrier was crossed.
+        """
+        rng = get_generator(rng)
+        barrier = self.barrier + BARRIER_SHIFT * self.sigma
+        stepVariance = self.sigma ** 2
+        endRDVs = rng.normal(RDVs + means * numSteps,
+                             self.sigma * np.sqrt(numSteps))
+        probCrossing = get_bridge_crossing_probability(
+            RDVs, endRDVs, stepVariance * numSteps, barrier)
+        crossed = rng.uniform(size=RDVs.size) < probCrossing
+        crossingSteps = np.where(
+            (endRDVs >= self.barrier) | (endRDVs <= -self.barrier),
+            numSteps, 0)
+        crossingSteps[crossed] = 0
+
+        # Locate the crossings by bisection. Given that a bridge crosses a
+        # barrier, the RDV at its middle time step is sampled conditional on
+        # the crossing, by rejection: about twice the inverse of the crossing
+        # probability candidates are drawn at once, and the first accepted
+        # one is kept. The first crossing then lies in the first half of the
+        # bridge with the probability of crossing there relative to either
+        # half, and the bisection continues in that half.
+        crossedRDVs = np.flatnonzero(crossed)
+        lower = np.zeros(crossedRDVs.size, dtype=int)
+        upper = numSteps[crossedRDVs].copy()
+        startRDVs = RDVs[crossedRDVs].copy()
+        stopRDVs = endRDVs[crossedRDVs].copy()
+        probBridge = probCrossing[crossedRDVs]
+        bisecting = np.flatnonzero(upper - lower > 1)
+        while bisecting.size:
+            copies = np.clip(np.ceil(2 / probBridge[bisecting]), 1,
+                             maxCopies).astype(int)
+            candidates = np.repeat(bisecting, copies)
+            middle = (lower[candidates] + upper[candidates]) // 2
+            stepsBefore = middle - lower[candidates]
+            stepsAfter = upper[candidates] - middle
+            start = startRDVs[candidates]
+            stop = stopRDVs[candidates]
+            middleRDVs = rng.normal(
+                start + (stop - start) * stepsBefore / (stepsBefore +
+                                                        stepsAfter),
+                self.sigma * np.sqrt(stepsBefore * stepsAfter /
+                                     (stepsBefore + stepsAfter)))
+            probBefore = get_bridge_crossing_probability(
+                start, middleRDVs, stepVariance * stepsBefore, barrier)
+            probAfter = get_bridge_crossing_probability(
+                middleRDVs, stop, stepVariance * stepsAfter, barrier)
+            probEither = 1 - (1 - probBefore) * (1 - probAfter)
+            accepted = np.flatnonzero(
+                rng.uniform(size=candidates.size) < probEither)
+            found, first = np.unique(candidates[accepted], return_index=True)
+            accepted = accepted[first]
+            before = (rng.uniform(size=found.size) * probEither[accepted] <
+                      probBefore[accepted])
+            after = ~before
+            upper[found[before]] = middle[accepted[before]]
+            stopRDVs[found[before]] = middleRDVs[accepted[before]]
+            probBridge[found[before]] = probBefore[accepted[before]]
+            lower[found[after]] = middle[accepted[after]]
+            startRDVs[found[after]] = middleRDVs[accepted[after]]
+            probBridge[found[after]] = probAfter[accepted[after]]
+            bisecting = np.flatnonzero(upper - lower > 1)
+
+        # The crossings now lie within single time steps. If the RDV at the
+        # end of the time step is beyond a barrier, it is kept; otherwise the
+        # crossing goes to a barrier chosen according to the single-barrier
+        # probabilities of crossing each of them, since within a single time
+        # step the noise is small compared to the distance between the
+        # barriers.
+        probUp = np.exp(-2 * np.maximum(barrier - startRDVs, 0) *
+                        np.maximum(barrier - stopRDVs, 0) / stepVariance)
+        probDown = np.exp(-2 * np.maximum(barrier + startRDVs, 0) *
+                          np.maximum(barrier + stopRDVs, 0) / stepVariance)
+        inside = (stopRDVs < barrier) & (stopRDVs > -barrier)
+        stopRDVs[inside] = np.where(
+            rng.uniform(size=np.count_nonzero(inside)) * (
+                probUp[inside] + probDown[inside]) < probUp[inside],
+            barrier, -barrier)
+        endRDVs[crossedRDVs] = stopRDVs
+        crossingSteps[crossedRDVs] = upper
+        return endRDVs, crossingSteps
+
+
+    def simulate_trial(self, valueLeft, valueRight, timeStep=10, rng=None,
+                       simulationMethod=u"steps"):
         """
         Generates a DDM trial given the item values.
         Args:
@@ -257,9 +1053,25 @@ class DDM(object):
           valueRight: value of the right item.
           timeStep: integer, value in milliseconds to be used for binning the
               time axis.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'distribution'}. If
+              'steps', the RDV is updated at every time step until it hits a
+              barrier. If 'distribution', the choice and response time are
+              sampled directly from the first-passage time distribution of
+              the model (see sample_first_passage()).
         Returns:
           A DDMTrial object resulting from the simulation.
         """
+        rng = get_generator(rng)
+        if simulationMethod == u"distribution":
+            RT, choice = self.sample_first_passage(valueLeft, valueRight,
+                                                   timeStep=timeStep, rng=rng)
+            return DDMTrial(RT, choice, valueLeft, valueRight)
+        elif simulationMethod != u"steps":
+            raise RuntimeError(u"Argument simulationMethod must be one of "
+                               "{steps, distribution}.")
         RDV = self.bias
         time = 0
         elapsedNDT = 0
@@ -280,13 +1092,120 @@ class DDM(object):
                 mean = self.d * (valueLeft - valueRight)
 
             # Sample the change in RDV from the distribution.
-            RDV += np.random.normal(mean, self.sigma)
+            RDV += rng.normal(mean, self.sigma)
 
             time += 1
 
         return DDMTrial(RT, choice, valueLeft, valueRight)
 
 
+    def simulate_trials(self, valueLeft, valueRight, numTrials, timeStep=10,
+                        blockSize=100, rng=None, simulationMethod=u"steps"):
+        """
+        Generates a batch of DDM trials for a single trial condition. The
+        trials follow the same rules as DDM.simulate_trial(), but are
+        simulated together using array operations.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          numTrials: integer, number of trials to be generated.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          blockSize: integer, number of time steps drawn at once for each
+              undecided trial.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'distribution'}. See
+              DDM.simulate_trial().
+        Returns:
+          A SimulationBatch object with numTrials trials.
+        """
+        return self.simulate_conditions([(valueLeft, valueRight)], numTrials,
+                                        timeStep, blockSize, rng,
+                                        simulationMethod)
+
+
+    def simulate_conditions(self, trialConditions, trialsPerCondition,
+                            timeStep=10, blockSize=100, rng=None,
+                            simulationMethod=u"steps"):
+        """
+        Generates a batch of DDM trials for several trial conditions at once.
+        Noise is drawn in blocks of time steps for all undecided trials, and
+        the RDV paths within a block are obtained with cumulative sums. The
+        first barrier crossing of each path is then found with argmax, and
+        only the trials which are still undecided move on to the next block.
+        Args:
+          trialConditions: list of pairs (valueLeft, valueRight).
+          trialsPerCondition: integer, number of trials to be generated for
+              each trial condition.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          blockSize: integer, number of time steps drawn at once for each
+              undecided trial.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'distribution'}. If
+              'distribution', the trials are sampled directly from the
+              first-passage time distribution of each trial condition, and
+              blockSize is not used. See DDM.simulate_trial().
+        Returns:
+          A SimulationBatch object, with the trials ordered by trial
+              condition.
+        """
+        rng = get_generator(rng)
+        valuesLeft = np.repeat(
+            np.array([valueLeft for (valueLeft, valueRight)
+                      in trialConditions]), trialsPerCondition)
+        valuesRight = np.repeat(
+            np.array([valueRight for (valueLeft, valueRight)
+                      in trialConditions]), trialsPerCondition)
+
+        if simulationMethod == u"distribution":
+            samples = [self.sample_first_passage(valueLeft, valueRight,
+                                                 trialsPerCondition, timeStep,
+                                                 rng)
+                       for (valueLeft, valueRight) in trialConditions]
+            return SimulationBatch(
+                np.concatenate([RT for (RT, choice) in samples]),
+                np.concatenate([choice for (RT, choice) in samples]),
+                valuesLeft, valuesRight)
+        elif simulationMethod != u"steps":
+            raise RuntimeError(u"Argument simulationMethod must be one of "
+                               "{steps, distribution}.")
+        numTrials = valuesLeft.size
+        drifts = self.d * (valuesLeft - valuesRight)
+        numNDTSteps = self.nonDecisionTime // timeStep
+
+        RT = np.zeros(numTrials, dtype=int)
+        choice = np.zeros(numTrials, dtype=int)
+        RDV = np.full(numTrials, self.bias, dtype=float)
+        active = np.arange(numTrials)
+        elapsedSteps = 0
+        while active.size:
+            # Only noise is added to the RDV during the non-decision time.
+            steps = elapsedSteps + np.arange(1, blockSize + 1)
+            means = np.where(steps > numNDTSteps, drifts[active, None], 0)
+            paths = RDV[active, None] + np.cumsum(
+                means + rng.normal(0, self.sigma, (active.size, blockSize)),
+                axis=1)
+
+            crossings = (paths >= self.barrier) | (paths <= -self.barrier)
+            hit = np.any(crossings, axis=1)
+            firstCrossing = np.argmax(crossings[hit], axis=1)
+            done = active[hit]
+            RT[done] = (elapsedSteps + firstCrossing + 1) * timeStep
+            choice[done] = np.where(
+                paths[hit, firstCrossing] >= self.barrier, -1, 1)
+
+            RDV[active[~hit]] = paths[~hit, -1]
+            active = active[~hit]
+            elapsedSteps += blockSize
+
+        return SimulationBatch(RT, choice, valuesLeft, valuesRight)
+
+
     def plot_trial(self, valueLeft, valueRight, timeStep, numTimeSteps,
                    probStates, probUpCrossing, probDownCrossing,
                    fileName=None):
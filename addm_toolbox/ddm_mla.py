@@ -32,9 +32,11 @@ from __future__ import absolute_import, division
 
 import numpy as np
 
-from builtins import str
+from builtins import range, str
 
+from . import ddm
 from .ddm import DDMTrial
+from .rng import get_generator
 
 
 class DDM(object):
@@ -70,7 +72,7 @@ class DDM(object):
         self.params = (d, sigma)
 
 
-    def simulate_trial(self, valueLeft, valueRight, timeStep=10): 
+    def simulate_trial(self, valueLeft, valueRight, timeStep=10, rng=None):
         """
         DDM algorithm. Given the parameters of the model and the trial
         conditions, returns the choice and response time as predicted by the
@@ -80,9 +82,13 @@ class DDM(object):
           valueRight: integer, value of the right item.
           timeStep: integer, value in milliseconds which determines how often
               the RDV signal is updated.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
         Returns:
           A DDMTrial object resulting from the simulation.
         """
+        rng = get_generator(rng)
         RT = 0
         choice = 0
         RDV = self.bias
@@ -90,7 +96,7 @@ class DDM(object):
 
         while RDV < self.barrier and RDV > -self.barrier:
             RT = RT + timeStep
-            epsilon = np.random.normal(0, self.sigma)
+            epsilon = rng.normal(0, self.sigma)
             if elapsedNDT < self.nonDecisionTime // timeStep:
                 RDV += epsilon
                 elapsedNDT += 1
@@ -104,8 +110,38 @@ class DDM(object):
         return DDMTrial(RT, choice, valueLeft, valueRight)
 
 
+    def simulate_trials(self, valueLeft, valueRight, numTrials, timeStep=10,
+                        blockSize=100, rng=None, simulationMethod=u"steps"):
+        """
+        Generates a batch of trials for a single trial condition, using the
+        block-wise simulator from ddm.DDM.simulate_conditions().
+        Args:
+          valueLeft: integer, value of the left item.
+          valueRight: integer, value of the right item.
+          numTrials: integer, number of trials to be generated.
+          timeStep: integer, value in milliseconds which determines how often
+              the RDV signal is updated.
+          blockSize: integer, number of time steps drawn at once for each
+              undecided trial.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+          simulationMethod: string, one of {'steps', 'distribution'}. See
+              ddm.DDM.simulate_trial().
+        Returns:
+          A ddm.SimulationBatch object with numTrials trials.
+        """
+        model = ddm.DDM(self.d, self.sigma, self.barrier,
+                        self.nonDecisionTime, self.bias)
+        return model.simulate_trials(valueLeft, valueRight, numTrials,
+                                     timeStep, blockSize, rng,
+                                     simulationMethod)
+
+
     def get_model_log_likelihood(self, trialConditions, numSimulations,
-                                 histBins, dataHistLeft, dataHistRight):
+                                 histBins, dataHistLeft, dataHistRight,
+                                 histogramMethod=u"simulation",
+                                 noiseBank=None, rng=None):
         """
         Computes the log-likelihood of a data set given the model. Data set is
         provided in the form of response time histograms conditioned on choice.
@@ -125,46 +161,223 @@ class DDM(object):
               histBins.
           dataHistRight: same as dataHistLeft, except that the response time
               histograms are conditioned on right choice.
+          histogramMethod: string, one of {'simulation', 'propagation'}. If
+              'simulation', the model histograms are estimated from
+              numSimulations simulated trials per condition. If
+              'propagation', the histogram bin probabilities are computed
+              from the barrier crossing distributions obtained by propagating
+              the RDV distribution forward in time, so they are free of
+              sampling noise and numSimulations is not used.
+          noiseBank: dict indexed by trial condition, as returned by
+              sample_noise_bank(). Only used when histogramMethod is
+              'simulation': if provided, the simulated trials are driven by
+              the noise in the bank instead of fresh draws, and
+              numSimulations is not used. Providing the same bank to all
+              models in a grid search makes their log-likelihoods directly
+              comparable.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
           Returns:
               The log-likelihood for the data given the model.
         """
+        histogramMethod = str(histogramMethod)
+        if (histogramMethod != u"simulation" and
+            histogramMethod != u"propagation"):
+            raise RuntimeError(u"Argument histogramMethod must be one of "
+                               "{simulation, propagation}")
+
+        rng = get_generator(rng)
         logLikelihood = 0
         for trialCondition in trialConditions:
-            RTsLeft = list()
-            RTsRight = list()
-            sim = 0
-            while sim < numSimulations:
-                try:
-                    ddmTrial = self.simulate_trial(trialCondition[0],
-                                                   trialCondition[1])
-                except:
-                    print(u"An exception occurred while generating "
-                          "artificial trial " + str(sim) + u" for condition " +
-                          str(trialCondition[0]) + u", " +
-                          str(trialCondition[1]) + u", during the " +
-                          u"log-likelihood computation for model " +
-                          str(self.params) + u".")
-                    raise
-                if ddmTrial.choice == -1:
-                    RTsLeft.append(ddmTrial.RT)
-                elif ddmTrial.choice == 1:
-                    RTsRight.append(ddmTrial.RT)
-                sim += 1
-
-            simulLeft = np.histogram(RTsLeft, bins=histBins)[0]
-            if np.sum(simulLeft) != 0:
-                simulLeft = simulLeft / np.sum(simulLeft)
+            if histogramMethod == u"propagation":
+                simulLeft, simulRight = self.get_propagation_histograms(
+                    trialCondition[0], trialCondition[1], histBins)
+            elif noiseBank:
+                simulLeft, simulRight = self.get_bank_histograms(
+                    trialCondition[0], trialCondition[1], histBins,
+                    noiseBank[trialCondition])
+            else:
+                simulLeft, simulRight = self.get_simulation_histograms(
+                    trialCondition[0], trialCondition[1], numSimulations,
+                    histBins, rng)
+
             with np.errstate(divide=u"ignore"):
                 logSimulLeft = np.where(simulLeft > 0, np.log(simulLeft), 0)
             dataLeft = np.array(dataHistLeft[trialCondition])
             logLikelihood += np.dot(logSimulLeft, dataLeft)
 
-            simulRight = np.histogram(RTsRight, bins=histBins)[0]
-            if np.sum(simulRight) != 0:
-                simulRight = simulRight / np.sum(simulRight)
             with np.errstate(divide=u"ignore"):
                 logSimulRight = np.where(simulRight > 0, np.log(simulRight), 0)
             dataRight = np.array(dataHistRight[trialCondition])
             logLikelihood += np.dot(logSimulRight, dataRight)
 
         return logLikelihood
+
+
+    def get_simulation_histograms(self, valueLeft, valueRight, numSimulations,
+                                  histBins, rng=None):
+        """
+        Estimates the response time histograms conditioned on choice for a
+        trial condition by generating simulations.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          numSimulations: integer, number of simulations to be generated.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        try:
+            batch = self.simulate_trials(valueLeft, valueRight,
+                                         numSimulations, rng=rng)
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials for condition " + str(valueLeft) + u", " +
+                  str(valueRight) + u", during the log-likelihood "
+                  "computation for model " + str(self.params) + u".")
+            raise
+        return batch.get_histograms(histBins)
+
+
+    def get_bank_histograms(self, valueLeft, valueRight, histBins, noise,
+                            timeStep=10):
+        """
+        Estimates the response time histograms conditioned on choice for a
+        trial condition from trials simulated with pre-drawn noise.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          noise: numpy array of standard normals with one row per simulated
+              trial, as in the entries returned by sample_noise_bank().
+          timeStep: integer, value in milliseconds which determines how often
+              the RDV signal is updated.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        drift = np.full(noise.shape[1], self.d * (valueLeft - valueRight))
+        drift[:int(self.nonDecisionTime // timeStep)] = 0
+        batch = simulate_from_bank(valueLeft, valueRight, drift, noise,
+                                   self.sigma, self.barrier, self.bias,
+                                   timeStep)
+        return batch.get_histograms(histBins)
+
+
+    def get_propagation_histograms(self, valueLeft, valueRight, histBins,
+                                   timeStep=10, approxStateStep=0.1):
+        """
+        Computes the response time histograms conditioned on choice for a
+        trial condition from the barrier crossing distributions of the model.
+        Args:
+          valueLeft: value of the left item.
+          valueRight: value of the right item.
+          histBins: list of numbers corresponding to the time bins used to
+              create the response time histograms.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          approxStateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A tuple (histLeft, histRight) of normalized numpy arrays.
+        """
+        model = ddm.DDM(self.d, self.sigma, self.barrier,
+                        self.nonDecisionTime, self.bias)
+        distribution = model.predict_distribution(
+            valueLeft, valueRight, maxRT=histBins[-1] + timeStep, timeStep=timeStep,
+            approxStateStep=approxStateStep)
+        return distribution.get_histograms(histBins)
+
+
+def sample_noise_bank(trialConditions, numSimulations, maxRT, timeStep=10,
+                      rng=None):
+    """
+    Draws a bank of standard normal noise for each trial condition, which can
+    be shared by all models in a grid search when computing histograms from
+    simulations (common random numbers). Since every model then simulates its
+    trials from the same noise, differences between the log-likelihoods of
+    two models are much less affected by sampling noise than with
+    independent simulations.
+    Args:
+      trialConditions: list of pairs corresponding to the different trial
+          conditions. Each pair contains the values of left and right items.
+      numSimulations: integer, number of simulated trials per trial
+          condition.
+      maxRT: integer, maximum response time in milliseconds covered by the
+          noise. Trials which have not reached a barrier by then are left out
+          of the histograms, as are trials with larger response times in
+          regular simulations.
+      timeStep: integer, value in milliseconds which determines how often
+          the RDV signal is updated.
+      rng: source of random numbers, as accepted by rng.get_generator(). If
+          not provided, the global numpy random state is used.
+    Returns:
+      A dict indexed by trial condition, where each entry is a numpy array of
+          shape (numSimulations, maxRT // timeStep), with one row of noise per
+          simulated trial.
+    """
+    rng = get_generator(rng)
+    noiseBank = dict()
+    for trialCondition in trialConditions:
+        noiseBank[trialCondition] = rng.normal(
+            size=(numSimulations, int(maxRT // timeStep))).astype(np.float32)
+    return noiseBank
+
+
+def simulate_from_bank(valueLeft, valueRight, drift, noise, sigma, barrier,
+                       bias=0, timeStep=10, blockSize=100):
+    """
+    Simulates a set of trials from pre-drawn noise. Block by block, the RDV
+    paths of the undecided trials are obtained with a cumulative sum and
+    their first barrier crossings are located, as in
+    ddm.DDM.simulate_conditions().
+    Args:
+      valueLeft: value of the left item.
+      valueRight: value of the right item.
+      drift: numpy array with the mean change in RDV at each time step,
+          either of shape (numSteps,) if it is shared by all trials, or of
+          the same shape as noise.
+      noise: numpy array of standard normals of shape (numTrials, numSteps).
+      sigma: float, standard deviation of the change in RDV at each step.
+      barrier: positive number, magnitude of the signal thresholds.
+      bias: number, initial value of the RDV.
+      timeStep: integer, value in milliseconds of each time step.
+      blockSize: integer, number of time steps processed at once.
+    Returns:
+      A ddm.SimulationBatch object with the trials which reached a barrier
+          within the noise available.
+    """
+    numTrials, numSteps = noise.shape
+    RDV = np.full(numTrials, bias, dtype=float)
+    RT = np.zeros(numTrials, dtype=int)
+    choice = np.zeros(numTrials, dtype=int)
+    active = np.arange(numTrials)
+    for start in range(0, numSteps, blockSize):
+        if not active.size:
+            break
+        end = min(start + blockSize, numSteps)
+        if drift.ndim == 1:
+            blockDrift = drift[start:end]
+        else:
+            blockDrift = drift[active, start:end]
+        paths = RDV[active, np.newaxis] + np.cumsum(
+            blockDrift + sigma * noise[active, start:end], axis=1)
+        crossed = (paths >= barrier) | (paths <= -barrier)
+        hit = crossed.any(axis=1)
+        firstStep = crossed.argmax(axis=1)[hit]
+        done = active[hit]
+        RT[done] = (start + firstStep + 1) * timeStep
+        choice[done] = np.where(
+            paths[hit, firstStep] >= barrier, -1, 1)
+        RDV[active] = paths[:, -1]
+        active = active[~hit]
+
+    decided = choice != 0
+    return ddm.SimulationBatch(
+        RT[decided], choice[decided],
+        np.full(np.count_nonzero(decided), valueLeft),
+        np.full(np.count_nonzero(decided), valueRight))
@@ -35,31 +35,37 @@ from __future__ import absolute_import
 import numpy as np
 import pkg_resources
 
-from builtins import range, str
-from multiprocessing import Pool
+from builtins import range, str, zip
 
-from .ddm_mla import DDM
+from .ddm_mla import DDM, sample_noise_bank
+from .parallel import WorkerPool, get_resident_data
+from .rng import get_generator, spawn_seeds
 from .util import load_trial_conditions_from_csv
 
 
 def wrap_ddm_get_model_log_likelihood(args):
     """
     Wrapper for DDM.get_model_log_likelihood(), intended for parallel
-    computation using a threadpool.
+    computation using a worker pool. The arguments shared by all models,
+    which include the noise bank, are resident in the workers under the name
+    'modelArgs', so each task only carries its model.
     Args:
-      args: a tuple where the first item is a DDM object, and the remaining
-          item are the same arguments required by
-          DDM.get_model_log_likelihood().
+      args: a tuple (poolId, model, rng), where poolId is the id of the
+          worker pool, model is a DDM object and rng is the source of random
+          numbers for the model.
     Returns:
       The output of DDM.get_model_log_likelihood().
     """
-    model = args[0]
-    return model.get_model_log_likelihood(*args[1:])
+    poolId, model, rng = args
+    return model.get_model_log_likelihood(
+        *get_resident_data(u"modelArgs", poolId), rng=rng)
 
 
 def main(d, sigma, rangeD, rangeSigma, trialsFileName=None, numTrials=10,
          numSimulations=10, binStep=100, maxRT=8000, numThreads=9,
-         verbose=False):
+         verbose=False, histogramMethod=u"simulation",
+         threadBudget=None, seed=None, simulationMethod=u"steps",
+         commonRandomNumbers=False):
     """
     Args:
       d: float, DDM parameter for generating artificial data.
@@ -75,9 +81,24 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None, numTrials=10,
       maxRT: int, maximum RT to be used in the RT histograms.
       numThreads: int, size of the thread pool.
       verbose: boolean, whether or not to increase output verbosity.
+      histogramMethod: string, one of {'simulation', 'propagation'}, method
+          used to compute the model RT histograms.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
+      seed: int, seed of the random streams used to generate the artificial
+          data and the model simulations. Each model in the grid draws from
+          its own stream, so the log-likelihoods do not depend on the number
+          of workers. If not provided, the streams are seeded with fresh
+          entropy.
+      simulationMethod: string, one of {'steps', 'distribution'}, method used
+          to generate the artificial data. See ddm.DDM.simulate_trial().
+      commonRandomNumbers: boolean, whether all models in the grid simulate
+          their trials from a single bank of numSimulations noise sequences
+          per trial condition, instead of drawing their own noise. Only used
+          when histogramMethod is 'simulation'.
     """
-    pool = Pool(numThreads)
-
     histBins = list(range(0, maxRT + binStep, binStep))
 
     # Load trial conditions.
@@ -86,7 +107,10 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None, numTrials=10,
             u"addm_toolbox", u"test_data/test_trial_conditions.csv")
     trialConditions = load_trial_conditions_from_csv(trialsFileName)
 
+    dataSeed, modelsSeed, bankSeed = spawn_seeds(seed, 3)
+
     # Generate artificial data.
+    rng = get_generator(dataSeed)
     dataRTLeft = dict()
     dataRTRight = dict()
     for trialCondition in trialConditions:
@@ -94,22 +118,17 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None, numTrials=10,
         dataRTRight[trialCondition] = list()
     model = DDM(d, sigma)
     for trialCondition in trialConditions:
-        t = 0
-        while t < numTrials:
-            try:
-                trial = model.simulate_trial(
-                    trialCondition[0], trialCondition[1])
-            except:
-                print(u"An exception occurred while generating artificial "
-                      "trial " + str(t) + u" for condition " +
-                      str(trialCondition[0]) + u", " + str(trialCondition[1]) +
-                      u".")
-                raise
-            if trial.choice == -1:
-                dataRTLeft[trialCondition].append(trial.RT)
-            elif trial.choice == 1:
-                dataRTRight[trialCondition].append(trial.RT)
-            t += 1
+        try:
+            batch = model.simulate_trials(
+                trialCondition[0], trialCondition[1], numTrials, rng=rng,
+                simulationMethod=simulationMethod)
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials for condition " + str(trialCondition[0]) + u", " +
+                  str(trialCondition[1]) + u".")
+            raise
+        dataRTLeft[trialCondition].extend(batch.RT[batch.choice == -1])
+        dataRTRight[trialCondition].extend(batch.RT[batch.choice == 1])
 
     # Generate histograms for artificial data.
     dataHistLeft = dict()
@@ -120,19 +139,30 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None, numTrials=10,
         dataHistRight[trialCondition] = np.histogram(
             dataRTRight[trialCondition], bins=histBins)[0]
 
+    noiseBank = None
+    if commonRandomNumbers and histogramMethod == u"simulation":
+        noiseBank = sample_noise_bank(trialConditions, numSimulations, maxRT,
+                                      rng=bankSeed)
+
     # Grid search on the parameters of the model.
     if verbose:
         print(u"Performing grid search over the model parameters...")
-    listParams = list()
     models = list()
     for d in rangeD:
         for sigma in rangeSigma:
-            model = DDM(d, sigma)
-            models.append(model)
-            listParams.append((model, trialConditions, numSimulations,
-                              histBins, dataHistLeft, dataHistRight))
-    logLikelihoods = pool.map(wrap_ddm_get_model_log_likelihood, listParams)
-    pool.close()
+            models.append(DDM(d, sigma))
+    modelSeeds = spawn_seeds(modelsSeed, len(models))
+    # The arguments shared by all models are installed in each worker once.
+    modelArgs = (trialConditions, numSimulations, histBins, dataHistLeft,
+                 dataHistRight, histogramMethod, noiseBank)
+    with WorkerPool(numThreads, threadBudget=threadBudget,
+                    residentData={u"modelArgs": modelArgs}) as pool:
+        if verbose:
+            print(u"Worker layout: " + pool.get_layout_description())
+        logLikelihoods = pool.map(
+            wrap_ddm_get_model_log_likelihood,
+            [(pool.poolId, model, modelSeed)
+             for model, modelSeed in zip(models, modelSeeds)])
 
     if verbose:
         for i, model in enumerate(models):
@@ -30,16 +30,21 @@ recovered through a maximum a posteriori estimation procedure.
 
 from __future__ import absolute_import, division
 
+import numpy as np
 import pkg_resources
 
-from builtins import range, str
+from builtins import range, str, zip
 
 from .ddm import DDMTrial, DDM
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
 from .util import load_trial_conditions_from_csv
 
 
 def main(d, sigma, rangeD, rangeSigma, trialsFileName=None,
-         trialsPerCondition=800, numThreads=9, verbose=False):
+         trialsPerCondition=800, numThreads=9, verbose=False,
+         backend=u"process", threadBudget=None, seed=None,
+         simulationMethod=u"steps"):
     """
     Args:
       d: float, DDM parameter for generating artificial data.
@@ -50,7 +55,18 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None,
       trialsPerCondition: int, number of artificial data trials to be
           generated per trial condition.
       numThreads: int, size of the thread pool.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
       verbose: boolean, whether or not to increase output verbosity.
+      seed: int, seed of the random streams used to generate the artificial
+          data, one for each trial condition. If not provided, the global
+          numpy random state is used.
+      simulationMethod: string, one of {'steps', 'distribution'}, method used
+          to generate the artificial data. See DDM.simulate_trial().
     """
     # Load trial conditions.
     if not trialsFileName:
@@ -61,15 +77,20 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None,
     # Generate artificial data.
     model = DDM(d, sigma)
     trials = list()
-    for (valueLeft, valueRight) in trialConditions:
-        for t in range(trialsPerCondition):
-            try:
-                trials.append(model.simulate_trial(valueLeft, valueRight))
-            except:
-                print(u"An exception occurred while generating artificial "
-                      "trial " + str(t) + u" for condition (" +
-                      str(valueLeft) + u", " + str(valueRight) + u").")
-                raise
+    conditionSeeds = spawn_seeds(seed, len(trialConditions))
+    for (valueLeft, valueRight), conditionSeed in zip(trialConditions,
+                                                      conditionSeeds):
+        try:
+            batch = model.simulate_trials(valueLeft, valueRight,
+                                          trialsPerCondition,
+                                          rng=get_generator(conditionSeed),
+                                          simulationMethod=simulationMethod)
+        except:
+            print(u"An exception occurred while generating artificial "
+                  "trials for condition (" + str(valueLeft) + u", " +
+                  str(valueRight) + u").")
+            raise
+        trials.extend(batch.to_trials())
 
     # Get likelihoods for all models and all artificial trials.
     numModels = len(rangeD) * len(rangeSigma)
@@ -79,18 +100,26 @@ def main(d, sigma, rangeD, rangeSigma, trialsFileName=None,
     for d in rangeD:
         for sigma in rangeSigma:
             model = DDM(d, sigma)
-            if verbose:
-                print(u"Computing likelihoods for model " + str(model.params) +
-                      u"...")
-            try:
-                likelihoods[model.params] = model.parallel_get_likelihoods(
-                    trials, numThreads=numThreads)
-            except:
-                print(u"An exception occurred during the likelihood "
-                      "computations for model " + str(model.params) + u".")
-                raise
             models.append(model)
             posteriors[model.params] = 1 / numModels
+    if verbose:
+        print(u"Computing likelihoods for " + str(numModels) + u" models...")
+    with WorkerPool(numThreads, trials=trials, backend=backend,
+                    threadBudget=threadBudget) as pool:
+        if verbose:
+            print(u"Worker layout: " + pool.get_layout_description())
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+            print(u"Estimated grid runtime: " + str(int(np.ceil(seconds))) +
+                  u" seconds, for " + str(int(totalCost)) + u" state "
+                  "transitions.")
+        try:
+            gridLikelihoods = pool.get_grid_likelihoods(models)
+        except:
+            print(u"An exception occurred during the likelihood "
+                  "computations for the model grid.")
+            raise
+    for m, model in enumerate(models):
+        likelihoods[model.params] = gridLikelihoods[m, :]
 
     # Compute the posteriors.
     for t in range(len(trials)):
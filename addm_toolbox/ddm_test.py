@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: ddm_test.py
+
+Unit tests for the ddm.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import unittest
+
+from .ddm import (DDM, DDMTrial, SimulationBatch, concatenate_batches,
+                  get_batch_from_trials)
+from .ddm_mla import DDM as MLADDM, sample_noise_bank, simulate_from_bank
+from .rng import get_generator
+
+
+def make_batch(withFixations=True):
+    """
+    Builds a batch of three trials with 2, 1 and 3 fixations, respectively.
+    """
+    RT = np.array([100, 200, 300])
+    choice = np.array([-1, 1, -1])
+    valueLeft = np.array([1, 2, 3])
+    valueRight = np.array([0, 1, 2])
+    if not withFixations:
+        return SimulationBatch(RT, choice, valueLeft, valueRight)
+    return SimulationBatch(
+        RT, choice, valueLeft, valueRight,
+        fixOffsets=np.array([0, 2, 3, 6]),
+        fixItem=np.array([1, 2, 1, 2, 1, 2]),
+        fixTime=np.array([10, 20, 30, 40, 50, 60]),
+        fixRDV=np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6]),
+        uninterruptedLastFixTime=np.array([25, 35, 65]))
+
+
+def assert_same_distribution(batch1, batch2, numStandardErrors=4):
+    """
+    Checks that two sets of simulated trials have the same probability of a
+    left choice and the same mean response time, within a number of standard
+    errors of the difference.
+    """
+    for values1, values2 in [(batch1.choice == -1, batch2.choice == -1),
+                             (batch1.RT, batch2.RT)]:
+        standardError = np.sqrt(np.var(values1) / values1.size +
+                                np.var(values2) / values2.size)
+        np.testing.assert_allclose(np.mean(values1), np.mean(values2),
+                                   rtol=0,
+                                   atol=numStandardErrors * standardError)
+
+
+class TestSimulationBatch(unittest.TestCase):
+    def test_get_trial_by_index(self):
+        batch = make_batch()
+        trial = batch[2]
+
+        self.assertEqual(300, trial.RT)
+        self.assertEqual(-1, trial.choice)
+        self.assertEqual(3, trial.valueLeft)
+        self.assertEqual(2, trial.valueRight)
+        np.testing.assert_array_equal([2, 1, 2], trial.fixItem)
+        np.testing.assert_array_equal([40, 50, 60], trial.fixTime)
+        np.testing.assert_array_equal([0.4, 0.5, 0.6], trial.fixRDV)
+        self.assertEqual(65, trial.uninterruptedLastFixTime)
+
+    def test_get_trial_by_negative_index(self):
+        batch = make_batch()
+        trial = batch[-3]
+
+        self.assertEqual(100, trial.RT)
+        np.testing.assert_array_equal([10, 20], trial.fixTime)
+
+    def test_get_trial_out_of_range(self):
+        batch = make_batch()
+        self.assertRaises(IndexError, batch.__getitem__, 3)
+        self.assertRaises(IndexError, batch.__getitem__, -4)
+
+    def test_select_slice(self):
+        batch = make_batch()[1:]
+
+        self.assertEqual(2, len(batch))
+        np.testing.assert_array_equal([200, 300], batch.RT)
+        np.testing.assert_array_equal([0, 1, 4], batch.fixOffsets)
+        np.testing.assert_array_equal([30, 40, 50, 60], batch.fixTime)
+        np.testing.assert_array_equal([35, 65],
+                                      batch.uninterruptedLastFixTime)
+
+    def test_select_index_array(self):
+        batch = make_batch()[np.array([2, 0])]
+
+        np.testing.assert_array_equal([300, 100], batch.RT)
+        np.testing.assert_array_equal([0, 3, 5], batch.fixOffsets)
+        np.testing.assert_array_equal([2, 1, 2, 1, 2], batch.fixItem)
+        np.testing.assert_array_equal([40, 50, 60, 10, 20], batch.fixTime)
+        np.testing.assert_array_equal([0.4, 0.5, 0.6, 0.1, 0.2],
+                                      batch.fixRDV)
+
+    def test_select_mask(self):
+        batch = make_batch()
+        selected = batch[batch.choice == -1]
+
+        np.testing.assert_array_equal([100, 300], selected.RT)
+        np.testing.assert_array_equal([1, 3], selected.valueLeft)
+        np.testing.assert_array_equal([0, 2, 5], selected.fixOffsets)
+        np.testing.assert_array_equal([10, 20, 40, 50, 60],
+                                      selected.fixTime)
+
+    def test_select_without_fixations(self):
+        batch = make_batch(withFixations=False)[np.array([True, False, True])]
+
+        self.assertIsNone(batch.fixOffsets)
+        np.testing.assert_array_equal([100, 300], batch.RT)
+        np.testing.assert_array_equal([0, 2], batch.valueRight)
+
+    def test_iterate(self):
+        batch = make_batch()
+        trials = list(batch)
+
+        self.assertEqual(3, len(trials))
+        self.assertEqual([100, 200, 300], [trial.RT for trial in trials])
+        np.testing.assert_array_equal([30], trials[1].fixTime)
+
+
+class TestConcatenateBatches(unittest.TestCase):
+    def test_concatenate_with_fixations(self):
+        batch = make_batch()
+        joined = concatenate_batches([batch[:1], batch[1:2], batch[2:]])
+
+        np.testing.assert_array_equal(batch.RT, joined.RT)
+        np.testing.assert_array_equal(batch.choice, joined.choice)
+        np.testing.assert_array_equal(batch.fixOffsets, joined.fixOffsets)
+        np.testing.assert_array_equal(batch.fixItem, joined.fixItem)
+        np.testing.assert_array_equal(batch.fixTime, joined.fixTime)
+        np.testing.assert_array_equal(batch.fixRDV, joined.fixRDV)
+        np.testing.assert_array_equal(batch.uninterruptedLastFixTime,
+                                      joined.uninterruptedLastFixTime)
+
+    def test_concatenate_keeps_order(self):
+        batch = make_batch()
+        joined = concatenate_batches([batch[2:], batch[:2]])
+
+        np.testing.assert_array_equal([300, 100, 200], joined.RT)
+        np.testing.assert_array_equal([0, 3, 5, 6], joined.fixOffsets)
+        np.testing.assert_array_equal([40, 50, 60, 10, 20, 30],
+                                      joined.fixTime)
+
+    def test_concatenate_without_fixations(self):
+        batch = make_batch(withFixations=False)
+        joined = concatenate_batches([batch, batch])
+
+        self.assertIsNone(joined.fixOffsets)
+        np.testing.assert_array_equal([100, 200, 300, 100, 200, 300],
+                                      joined.RT)
+
+
+class TestNoiseBank(unittest.TestCase):
+    def setUp(self):
+        self.trialConditions = [(0, 0), (3, 1)]
+        self.histBins = list(range(0, 5001, 100))
+
+    def simulate_by_steps(self, drift, noise, sigma, barrier, timeStep=10):
+        # Reference simulation, one trial and one time step at a time.
+        RT = list()
+        choice = list()
+        for trialNoise in noise:
+            RDV = 0
+            for step in range(trialNoise.size):
+                RDV += drift + sigma * trialNoise[step]
+                if RDV >= barrier or RDV <= -barrier:
+                    RT.append((step + 1) * timeStep)
+                    choice.append(-1 if RDV >= barrier else 1)
+                    break
+        return np.array(RT), np.array(choice)
+
+    def test_seeded_bank_reproducible(self):
+        bank1 = sample_noise_bank(self.trialConditions, 20, 1000, rng=4)
+        bank2 = sample_noise_bank(self.trialConditions, 20, 1000, rng=4)
+
+        for trialCondition in self.trialConditions:
+            self.assertEqual((20, 100), bank1[trialCondition].shape)
+            np.testing.assert_array_equal(bank1[trialCondition],
+                                          bank2[trialCondition])
+
+    def test_simulate_from_bank_matches_step_simulation(self):
+        noise = sample_noise_bank([(3, 1)], 200, 5000, rng=5)[(3, 1)]
+        drift = 0.006 * 2
+        batch = simulate_from_bank(3, 1, np.full(noise.shape[1], drift),
+                                   noise, 0.07, 1, blockSize=30)
+        RT, choice = self.simulate_by_steps(drift, noise, 0.07, 1)
+
+        np.testing.assert_array_equal(RT, batch.RT)
+        np.testing.assert_array_equal(choice, batch.choice)
+        np.testing.assert_array_equal(np.full(RT.size, 3), batch.valueLeft)
+
+    def test_simulate_from_bank_independent_of_block_size(self):
+        noise = sample_noise_bank([(0, 0)], 200, 5000, rng=6)[(0, 0)]
+        drift = np.zeros(noise.shape[1])
+        batch1 = simulate_from_bank(0, 0, drift, noise, 0.07, 1,
+                                    blockSize=7)
+        batch2 = simulate_from_bank(0, 0, drift, noise, 0.07, 1,
+                                    blockSize=500)
+
+        np.testing.assert_array_equal(batch1.RT, batch2.RT)
+        np.testing.assert_array_equal(batch1.choice, batch2.choice)
+
+    def test_same_bank_same_histograms(self):
+        bank = sample_noise_bank(self.trialConditions, 200, 5000, rng=7)
+        model = MLADDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+
+        for (valueLeft, valueRight) in self.trialConditions:
+            noise = bank[(valueLeft, valueRight)]
+            histLeft1, histRight1 = model.get_bank_histograms(
+                valueLeft, valueRight, self.histBins, noise)
+            histLeft2, histRight2 = model.get_bank_histograms(
+                valueLeft, valueRight, self.histBins, noise)
+            np.testing.assert_array_equal(histLeft1, histLeft2)
+            np.testing.assert_array_equal(histRight1, histRight2)
+            self.assertAlmostEqual(1, np.sum(histLeft1))
+            self.assertAlmostEqual(1, np.sum(histRight1))
+            # No decisions are made during the non-decision time.
+            self.assertEqual(0, histLeft1[0] + histRight1[0])
+
+
+class TestPropagationHistograms(unittest.TestCase):
+    def setUp(self):
+        self.model = MLADDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+        self.histBins = list(range(0, 1001, 100))
+
+    def test_last_bin_includes_max_rt(self):
+        distribution = DDM(d=0.006, sigma=0.07,
+                           nonDecisionTime=100).predict_distribution(
+                               3, 1, maxRT=5000)
+        histLeft1, histRight1 = distribution.get_histograms(self.histBins)
+        histLeft2, histRight2 = self.model.get_propagation_histograms(
+            3, 1, self.histBins)
+
+        np.testing.assert_allclose(histLeft1, histLeft2)
+        np.testing.assert_allclose(histRight1, histRight2)
+
+    def test_matches_simulation_histograms(self):
+        for (valueLeft, valueRight) in [(3, 1), (1, 1)]:
+            batch = DDM(d=0.006, sigma=0.07,
+                        nonDecisionTime=100).simulate_conditions(
+                            [(valueLeft, valueRight)], 20000, rng=8)
+            simulHists = batch.get_histograms(self.histBins)
+            propHists = self.model.get_propagation_histograms(
+                valueLeft, valueRight, self.histBins)
+
+            for choice, simulHist, propHist in zip([-1, 1], simulHists,
+                                                   propHists):
+                inRange = ((batch.choice == choice) &
+                           (batch.RT <= self.histBins[-1]))
+                standardError = np.sqrt(propHist * (1 - propHist) /
+                                        np.count_nonzero(inRange))
+                np.testing.assert_array_less(np.absolute(simulHist -
+                                                         propHist),
+                                             4 * standardError + 1e-3)
+
+
+class TestSimulateConditions(unittest.TestCase):
+    def setUp(self):
+        self.model = DDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+
+    def simulate_by_trial(self, valueLeft, valueRight, numTrials, seed):
+        rng = get_generator(seed)
+        return get_batch_from_trials(
+            [self.model.simulate_trial(valueLeft, valueRight, rng=rng)
+             for _ in range(numTrials)])
+
+    def test_matches_simulate_trial(self):
+        for (valueLeft, valueRight) in [(3, 1), (1, 1)]:
+            batch = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], 3000, rng=1)
+            assert_same_distribution(
+                self.simulate_by_trial(valueLeft, valueRight, 1500, 2),
+                batch)
+
+    def test_independent_of_block_size(self):
+        batch1 = self.model.simulate_conditions([(2, 1)], 3000, blockSize=1,
+                                                rng=3)
+        batch2 = self.model.simulate_conditions([(2, 1)], 3000,
+                                                blockSize=100, rng=4)
+        assert_same_distribution(batch1, batch2)
+
+    def test_seeded_batches_reproducible(self):
+        batch1 = self.model.simulate_conditions([(1, 2), (2, 1)], 50, rng=6)
+        batch2 = self.model.simulate_conditions([(1, 2), (2, 1)], 50, rng=6)
+
+        np.testing.assert_array_equal(batch1.RT, batch2.RT)
+        np.testing.assert_array_equal(batch1.choice, batch2.choice)
+        np.testing.assert_array_equal(np.repeat([1, 2], 50),
+                                      batch1.valueLeft)
+
+
+class TestTransitionTables(unittest.TestCase):
+    def setUp(self):
+        self.trials = [DDMTrial(RT, choice, valueLeft, valueRight)
+                       for (RT, choice, valueLeft, valueRight)
+                       in [(500, -1, 3, 1), (1200, 1, 1, 1), (300, 1, 0, 2),
+                           (2000, -1, 2, 1), (800, 1, 3, 1)]]
+
+    def get_likelihoods(self, model):
+        return np.array([model.get_trial_likelihood(trial)
+                         for trial in self.trials])
+
+    def get_barriers(self, numTimeSteps, decay):
+        barrierUp = 1 / (1 + decay * np.arange(numTimeSteps))
+        return barrierUp, -barrierUp
+
+    def test_cached_likelihoods_match_uncached(self):
+        model = DDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+        likelihoods = self.get_likelihoods(model)
+
+        self.assertTrue(model._transitionTables)
+        np.testing.assert_array_equal(likelihoods,
+                                      self.get_likelihoods(model))
+        for trial, likelihood in zip(self.trials, likelihoods):
+            uncachedModel = DDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+            self.assertEqual(likelihood,
+                             uncachedModel.get_trial_likelihood(trial))
+
+    def test_tables_rebuilt_for_new_sigma(self):
+        model = DDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+        self.get_likelihoods(model)
+        model.sigma = 0.09
+
+        np.testing.assert_array_equal(
+            self.get_likelihoods(DDM(d=0.006, sigma=0.09,
+                                     nonDecisionTime=100)),
+            self.get_likelihoods(model))
+
+    def test_collapsing_tables_rebuilt_for_longer_trials(self):
+        model = DDM(d=0.006, sigma=0.07)
+        states = np.linspace(-0.95, 0.95, 20)
+        for numTimeSteps in [1, 10, 50, 30]:
+            barrierUp, barrierDown = self.get_barriers(numTimeSteps, 0.01)
+            tables = model.get_transition_tables(0.01, states, 0.1,
+                                                 barrierUp, barrierDown)
+            uncachedTables = DDM(d=0.006, sigma=0.07).get_transition_tables(
+                0.01, states, 0.1, barrierUp, barrierDown)
+
+            self.assertEqual((states.size, numTimeSteps), tables[1].shape)
+            for table, uncachedTable in zip(tables, uncachedTables):
+                np.testing.assert_array_equal(uncachedTable, table)
+
+    def test_tables_rebuilt_for_new_barrier_decay(self):
+        model = DDM(d=0.006, sigma=0.07)
+        states = np.linspace(-0.95, 0.95, 20)
+        model.get_transition_tables(0.01, states, 0.1,
+                                    *self.get_barriers(50, 0.01))
+        tables = model.get_transition_tables(0.01, states, 0.1,
+                                             *self.get_barriers(30, 0.02))
+        uncachedTables = DDM(d=0.006, sigma=0.07).get_transition_tables(
+            0.01, states, 0.1, *self.get_barriers(30, 0.02))
+
+        for table, uncachedTable in zip(tables, uncachedTables):
+            np.testing.assert_array_equal(uncachedTable, table)
+
+
+class TestTrialCost(unittest.TestCase):
+    def test_cost_scales_with_time_steps_and_states(self):
+        model = DDM(d=0.006, sigma=0.07)
+        trial = DDMTrial(1000, -1, 3, 1)
+
+        # 21 states and 100 time steps.
+        self.assertEqual(21 ** 2 * 100, model.get_trial_cost(trial))
+        self.assertEqual(2 * model.get_trial_cost(trial),
+                         model.get_trial_cost(DDMTrial(2000, -1, 3, 1)))
+        self.assertEqual(41 ** 2 * 100,
+                         model.get_trial_cost(trial, approxStateStep=0.05))
+        self.assertEqual(21 ** 2 * 50,
+                         model.get_trial_cost(trial, timeStep=20))
+
+    def test_short_trial_costs_one_time_step(self):
+        model = DDM(d=0.006, sigma=0.07)
+        self.assertEqual(21 ** 2,
+                         model.get_trial_cost(DDMTrial(5, 1, 3, 1)))
+
+
+class TestCrossingProbabilities(unittest.TestCase):
+    def test_batch_matches_single_sequences(self):
+        model = DDM(d=0.006, sigma=0.07)
+        rng = np.random.RandomState(1)
+        drifts = rng.choice([-0.01, 0, 0.004, 0.02], size=(6, 40))
+        drifts[0, :] = 0.004
+        probUp, probDown = model.get_crossing_probabilities(drifts)
+
+        self.assertEqual((6, 41), probUp.shape)
+        for k in range(drifts.shape[0]):
+            singleUp, singleDown = DDM(
+                d=0.006, sigma=0.07).get_crossing_probabilities(drifts[k])
+            np.testing.assert_allclose(singleUp[0], probUp[k], atol=1e-15)
+            np.testing.assert_allclose(singleDown[0], probDown[k],
+                                       atol=1e-15)
+
+
+class TestFirstPassage(unittest.TestCase):
+    def setUp(self):
+        self.model = DDM(d=0.006, sigma=0.07, nonDecisionTime=100)
+
+    def test_table_is_cumulative_distribution(self):
+        cumProbs = self.model.get_first_passage_table(3, 1)
+
+        self.assertEqual(0, cumProbs.size % 2)
+        self.assertTrue(np.all(np.diff(cumProbs) >= 0))
+        self.assertAlmostEqual(1, cumProbs[-1])
+        self.assertIs(cumProbs, self.model.get_first_passage_table(3, 1))
+
+    def test_sample_single_trial(self):
+        RT, choice = self.model.sample_first_passage(3, 1, rng=1)
+        self.assertIsInstance(RT, int)
+        self.assertIn(choice, [-1, 1])
+        self.assertEqual(0, RT % 10)
+
+    def test_distribution_matches_steps(self):
+        for (valueLeft, valueRight) in [(3, 1), (1, 1), (0, 2)]:
+            batch1 = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], 3000, rng=2)
+            batch2 = self.model.simulate_conditions(
+                [(valueLeft, valueRight)], 3000, rng=3,
+                simulationMethod=u"distribution")
+            assert_same_distribution(batch1, batch2)
+
+    def test_simulate_trial_with_distribution(self):
+        rng = get_generator(4)
+        trials = [self.model.simulate_trial(3, 1, rng=rng,
+                                            simulationMethod=u"distribution")
+                  for _ in range(1500)]
+        batch = self.model.simulate_conditions([(3, 1)], 3000, rng=5)
+        assert_same_distribution(get_batch_from_trials(trials), batch)
+
+    def test_invalid_simulation_method(self):
+        self.assertRaises(RuntimeError, self.model.simulate_conditions,
+                          [(3, 1)], 10, simulationMethod=u"bridge")
+
+
+class TestAdvanceRDV(unittest.TestCase):
+    def setUp(self):
+        self.model = DDM(d=0.006, sigma=0.07)
+
+    def advance_by_steps(self, RDVs, mean, numSteps, seed):
+        rng = get_generator(seed)
+        RDVs = RDVs.copy()
+        crossingSteps = np.zeros(RDVs.size, dtype=int)
+        for t in range(numSteps):
+            active = crossingSteps == 0
+            RDVs[active] += rng.normal(mean, self.model.sigma,
+                                       np.count_nonzero(active))
+            hit = active & (np.absolute(RDVs) >= self.model.barrier)
+            crossingSteps[hit] = t + 1
+        return RDVs, crossingSteps
+
+    def test_bridge_ends_inside_barriers_without_crossing(self):
+        RDVs = np.linspace(-0.98, 0.98, 2000)
+        numSteps = np.full(RDVs.size, 5)
+        endRDVs, crossingSteps = self.model.advance_rdvs(
+            RDVs, np.full(RDVs.size, 0.02), numSteps, rng=1)
+
+        crossed = crossingSteps > 0
+        self.assertTrue(np.any(crossed))
+        self.assertTrue(np.all(np.absolute(endRDVs[~crossed]) <
+                               self.model.barrier))
+        self.assertTrue(np.all(np.absolute(endRDVs[crossed]) >=
+                               self.model.barrier))
+        self.assertTrue(np.all(crossingSteps <= numSteps))
+
+    def test_bridge_matches_steps(self):
+        RDVs = np.zeros(4000)
+        mean = 0.012
+        endRDVs1, crossingSteps1 = self.advance_by_steps(RDVs, mean, 600, 2)
+        endRDVs2, crossingSteps2 = self.model.advance_rdvs(
+            RDVs, np.full(RDVs.size, mean), np.full(RDVs.size, 600), rng=3)
+
+        for values1, values2 in [(endRDVs1 > 0, endRDVs2 > 0),
+                                 (crossingSteps1, crossingSteps2)]:
+            standardError = np.sqrt(np.var(values1) / values1.size +
+                                    np.var(values2) / values2.size)
+            np.testing.assert_allclose(np.mean(values1), np.mean(values2),
+                                       rtol=0, atol=4 * standardError)
+
+    def test_single_rdv_bridge(self):
+        rng = get_generator(4)
+        for _ in range(200):
+            RDV, crossingStep = self.model.advance_rdv(
+                0.9, 0.01, 20, u"bridge", rng)
+            if crossingStep is None:
+                self.assertLess(abs(RDV), self.model.barrier)
+            else:
+                self.assertGreaterEqual(abs(RDV), self.model.barrier)
+                self.assertTrue(1 <= crossingStep <= 20)
@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: distributed.py
+
+Distributed execution of grid likelihoods and simulations across several
+hosts. A coordinator, running in the process of a model fitting script, serves
+tasks through a multiprocessing manager. Worker processes started with the
+addm_worker script on any host connect to it, fetch the data trials once, and
+request tasks until the coordinator is closed. Workers send heartbeats while
+running a task, and tasks whose worker stops responding are re-queued.
+
+The manager unpickles the messages it receives and workers run the functions
+named by their tasks, so anyone who can connect with the authentication key
+can run code on the coordinator and on the workers. The coordinator listens on
+localhost and uses a random key by default; only listen on other interfaces
+within a trusted network.
+"""
+
+from __future__ import absolute_import, division
+
+import binascii
+import numpy as np
+import os
+import socket
+import threading
+import time
+import traceback
+
+from builtins import range, str, zip
+from collections import deque
+from multiprocessing.managers import BaseManager
+
+from . import parallel
+from .parallel import (get_resident_unit_likelihoods, get_simulation_tasks,
+                       simulate_batch, skip_simulation_tasks,
+                       split_trials_by_cost)
+
+
+class TaskBoard(object):
+    """
+    Shared state of the coordinator, which lives in the manager's server
+    process and is accessed by the coordinator and the workers through
+    manager proxies. All methods are thread-safe, since the manager serves
+    each connection in its own thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trials = None
+        self.trialsVersion = 0
+        self.pending = deque()
+        self.running = dict()
+        self.results = dict()
+        self.errors = dict()
+        # Ids of the tasks whose results have been collected, so that late
+        # duplicates from the original workers of re-queued tasks are dropped.
+        self.completed = set()
+        self.closed = False
+
+
+    def set_trials(self, trials):
+        with self.lock:
+            self.trials = trials
+            self.trialsVersion += 1
+
+
+    def get_trials(self):
+        with self.lock:
+            return self.trialsVersion, self.trials
+
+
+    def add_tasks(self, tasks):
+        """
+        Args:
+          tasks: list of tuples (taskId, function, args).
+        """
+        with self.lock:
+            self.pending.extend(tasks)
+
+
+    def get_task(self, workerId):
+        """
+        Hands out the next pending task to a worker.
+        Args:
+          workerId: string identifying the worker.
+        Returns:
+          A tuple (trialsVersion, taskId, function, args), or None if there
+              are no pending tasks.
+        """
+        with self.lock:
+            if not self.pending:
+                return None
+            task = self.pending.popleft()
+            self.running[task[0]] = (task, workerId, time.time())
+            return (self.trialsVersion,) + tuple(task)
+
+
+    def heartbeat(self, workerId, taskId):
+        with self.lock:
+            if taskId in self.running:
+                task, runningWorkerId, lastSeen = self.running[taskId]
+                if runningWorkerId == workerId:
+                    self.running[taskId] = (task, workerId, time.time())
+
+
+    def put_result(self, workerId, taskId, result):
+        with self.lock:
+            self.running.pop(taskId, None)
+            # A re-queued task may complete more than once; the first result
+            # is kept.
+            if taskId not in self.results and taskId not in self.completed:
+                self.results[taskId] = result
+
+
+    def put_error(self, workerId, taskId, message):
+        with self.lock:
+            self.running.pop(taskId, None)
+            if taskId not in self.results and taskId not in self.completed:
+                self.errors[taskId] = (workerId, message)
+
+
+    def requeue_lost_tasks(self, heartbeatTimeout):
+        """
+        Moves running tasks whose worker has not sent a heartbeat within the
+        timeout back to the front of the pending queue.
+        Args:
+          heartbeatTimeout: float, timeout in seconds.
+        Returns:
+          The number of re-queued tasks.
+        """
+        with self.lock:
+            now = time.time()
+            lost = [taskId for taskId, (task, workerId, lastSeen)
+                    in self.running.items()
+                    if now - lastSeen > heartbeatTimeout]
+            for taskId in lost:
+                task, workerId, lastSeen = self.running.pop(taskId)
+                if (taskId not in self.results and
+                    taskId not in self.completed):
+                    self.pending.appendleft(task)
+            return len(lost)
+
+
+    def pop_results(self, taskIds):
+        """
+        Args:
+          taskIds: list of task ids.
+        Returns:
+          A tuple (results, errors), where results is a list with the results
+              of the given tasks if they have all completed (None otherwise)
+              and errors is a dict with the errors reported for them.
+        """
+        with self.lock:
+            errors = dict((taskId, self.errors[taskId]) for taskId in taskIds
+                          if taskId in self.errors)
+            if errors or any(taskId not in self.results
+                             for taskId in taskIds):
+                return None, errors
+            self.completed.update(taskIds)
+            return [self.results.pop(taskId) for taskId in taskIds], errors
+
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+
+    def is_closed(self):
+        with self.lock:
+            return self.closed
+
+
+# Task board of the coordinator's manager process, created on first use.
+serverTaskBoard = None
+
+
+def get_server_task_board():
+    """
+    Returns the task board served by the coordinator's manager. This method
+    runs in the manager's server process, and should stay at module level,
+    allowing it to be pickled when the server process is spawned.
+    """
+    global serverTaskBoard
+    if serverTaskBoard is None:
+        serverTaskBoard = TaskBoard()
+    return serverTaskBoard
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+CoordinatorManager.register(u"get_task_board",
+                            callable=get_server_task_board)
+
+
+class WorkerManager(BaseManager):
+    pass
+
+
+WorkerManager.register(u"get_task_board")
+
+
+class Coordinator(object):
+    """
+    Coordinator for distributed computation of grid likelihoods and
+    simulations. It can be used in place of a WorkerPool in the model fitting
+    scripts:
+
+        with Coordinator(port=50000, trials=trials) as pool:
+            likelihoods = pool.get_grid_likelihoods(models)
+
+    Workers are started with the key printed by the coordinator:
+
+        addm_worker --host <coordinator host> --port 50000 --auth-key <key>
+    """
+    def __init__(self, host=u"localhost", port=50000, authKey=None,
+                 trials=None, numChunks=64, heartbeatTimeout=60,
+                 pollInterval=0.5, verbose=False):
+        """
+        Args:
+          host: string, address on which to listen for workers. By default,
+              only workers on the same host can connect. An empty string
+              listens on all interfaces, and should only be used within a
+              trusted network.
+          port: int, port on which to listen for workers. If 0, a free port
+              is picked when the coordinator starts.
+          authKey: string, key shared with the workers for authentication. If
+              not provided, a random key is generated and printed when the
+              coordinator starts.
+          trials: list of DDMTrial or aDDMTrial objects to be sent to each
+              worker.
+          numChunks: int, number of chunks into which the trials are split
+              for each model in a grid.
+          heartbeatTimeout: float, time in seconds without a heartbeat after
+              which the task of a worker is considered lost and re-queued.
+          pollInterval: float, time in seconds between checks for completed
+              tasks.
+          verbose: boolean, whether or not to increase output verbosity.
+        """
+        self.host = host
+        self.port = port
+        self.generatedAuthKey = authKey is None
+        if authKey is None:
+            authKey = binascii.hexlify(os.urandom(16)).decode(u"ascii")
+        self.authKey = authKey
+        self.trials = trials
+        self.numChunks = numChunks
+        self.heartbeatTimeout = heartbeatTimeout
+        self.pollInterval = pollInterval
+        self.verbose = verbose
+        self.board = None
+        self.manager = None
+        self.nextTaskId = 0
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+    def start(self):
+        """
+        Starts serving tasks to workers, from a manager server process.
+        """
+        if self.manager is not None:
+            return
+        self.manager = CoordinatorManager(
+            address=(self.host, self.port),
+            authkey=self.authKey.encode(u"utf-8"))
+        self.manager.start()
+        # With port 0, the operating system picks a free port.
+        self.port = self.manager.address[1]
+        self.board = self.manager.get_task_board()
+        if self.trials is not None:
+            self.board.set_trials(self.trials)
+        if self.generatedAuthKey:
+            print(u"Coordinator listening on " + str(self.host) + u":" +
+                  str(self.port) + u", with authentication key " +
+                  self.authKey + u".")
+        elif self.verbose:
+            print(u"Coordinator listening on " + str(self.host) + u":" +
+                  str(self.port) + u".")
+
+
+    def set_trials(self, trials):
+        """
+        Replaces the trials sent to the workers. Workers fetch the new trials
+        before running their next task.
+        Args:
+          trials: list of DDMTrial or aDDMTrial objects.
+        """
+        self.trials = trials
+        if self.board is not None:
+            self.board.set_trials(trials)
+
+
+    def run_tasks(self, function, argsList):
+        """
+        Runs a set of tasks on the workers and waits for all of them to
+        complete.
+        Args:
+          function: a function defined at module level, which the workers
+              call with each item of argsList.
+          argsList: list with the arguments for each task.
+        Returns:
+          A list with the results, in the same order as argsList.
+        """
+        self.start()
+        taskIds = list(range(self.nextTaskId,
+                             self.nextTaskId + len(argsList)))
+        self.nextTaskId += len(argsList)
+        self.board.add_tasks([(taskId, function, args)
+                              for taskId, args in zip(taskIds, argsList)])
+        while True:
+            results, errors = self.board.pop_results(taskIds)
+            if errors:
+                workerId, message = list(errors.values())[0]
+                print(u"An exception occurred in worker " + str(workerId) +
+                      u":\n" + str(message))
+                raise RuntimeError(u"Distributed task failed.")
+            if results is not None:
+                return results
+            numLost = self.board.requeue_lost_tasks(self.heartbeatTimeout)
+            if numLost and self.verbose:
+                print(u"Re-queued " + str(numLost) + u" lost tasks.")
+            time.sleep(self.pollInterval)
+
+
+    def get_grid_likelihoods(self, models, timeStep=10, stateStep=0.1,
+                             numChunks=None):
+        """
+        Computes the likelihood of each of the trials sent to the workers for
+        every model in a grid, with the same work units as
+        WorkerPool.get_grid_likelihoods().
+        Args:
+          models: list of DDM or aDDM objects.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          stateStep: float, to be used for binning the RDV axis.
+          numChunks: int, number of chunks into which the trials are split
+              for each model. If not provided, the coordinator's numChunks is
+              used.
+        Returns:
+          A numpy array of shape (len(models), number of trials).
+        """
+        if self.trials is None:
+            raise RuntimeError(u"No trials were set in the coordinator.")
+        numTrials = len(self.trials)
+        if not models:
+            return np.empty((0, numTrials))
+        if numChunks is None:
+            numChunks = self.numChunks
+        costs = np.array([models[0].get_trial_cost(trial, timeStep, stateStep)
+                          for trial in self.trials], dtype=float)
+        chunks = split_trials_by_cost(costs,
+                                      max(1, min(numTrials, numChunks)))
+
+        units = list()
+        for m, model in enumerate(models):
+            for trialIndices, cost in chunks:
+                units.append((cost, m, model, trialIndices))
+        units.sort(key=lambda unit: -unit[0])
+
+        # Workers install the trials without a pool id (see run_worker()).
+        likelihoods = np.empty((len(models), numTrials))
+        for m, trialIndices, unitLikelihoods in self.run_tasks(
+                get_resident_unit_likelihoods,
+                [(None, m, model, trialIndices, timeStep, stateStep)
+                 for cost, m, model, trialIndices in units]):
+            likelihoods[m, trialIndices] = unitLikelihoods
+        return likelihoods
+
+
+    def simulate_trials(self, model, trialConditions, trialsPerCondition,
+                        fixationData=None, trialsPerTask=100, seed=None,
+                        splitConditions=True, simulationArgs=None):
+        """
+        Generates artificial trials on the workers, with the same tasks used
+        by parallel.WorkerPool.simulate_trials().
+        Args:
+          model: a DDM or aDDM object, or a list of them.
+          trialConditions: list of pairs (valueLeft, valueRight).
+          trialsPerCondition: int, number of trials per trial condition and
+              model, or a list with one such number for each model.
+          fixationData: a FixationData object, required for the aDDM.
+          trialsPerTask: int, maximum number of trials of a trial condition
+              in each task.
+          seed: int or numpy SeedSequence. Each task draws from its own
+              random stream spawned from this seed, so the generated trials
+              do not depend on the number of workers. If not provided, the
+              streams are spawned from fresh entropy.
+          splitConditions: boolean, whether each task covers a single trial
+              condition, or all trial conditions of a model.
+          simulationArgs: dict of additional arguments to the model's
+              simulate_conditions().
+        Returns:
+          A SimulationBatch object, ordered by model and trial condition.
+        """
+        # Imported here, since the ddm module depends on this one.
+        from .ddm import concatenate_batches
+        return concatenate_batches(list(self.iter_simulations(
+            model, trialConditions, trialsPerCondition, fixationData,
+            trialsPerTask, seed, splitConditions, simulationArgs)))
+
+
+    def iter_simulations(self, model, trialConditions, trialsPerCondition,
+                         fixationData=None, trialsPerTask=100, seed=None,
+                         splitConditions=True, simulationArgs=None,
+                         numSkippedTrials=0):
+        """
+        Generates the same artificial trials as Coordinator.simulate_trials(),
+        yielding them one task at a time. Tasks are run in rounds of
+        numChunks tasks, so that only one round of results is held in memory.
+        Args:
+          model, trialConditions, trialsPerCondition, fixationData,
+              trialsPerTask, seed, splitConditions, simulationArgs: see
+              Coordinator.simulate_trials().
+          numSkippedTrials: int, number of trials at the start of the
+              sequence which are not generated again. See
+              parallel.WorkerPool.iter_simulations().
+        Returns:
+          A generator of SimulationBatch objects, ordered by model and trial
+              condition.
+        """
+        argsList = get_simulation_tasks(model, trialConditions,
+                                        trialsPerCondition, fixationData,
+                                        trialsPerTask, splitConditions, seed,
+                                        simulationArgs)
+        argsList, numSkipped = skip_simulation_tasks(argsList,
+                                                     numSkippedTrials)
+        for start in range(0, len(argsList), self.numChunks):
+            for batch in self.run_tasks(
+                    simulate_batch, argsList[start:start + self.numChunks]):
+                if numSkipped:
+                    batch = batch[numSkipped:]
+                    numSkipped = 0
+                yield batch
+
+
+    def close(self):
+        """
+        Tells the workers to exit and stops serving. The manager's server
+        process is shut down, which closes its listening socket.
+        """
+        if self.manager is None:
+            return
+        self.board.close()
+        # Give polling workers a chance to see the board is closed.
+        time.sleep(self.pollInterval)
+        self.board = None
+        self.manager.shutdown()
+        self.manager = None
+
+
+def send_heartbeats(board, workerId, taskId, done, heartbeatInterval):
+    """
+    Sends heartbeats for a running task until it is done.
+    Args:
+      board: proxy of the coordinator's TaskBoard.
+      workerId: string identifying the worker.
+      taskId: id of the running task.
+      done: threading.Event, set when the task is done.
+      heartbeatInterval: float, time in seconds between heartbeats.
+    """
+    while not done.wait(heartbeatInterval):
+        try:
+            board.heartbeat(workerId, taskId)
+        except (EOFError, IOError):
+            return
+
+
+def run_worker(host, port, authKey, heartbeatInterval=10, pollInterval=0.5,
+               connectTimeout=600, verbose=False):
+    """
+    Connects to a coordinator and runs its tasks until the coordinator is
+    closed.
+    Args:
+      host: string, address of the coordinator.
+      port: int, port of the coordinator.
+      authKey: string, key shared with the coordinator for authentication,
+          as printed by the coordinator.
+      heartbeatInterval: float, time in seconds between heartbeats sent while
+          running a task. Must be smaller than the coordinator's
+          heartbeatTimeout.
+      pollInterval: float, time in seconds between requests when there are no
+          pending tasks, or between connection attempts.
+      connectTimeout: float, time in seconds during which to keep trying to
+          connect to the coordinator.
+      verbose: boolean, whether or not to increase output verbosity.
+    """
+    workerId = socket.gethostname() + u":" + str(os.getpid())
+    manager = WorkerManager(address=(host, port),
+                            authkey=authKey.encode(u"utf-8"))
+    # Workers may be started before the coordinator is listening.
+    startTime = time.time()
+    while True:
+        try:
+            manager.connect()
+            break
+        except IOError:
+            if time.time() - startTime > connectTimeout:
+                print(u"Worker " + workerId + u" could not connect to " +
+                      str(host) + u":" + str(port) + u".")
+                raise
+            time.sleep(pollInterval)
+
+    trialsVersion = None
+    numTasks = 0
+    try:
+        board = manager.get_task_board()
+        if verbose:
+            print(u"Worker " + workerId + u" connected to " + str(host) +
+                  u":" + str(port) + u".")
+        while not board.is_closed():
+            task = board.get_task(workerId)
+            if task is None:
+                time.sleep(pollInterval)
+                continue
+            currentVersion, taskId, function, args = task
+            if currentVersion != trialsVersion:
+                trialsVersion, trials = board.get_trials()
+                parallel.install_trials(trials)
+
+            # Heartbeats are sent from a separate thread, which gets its own
+            # connection to the manager.
+            done = threading.Event()
+            heartbeatThread = threading.Thread(
+                target=send_heartbeats,
+                args=(board, workerId, taskId, done, heartbeatInterval))
+            heartbeatThread.daemon = True
+            heartbeatThread.start()
+
+            try:
+                result = function(args)
+            except:
+                done.set()
+                board.put_error(workerId, taskId, traceback.format_exc())
+                continue
+            done.set()
+            board.put_result(workerId, taskId, result)
+            numTasks += 1
+    except (EOFError, IOError):
+        # The coordinator stopped serving.
+        pass
+
+    if verbose:
+        print(u"Worker " + workerId + u" finished after " + str(numTasks) +
+              u" tasks.")
+
+
+def main(host, port, authKey, heartbeatInterval=10, connectTimeout=600,
+         verbose=False):
+    """
+    Args:
+      host: string, address of the coordinator.
+      port: int, port of the coordinator.
+      authKey: string, key shared with the coordinator for authentication,
+          as printed by the coordinator.
+      heartbeatInterval: float, time in seconds between heartbeats.
+      connectTimeout: float, time in seconds during which to keep trying to
+          connect to the coordinator.
+      verbose: boolean, whether or not to increase output verbosity.
+    """
+    run_worker(host, port, authKey, heartbeatInterval,
+               connectTimeout=connectTimeout, verbose=verbose)
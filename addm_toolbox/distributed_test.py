@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: distributed_test.py
+
+Unit tests for the distributed.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from multiprocessing import Process
+
+from . import distributed
+from .addm import FixationData, aDDM
+from .distributed import Coordinator, TaskBoard
+from .parallel import WorkerPool
+
+
+def exit_on_first_attempt(args):
+    """
+    Task which kills its worker the first time it runs, and returns twice its
+    value afterwards.
+    """
+    markerFileName, value = args
+    if not os.path.isfile(markerFileName):
+        open(markerFileName, u"w").close()
+        os._exit(1)
+    return 2 * value
+
+
+def make_fixation_data():
+    fixations = dict()
+    for fixNumber in range(1, 4):
+        fixations[fixNumber] = np.array([200, 400, 600])
+    return FixationData(
+        probFixLeftFirst=0.5, latencies=np.array([100, 200]),
+        transitions=np.array([20, 40]), fixations=fixations,
+        fixDistType=u"simple")
+
+
+class TestTaskBoard(unittest.TestCase):
+    def setUp(self):
+        self.board = TaskBoard()
+        self.board.set_trials([u"trial"])
+        self.board.add_tasks([(0, len, (u"a",)), (1, len, (u"bb",)),
+                              (2, len, (u"ccc",))])
+
+    def expire(self, taskId):
+        # Backdates the last heartbeat of a running task.
+        task, workerId, lastSeen = self.board.running[taskId]
+        self.board.running[taskId] = (task, workerId, lastSeen - 100)
+
+    def test_tasks_handed_out_in_order(self):
+        self.assertEqual((1, 0, len, (u"a",)), self.board.get_task(u"w1"))
+        self.assertEqual((1, 1, len, (u"bb",)), self.board.get_task(u"w2"))
+        self.assertEqual((1, 2, len, (u"ccc",)), self.board.get_task(u"w1"))
+        self.assertIsNone(self.board.get_task(u"w2"))
+
+    def test_requeue_lost_task_to_front(self):
+        self.board.get_task(u"w1")
+        self.board.get_task(u"w2")
+        self.expire(0)
+
+        self.assertEqual(1, self.board.requeue_lost_tasks(10))
+        self.assertEqual(0, self.board.get_task(u"w3")[1])
+        self.assertEqual(2, self.board.get_task(u"w3")[1])
+
+    def test_heartbeat_keeps_task_running(self):
+        self.board.get_task(u"w1")
+        self.expire(0)
+        self.board.heartbeat(u"w1", 0)
+
+        self.assertEqual(0, self.board.requeue_lost_tasks(10))
+        self.assertIn(0, self.board.running)
+
+    def test_heartbeat_from_other_worker_ignored(self):
+        self.board.get_task(u"w1")
+        self.expire(0)
+        self.board.heartbeat(u"w2", 0)
+
+        self.assertEqual(1, self.board.requeue_lost_tasks(10))
+
+    def test_first_result_wins(self):
+        self.board.get_task(u"w1")
+        self.expire(0)
+        self.board.requeue_lost_tasks(10)
+        self.board.get_task(u"w2")
+
+        self.board.put_result(u"w2", 0, u"second worker")
+        self.board.put_result(u"w1", 0, u"first worker")
+        results, errors = self.board.pop_results([0])
+        self.assertEqual([u"second worker"], results)
+        self.assertEqual({}, errors)
+
+    def test_completed_task_not_requeued(self):
+        self.board.get_task(u"w1")
+        self.expire(0)
+        self.board.requeue_lost_tasks(10)
+        task = self.board.get_task(u"w2")
+        self.board.put_result(u"w2", 0, 1)
+        # The original worker is still considered to be running the task.
+        self.board.running[0] = (task[1:], u"w1", 0)
+
+        self.assertEqual(1, self.board.requeue_lost_tasks(10))
+        self.assertEqual(1, self.board.get_task(u"w3")[1])
+
+    def test_late_result_after_pop_dropped(self):
+        self.board.get_task(u"w1")
+        self.expire(0)
+        self.board.requeue_lost_tasks(10)
+        self.board.get_task(u"w2")
+        self.board.put_result(u"w2", 0, 1)
+        self.assertEqual(([1], {}), self.board.pop_results([0]))
+
+        self.board.put_result(u"w1", 0, 2)
+        self.board.put_error(u"w1", 0, u"Traceback")
+        self.assertEqual({}, self.board.results)
+        self.assertEqual({}, self.board.errors)
+
+    def test_pop_results_waits_for_all_tasks(self):
+        self.board.put_result(u"w1", 0, 1)
+        self.assertEqual((None, {}), self.board.pop_results([0, 1]))
+
+        self.board.put_result(u"w1", 1, 2)
+        self.assertEqual(([1, 2], {}), self.board.pop_results([0, 1]))
+        self.assertEqual((None, {}), self.board.pop_results([0]))
+
+    def test_pop_results_reports_errors(self):
+        self.board.put_result(u"w1", 0, 1)
+        self.board.put_error(u"w2", 1, u"Traceback")
+
+        self.assertEqual((None, {1: (u"w2", u"Traceback")}),
+                         self.board.pop_results([0, 1]))
+
+
+class TestCoordinator(unittest.TestCase):
+    def test_defaults_to_localhost_and_random_key(self):
+        coordinator1 = Coordinator()
+        coordinator2 = Coordinator()
+
+        self.assertEqual(u"localhost", coordinator1.host)
+        self.assertGreaterEqual(len(coordinator1.authKey), 32)
+        self.assertNotEqual(coordinator1.authKey, coordinator2.authKey)
+
+    def test_given_key_kept(self):
+        coordinator = Coordinator(authKey=u"secret")
+        self.assertEqual(u"secret", coordinator.authKey)
+
+
+class TestDistributedWorkers(unittest.TestCase):
+    def setUp(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        self.fixationData = make_fixation_data()
+        self.trials = model.simulate_conditions(
+            [(0, 0), (1, 3), (3, 1)], self.fixationData, 6,
+            rng=1).to_trials()
+        self.coordinator = Coordinator(
+            port=0, authKey=u"test", trials=self.trials, numChunks=4,
+            heartbeatTimeout=1, pollInterval=0.05)
+        self.coordinator.start()
+        self.workers = [
+            Process(target=distributed.main,
+                    args=(u"localhost", self.coordinator.port, u"test"),
+                    kwargs=dict(heartbeatInterval=0.1, connectTimeout=10))
+            for _ in range(3)]
+        for worker in self.workers:
+            worker.start()
+
+    def tearDown(self):
+        self.coordinator.close()
+        for worker in self.workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.terminate()
+
+    def test_grid_likelihoods_match_worker_pool(self):
+        models = [aDDM(d=0.004, sigma=0.06, theta=0.3),
+                  aDDM(d=0.008, sigma=0.08, theta=0.7)]
+        likelihoods = self.coordinator.get_grid_likelihoods(models)
+        with WorkerPool(2, trials=self.trials) as pool:
+            np.testing.assert_allclose(pool.get_grid_likelihoods(models),
+                                       likelihoods)
+
+    def test_simulations_match_worker_pool(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch1 = self.coordinator.simulate_trials(
+            model, [(0, 0), (3, 1)], 30, self.fixationData,
+            trialsPerTask=10, seed=2)
+        with WorkerPool(2) as pool:
+            batch2 = pool.simulate_trials(
+                model, [(0, 0), (3, 1)], 30, self.fixationData,
+                trialsPerTask=10, seed=2)
+        np.testing.assert_array_equal(batch2.RT, batch1.RT)
+        np.testing.assert_array_equal(batch2.fixTime, batch1.fixTime)
+
+    def test_task_of_killed_worker_requeued(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            markerFileName = os.path.join(tempDir, u"marker")
+            results = self.coordinator.run_tasks(
+                exit_on_first_attempt,
+                [(markerFileName, value) for value in range(5)])
+        finally:
+            shutil.rmtree(tempDir)
+        self.assertEqual([0, 2, 4, 6, 8], results)
+        self.assertEqual(1, sum(worker.exitcode == 1
+                                for worker in self.workers))
+
+    def test_close_releases_port(self):
+        port = self.coordinator.port
+        self.assertEqual([0, 1, 2], self.coordinator.run_tasks(
+            len, [[None] * n for n in range(3)]))
+        self.coordinator.close()
+        for worker in self.workers:
+            worker.join(15)
+            self.assertFalse(worker.is_alive())
+
+        # Nothing accepts connections on the port any more, and a new
+        # coordinator can listen on it (as the manager's listener does,
+        # reusing the address while old connections are in TIME_WAIT).
+        self.assertRaises(socket.error, socket.create_connection,
+                          (u"localhost", port), 1)
+        listener = socket.socket()
+        try:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((u"localhost", port))
+            listener.listen(1)
+        finally:
+            listener.close()
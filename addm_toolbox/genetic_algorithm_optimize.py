@@ -37,55 +37,90 @@ import random
 
 from builtins import range, str, zip
 from deap import base, creator, tools
-from multiprocessing import Pool
 
 from .addm import aDDM
+from .parallel import WorkerPool
+from .rng import get_generator, spawn_seeds
+from .surrogate import NLLSurrogate
 from .util import load_data_from_csv, convert_item_values
 
 
-# Global variables.
-dataTrials = []
-
-
-def evaluate(individual):
+def evaluate_population(pool, population, splitTrials=False):
+    """
+    Computes the negative log likelihood of the data set installed in the
+    workers of a pool, given the parameters of the aDDM for each individual in
+    a population.
+    Args:
+      pool: a WorkerPool object with the data trials installed.
+      population: list of individuals, where each individual is a list
+          containing the 3 model parameters, in the following order: d,
+          theta, sigma.
+      splitTrials: boolean, whether or not to split the trials of each
+          individual across workers. If False, each individual is evaluated
+          by a single worker.
+    Returns:
+      A list where each item is a tuple containing the negative log likelihood
+          for the data set and the corresponding individual.
     """
-    Computes the negative log likelihood of the global data set given the
-    parameters of the aDDM.
+    models = [aDDM(individual[0], individual[2], individual[1])
+              for individual in population]
+    likelihoods = pool.get_grid_likelihoods(
+        models, numChunks=None if splitTrials else 1)
+
+    fitnesses = list()
+    for individual, modelLikelihoods in zip(population, likelihoods):
+        logLikelihood = np.sum(np.log(modelLikelihoods[modelLikelihoods != 0]))
+        print(u"NLL for " + str(individual) + u": " + str(-logLikelihood))
+        if logLikelihood != 0:
+            fitnesses.append((-logLikelihood,))
+        else:
+            fitnesses.append((float("inf"),))
+    return fitnesses
+
+
+def evaluate_population_surrogate(surrogate, population):
+    """
+    Computes the surrogate negative log likelihood for each individual in a
+    population.
     Args:
-      individual: list containing the 3 model parameters, in the following
-          order: d, theta, sigma.
+      surrogate: an NLLSurrogate object fitted to the NLL of the data set.
+      population: list of individuals, where each individual is a list
+          containing the 3 model parameters, in the following order: d,
+          theta, sigma.
     Returns:
-      A list containing the negative log likelihood for the global data set and
-          the given model.
+      A list where each item is a tuple containing the surrogate negative log
+          likelihood for the corresponding individual.
     """
-    d = individual[0]
-    theta = individual[1]
-    sigma = individual[2]
-    model = aDDM(d, sigma, theta) 
+    return [(surrogate(individual),) for individual in population]
 
-    logLikelihood = 0
-    for trial in dataTrials:
-        try:
-            likelihood = model.get_trial_likelihood(trial)
-        except:
-            print(u"An exception occurred during the likelihood " +
-                  "computations for model " + str(model.params) + u".")
-            raise
-        if likelihood != 0:
-            logLikelihood += np.log(likelihood)
 
-    print(u"NLL for " + str(individual) + u": " + str(-logLikelihood))
-    if logLikelihood != 0:
-        return -logLikelihood,
-    else:
-        return float("inf"),
+def get_best_individual(population, surrogate=None):
+    """
+    Finds the individual with the lowest fitness in a population. When the
+    population was evaluated on a surrogate, its best individual is confirmed
+    with the true negative log likelihood, which also refines the surrogate
+    near it.
+    Args:
+      population: list of evaluated individuals.
+      surrogate: the NLLSurrogate object used to evaluate the population, or
+          None if the population was evaluated with the true NLL.
+    Returns:
+      A tuple (individual, fitness), where fitness is the true negative log
+          likelihood of the individual.
+    """
+    bestInd = min(population, key=lambda ind: ind.fitness.values[0])
+    if surrogate is not None:
+        return bestInd, surrogate.confirm(list(bestInd))
+    return bestInd, bestInd.fitness.values[0]
 
 
 def main(lowerBoundD=0.0001, upperBoundD=0.09, lowerBoundSigma=0.001,
          upperBoundSigma=0.9, lowerBoundTheta=0, upperBoundTheta=1,
          expdataFileName=None, fixationsFileName=None, trialsPerSubject=100,
          popSize=18, numGenerations=20, crossoverRate=0.5, mutationRate=0.3,
-         subjectIds=[], numThreads=9, verbose=False):
+         subjectIds=[], numThreads=9, verbose=False, useSurrogate=False,
+         numDesignPoints=30, numRefinements=10, splitTrials=False,
+         threadBudget=None, seed=None):
     """
     Args:
       lowerBoundD: float, lower search bound for parameter d.
@@ -106,9 +141,24 @@ def main(lowerBoundD=0.0001, upperBoundD=0.09, lowerBoundSigma=0.001,
           provided, all existing subjects will be used.
       numThreads: int, size of the thread pool.
       verbose: boolean, whether or not to increase output verbosity.
+      useSurrogate: boolean, whether or not to evaluate the population on a
+          surrogate of the NLL surface. The true NLL is then only computed on
+          the surrogate design points, during refinement, and to confirm the
+          best individual of the initial population and of each generation.
+      numDesignPoints: int, number of points in the initial surrogate design.
+      numRefinements: int, number of surrogate refinement iterations near its
+          minima.
+      splitTrials: boolean, whether or not to split the trials of each
+          individual across workers, in addition to evaluating individuals in
+          parallel.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads. If not
+          provided, the number of BLAS threads is left unchanged. See
+          parallel.get_thread_layout().
+      seed: int, seed of the random streams used to select the data trials
+          and to place the surrogate design and refinement points. If not
+          provided, the streams are seeded with fresh entropy.
     """
-    global dataTrials
-
     # Load experimental data from CSV file.
     if verbose:
         print(u"Loading experimental data...")
@@ -121,13 +171,17 @@ def main(lowerBoundD=0.0001, upperBoundD=0.09, lowerBoundSigma=0.001,
     data = load_data_from_csv(expdataFileName, fixationsFileName,
                               convertItemValues=convert_item_values)
 
+    subsetSeed, surrogateSeed = spawn_seeds(seed, 2)
+
     # Get correct subset of trials.
+    rng = get_generator(subsetSeed)
+    dataTrials = list()
     subjectIds = ([str(subj) for subj in subjectIds] if subjectIds
                   else list(data))
     for subjectId in subjectIds:
         numTrials = (trialsPerSubject if trialsPerSubject >= 1
                      else len(data[subjectId]))
-        trialSet = np.random.choice(
+        trialSet = rng.choice(
             [trialId for trialId in range(len(data[subjectId]))],
             numTrials, replace=False)
         dataTrials.extend([data[subjectId][t] for t in trialSet])
@@ -137,10 +191,6 @@ def main(lowerBoundD=0.0001, upperBoundD=0.09, lowerBoundSigma=0.001,
 
     toolbox = base.Toolbox()
 
-    # Create thread pool.
-    pool = Pool(numThreads)
-    toolbox.register(u"map", pool.map)
-
     # Create individual.
     toolbox.register(u"attr_d", random.uniform, lowerBoundD, upperBoundD)
     toolbox.register(u"attr_sigma", random.uniform, lowerBoundSigma,
@@ -160,74 +210,96 @@ def main(lowerBoundD=0.0001, upperBoundD=0.09, lowerBoundSigma=0.001,
     toolbox.register(u"mutate", tools.mutGaussian, mu=0,
                      sigma=[0.0005, 0.05, 0.005], indpb=0.4)
     toolbox.register(u"select", tools.selTournament, tournsize=3)
-    toolbox.register(u"evaluate", evaluate)
-
-    # Evaluate the entire population.
-    try:
-        fitnesses = list(map(toolbox.evaluate, pop))
-    except:
-        print(u"An exception occurred during the first population evaluation.")
-        raise
-    bestFit = float("inf")
-    bestInd = None
-    for ind, fit in zip(pop, fitnesses):
-        ind.fitness.values = fit
-
-        # Get best individual.
-        currFit = fit[0] if isinstance(fit, tuple) else fit
-        if currFit < bestFit:
-            bestInd = ind
 
-    for g in range(numGenerations):
+    # Create worker pool, with the data trials installed in each worker.
+    with WorkerPool(numThreads, trials=dataTrials,
+                    threadBudget=threadBudget) as pool:
         if verbose:
-            print(u"Generation " + str(g) + u"...")
-
-        # Select the next generation individuals.
-        offspring = toolbox.select(pop, len(pop))
-        # Clone the selected individuals.
-        offspring = list(map(toolbox.clone, offspring))
-
-        # Apply crossover and mutation on the offspring.
-        for child1, child2 in zip(offspring[::2], offspring[1::2]):
-            if random.random() < crossoverRate:
-                toolbox.mate(child1, child2)
-                del child1.fitness.values
-                del child2.fitness.values
-
-        for mutant in offspring:
-            if random.random() < mutationRate:
-                toolbox.mutate(mutant)
-                del mutant.fitness.values
-
-        # Evaluate the individuals which are valid but have an invalid fitness.
-        invalidInd = list()
-        for ind in offspring:
-            if (ind[0] < lowerBoundD or
-                ind[0] > upperBoundD or
-                ind[1] < lowerBoundTheta or
-                ind[1] > upperBoundTheta or
-                ind[2] < lowerBoundSigma or
-                ind[2] > upperBoundSigma):
-                ind.fitness.values = float("inf"),
-            elif not ind.fitness.valid:
-                invalidInd.append(ind)
+            print(u"Worker layout: " + pool.get_layout_description())
+
+        toolbox.register(u"evaluate_population", evaluate_population, pool,
+                         splitTrials=splitTrials)
+
+        surrogate = None
+        if useSurrogate:
+            surrogate = NLLSurrogate(
+                lambda individual: evaluate_population(
+                    pool, [individual], splitTrials=True)[0],
+                [(lowerBoundD, upperBoundD),
+                 (lowerBoundTheta, upperBoundTheta),
+                 (lowerBoundSigma, upperBoundSigma)],
+                verbose=verbose)
+            surrogateRng = get_generator(surrogateSeed)
+            surrogate.build_design(numDesignPoints, rng=surrogateRng)
+            surrogate.refine(numRefinements, rng=surrogateRng)
+            toolbox.register(u"evaluate_population",
+                             evaluate_population_surrogate, surrogate)
+
+        # Evaluate the entire population.
         try:
-            fitnesses = list(map(toolbox.evaluate, invalidInd))
+            fitnesses = toolbox.evaluate_population(pop)
         except:
-            print(u"An exception occurred during the population evaluation "
-                  "for generation " + str(g) + u".")
+            print(u"An exception occurred during the first population "
+                  "evaluation.")
             raise
-        for ind, fit in zip(invalidInd, fitnesses):
+        for ind, fit in zip(pop, fitnesses):
             ind.fitness.values = fit
 
-        # The population is entirely replaced by the offspring.
-        pop[:] = offspring
-
-        # Update best individual.
-        for ind in pop:
-            if ind.fitness.values[0] < bestFit:
-                bestFit = ind.fitness.values[0]
-                bestInd = ind
+        # Get best individual.
+        bestInd, bestFit = get_best_individual(pop, surrogate)
+        bestInd = toolbox.clone(bestInd)
+
+        for g in range(numGenerations):
+            if verbose:
+                print(u"Generation " + str(g) + u"...")
+
+            # Select the next generation individuals.
+            offspring = toolbox.select(pop, len(pop))
+            # Clone the selected individuals.
+            offspring = list(map(toolbox.clone, offspring))
+
+            # Apply crossover and mutation on the offspring.
+            for child1, child2 in zip(offspring[::2], offspring[1::2]):
+                if random.random() < crossoverRate:
+                    toolbox.mate(child1, child2)
+                    del child1.fitness.values
+                    del child2.fitness.values
+
+            for mutant in offspring:
+                if random.random() < mutationRate:
+                    toolbox.mutate(mutant)
+                    del mutant.fitness.values
+
+            # Evaluate the individuals which are valid but have an invalid
+            # fitness.
+            invalidInd = list()
+            for ind in offspring:
+                if (ind[0] < lowerBoundD or
+                    ind[0] > upperBoundD or
+                    ind[1] < lowerBoundTheta or
+                    ind[1] > upperBoundTheta or
+                    ind[2] < lowerBoundSigma or
+                    ind[2] > upperBoundSigma):
+                    ind.fitness.values = float("inf"),
+                elif not ind.fitness.valid:
+                    invalidInd.append(ind)
+            try:
+                fitnesses = toolbox.evaluate_population(invalidInd)
+            except:
+                print(u"An exception occurred during the population "
+                      "evaluation for generation " + str(g) + u".")
+                raise
+            for ind, fit in zip(invalidInd, fitnesses):
+                ind.fitness.values = fit
+
+            # The population is entirely replaced by the offspring.
+            pop[:] = offspring
+
+            # Update best individual.
+            candidate, candidateFit = get_best_individual(pop, surrogate)
+            if candidateFit < bestFit:
+                bestFit = candidateFit
+                bestInd = toolbox.clone(candidate)
 
     print(u"Best individual: " + str(bestInd))
     print(u"Fitness of best individual: " + str(bestFit))
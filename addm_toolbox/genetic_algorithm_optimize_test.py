@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: genetic_algorithm_optimize_test.py
+
+
+Unit tests for the genetic_algorithm_optimize.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import unittest
+
+from .addm import aDDM
+from .genetic_algorithm_optimize import (evaluate_population,
+                                         evaluate_population_surrogate,
+                                         get_best_individual)
+from .parallel import WorkerPool
+from .parallel_test import make_fixation_data
+from .surrogate import NLLSurrogate
+from .surrogate_test import quadratic_nll
+
+
+class Fitness(object):
+    def __init__(self, values):
+        self.values = values
+
+
+class Individual(list):
+    """
+    Minimal stand-in for a DEAP individual: a list of parameters with a
+    fitness.
+    """
+    def __init__(self, params, fitness):
+        super(Individual, self).__init__(params)
+        self.fitness = Fitness(fitness)
+
+
+class TestEvaluatePopulation(unittest.TestCase):
+    def setUp(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch = model.simulate_conditions(
+            [(0, 0), (1, 3), (3, 1)], make_fixation_data(), 6, rng=12)
+        self.trials = batch.to_trials()
+        # Individuals hold the parameters in the order d, theta, sigma.
+        self.population = [[0.004, 0.3, 0.06], [0.006, 0.5, 0.07],
+                           [0.008, 0.7, 0.08]]
+
+    def get_serial_fitnesses(self):
+        return [(-np.sum(np.log([
+            aDDM(d, sigma, theta).get_trial_likelihood(trial)
+            for trial in self.trials])),)
+            for (d, theta, sigma) in self.population]
+
+    def test_matches_serial(self):
+        expected = self.get_serial_fitnesses()
+        for splitTrials in [False, True]:
+            with WorkerPool(2, trials=self.trials) as pool:
+                fitnesses = evaluate_population(pool, self.population,
+                                                splitTrials=splitTrials)
+            np.testing.assert_allclose(expected, fitnesses)
+
+    def test_pool_reused_across_generations(self):
+        with WorkerPool(2, trials=self.trials, backend=u"thread") as pool:
+            fitnesses1 = evaluate_population(pool, self.population)
+            fitnesses2 = evaluate_population(pool, self.population[::-1])
+        self.assertEqual(fitnesses1, fitnesses2[::-1])
+
+
+class TestBestIndividual(unittest.TestCase):
+    def setUp(self):
+        self.params = [[0.1, 0.9], [0.35, 0.55], [0.8, 0.2], [0.5, 0.5]]
+
+    def test_best_individual_without_surrogate(self):
+        population = [Individual(p, (quadratic_nll(p),))
+                      for p in self.params]
+        bestInd, bestFit = get_best_individual(population)
+
+        self.assertIs(population[1], bestInd)
+        self.assertEqual(quadratic_nll(self.params[1]), bestFit)
+
+    def test_best_individual_confirmed_with_true_nll(self):
+        surrogate = NLLSurrogate(quadratic_nll, [(0, 1), (0, 1)])
+        surrogate.build_design(6, rng=13)
+        fitnesses = evaluate_population_surrogate(surrogate, self.params)
+        population = [Individual(p, fit)
+                      for p, fit in zip(self.params, fitnesses)]
+        bestInd, bestFit = get_best_individual(population, surrogate)
+
+        surrogateFits = [fit[0] for fit in fitnesses]
+        self.assertIs(population[int(np.argmin(surrogateFits))], bestInd)
+        self.assertEqual(quadratic_nll(bestInd), bestFit)
+        self.assertNotEqual(min(surrogateFits), bestFit)
+        np.testing.assert_array_equal(bestInd, surrogate.points[-1])
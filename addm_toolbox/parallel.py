@@ -0,0 +1,811 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: parallel.py
+
+Utilities for parallel computation of model likelihoods, shared by the model
+fitting scripts.
+"""
+
+from __future__ import absolute_import, division
+
+import itertools
+import numpy as np
+import os
+import time
+
+from builtins import next, range, str
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from .rng import get_generator, spawn_seeds
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+# Environment variables read by the common BLAS/OpenMP libraries when they
+# are loaded.
+BLAS_THREAD_VARIABLES = [u"OMP_NUM_THREADS", u"OPENBLAS_NUM_THREADS",
+                         u"MKL_NUM_THREADS", u"VECLIB_MAXIMUM_THREADS",
+                         u"NUMEXPR_NUM_THREADS"]
+
+# Data resident in the workers, installed once per worker process (or once
+# per thread pool). Entries are indexed by the id of the pool which installed
+# them, so that several thread pools can coexist in the same process.
+residentData = dict()
+
+# Source of unique pool ids within a process.
+poolIds = itertools.count()
+
+
+def install_resident_data(data, poolId=None):
+    """
+    Stores a set of named objects in the worker, so that tasks can refer to
+    them instead of carrying them.
+    Args:
+      data: dict of objects indexed by name.
+      poolId: id of the pool (or coordinator) which the objects belong to.
+    """
+    residentData.setdefault(poolId, dict()).update(data)
+
+
+def get_resident_data(name, poolId=None):
+    """
+    Args:
+      name: string, name of the object.
+      poolId: id of the pool (or coordinator) which the object belongs to.
+    Returns:
+      The object installed in the worker by install_resident_data().
+    """
+    return residentData[poolId][name]
+
+
+def install_trials(trials, poolId=None):
+    """
+    Stores a set of trials in the worker, so that tasks can refer to them by
+    index instead of carrying them.
+    Args:
+      trials: list of DDMTrial or aDDMTrial objects.
+      poolId: id of the pool (or coordinator) which the trials belong to.
+    """
+    install_resident_data({u"trials": trials}, poolId)
+
+
+def get_resident_trials(poolId=None):
+    """
+    Args:
+      poolId: id of the pool (or coordinator) which the trials belong to.
+    Returns:
+      The list of trials installed in the worker by install_trials().
+    """
+    return get_resident_data(u"trials", poolId)
+
+
+def limit_blas_threads(numBlasThreads):
+    """
+    Limits the number of threads used by BLAS/OpenMP libraries in the current
+    process. Libraries which are already loaded can only be limited if the
+    optional threadpoolctl package is installed; otherwise, the limit only
+    applies to libraries loaded afterwards, through environment variables.
+    Args:
+      numBlasThreads: int, maximum number of BLAS threads.
+    Returns:
+      A tuple (previousValues, limiter) to be passed to
+          restore_blas_threads(), where previousValues is a dict with the
+          previous value of each environment variable (None if unset) and
+          limiter is the active threadpoolctl context (None if threadpoolctl
+          is not installed).
+    """
+    previousValues = dict((variable, os.environ.get(variable))
+                          for variable in BLAS_THREAD_VARIABLES)
+    for variable in BLAS_THREAD_VARIABLES:
+        os.environ[variable] = str(numBlasThreads)
+    limiter = None
+    if threadpool_limits is not None:
+        limiter = threadpool_limits(limits=numBlasThreads)
+        limiter.__enter__()
+    return previousValues, limiter
+
+
+def restore_blas_threads(previousLimits):
+    """
+    Undoes limit_blas_threads(), restoring the BLAS/OpenMP thread limits and
+    environment variables which were in place before it was called.
+    Args:
+      previousLimits: tuple (previousValues, limiter), as returned by
+          limit_blas_threads().
+    """
+    previousValues, limiter = previousLimits
+    if limiter is not None:
+        limiter.__exit__(None, None, None)
+    for variable, value in previousValues.items():
+        if value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = value
+
+
+def initialize_worker(poolId, trials, data, numBlasThreads):
+    """
+    Pool initializer which applies the BLAS thread limit of the worker and
+    installs the trials and other resident data in it. The limit is kept for
+    the lifetime of the worker process.
+    Args:
+      poolId: id of the pool which the worker belongs to.
+      trials: list of DDMTrial or aDDMTrial objects, or None.
+      data: dict of objects indexed by name, or None.
+      numBlasThreads: int, maximum number of BLAS threads per worker, or None
+          to leave the BLAS libraries unchanged.
+    """
+    if numBlasThreads is not None:
+        limit_blas_threads(numBlasThreads)
+    if trials is not None:
+        install_trials(trials, poolId)
+    if data is not None:
+        install_resident_data(data, poolId)
+
+
+def get_thread_layout(numThreads, threadBudget=None):
+    """
+    Splits a budget of cores between pool workers and per-worker BLAS
+    threads, so that the machine is not oversubscribed.
+    Args:
+      numThreads: int, requested number of workers.
+      threadBudget: int, total number of cores to be used. If not provided,
+          all cores in the machine are used.
+    Returns:
+      A tuple (numWorkers, numBlasThreads).
+    """
+    if threadBudget is None:
+        threadBudget = cpu_count()
+    numWorkers = max(1, min(numThreads, threadBudget))
+    numBlasThreads = max(1, threadBudget // numWorkers)
+    return numWorkers, numBlasThreads
+
+
+def get_resident_trial_likelihoods(args):
+    """
+    Computes the likelihoods of a range of the trials resident in the worker
+    process. This method should stay at module level, allowing it to be
+    pickled (as required by multiprocessing).
+    Args:
+      args: a tuple (poolId, model, start, stop, timeStep, stateStep), where
+          poolId is the id of the pool which installed the trials, model is
+          a DDM or aDDM object, start and stop delimit the range of trial
+          indices, and timeStep and stateStep are the arguments to
+          get_trial_likelihood().
+    Returns:
+      A list with the likelihood of each trial in the range.
+    """
+    poolId, model, start, stop, timeStep, stateStep = args
+    return [model.get_trial_likelihood(trial, timeStep, stateStep)
+            for trial in get_resident_trials(poolId)[start:stop]]
+
+
+def get_resident_unit_likelihoods(args):
+    """
+    Computes the likelihoods of a subset of the trials resident in the worker
+    process, for one model of a grid. This method should stay at module level,
+    allowing it to be pickled (as required by multiprocessing).
+    Args:
+      args: a tuple (poolId, modelIndex, model, trialIndices, timeStep,
+          stateStep), where poolId is the id of the pool which installed the
+          trials, modelIndex is the position of the model in the grid, model
+          is a DDM or aDDM object, trialIndices is a numpy array of indices
+          of resident trials, and timeStep and stateStep are the arguments to
+          get_trial_likelihood().
+    Returns:
+      A tuple (modelIndex, trialIndices, likelihoods), so that results can be
+          reassembled regardless of the order in which units complete.
+    """
+    poolId, modelIndex, model, trialIndices, timeStep, stateStep = args
+    trials = get_resident_trials(poolId)
+    likelihoods = [model.get_trial_likelihood(trials[t], timeStep, stateStep)
+                   for t in trialIndices]
+    return modelIndex, trialIndices, likelihoods
+
+
+def simulate_batch(args):
+    """
+    Generates a batch of artificial trials for a set of trial conditions.
+    This method should stay at module level, allowing it to be pickled (as
+    required by multiprocessing).
+    Args:
+      args: a tuple (model, trialConditions, trialsPerCondition,
+          fixationData, seed, simulationArgs), where model is a DDM or aDDM
+          object, trialConditions is a list of pairs (valueLeft, valueRight),
+          fixationData is a FixationData object (or None for the DDM), seed
+          is the seed of the random stream of this task (see
+          rng.get_generator()) and simulationArgs is a dict of additional
+          arguments to the model's simulate_conditions().
+    Returns:
+      A SimulationBatch object.
+    """
+    (model, trialConditions, trialsPerCondition, fixationData, seed,
+     simulationArgs) = args
+    rng = get_generator(seed)
+    if fixationData is None:
+        return model.simulate_conditions(trialConditions, trialsPerCondition,
+                                         rng=rng, **simulationArgs)
+    return model.simulate_conditions(trialConditions, fixationData,
+                                     trialsPerCondition, rng=rng,
+                                     **simulationArgs)
+
+
+def get_simulation_tasks(model, trialConditions, trialsPerCondition,
+                         fixationData=None, trialsPerTask=None,
+                         splitConditions=True, seed=None,
+                         simulationArgs=None):
+    """
+    Splits the generation of artificial trials into tasks for
+    simulate_batch(), each with its own random stream.
+    Args:
+      model: a DDM or aDDM object, or a list of them (e.g. models sampled
+          from a posterior distribution), in which case the trials are
+          generated for each model in turn.
+      trialConditions: list of pairs (valueLeft, valueRight).
+      trialsPerCondition: int, number of trials per trial condition and
+          model, or a list with one such number for each model.
+      fixationData: a FixationData object, required for the aDDM.
+      trialsPerTask: int, maximum number of trials of a trial condition in
+          each task. If not provided, each task generates all the trials of
+          its trial conditions for its model.
+      splitConditions: boolean, whether each task covers a single trial
+          condition. If False, each task covers all trial conditions of a
+          model, which are then simulated together.
+      seed: int or numpy SeedSequence. Each task draws from its own random
+          stream spawned from this seed, so the generated trials do not
+          depend on the number of workers. If not provided, the streams are
+          spawned from fresh entropy and cannot be reproduced.
+      simulationArgs: dict of additional arguments to the model's
+          simulate_conditions() (e.g. timeStep or simulationMethod).
+    Returns:
+      A list of argument tuples for simulate_batch().
+    """
+    models = model if isinstance(model, list) else [model]
+    if isinstance(trialsPerCondition, list):
+        modelTrials = trialsPerCondition
+    else:
+        modelTrials = [trialsPerCondition] * len(models)
+    if simulationArgs is None:
+        simulationArgs = dict()
+    if splitConditions:
+        conditionGroups = [[trialCondition]
+                           for trialCondition in trialConditions]
+    else:
+        conditionGroups = [list(trialConditions)]
+    argsList = list()
+    for model, numTrials in zip(models, modelTrials):
+        if numTrials == 0:
+            continue
+        taskTrials = numTrials if trialsPerTask is None else trialsPerTask
+        for conditionGroup in conditionGroups:
+            for start in range(0, numTrials, taskTrials):
+                argsList.append(
+                    (model, conditionGroup,
+                     min(taskTrials, numTrials - start), fixationData))
+    seeds = spawn_seeds(seed, len(argsList))
+    return [args + (taskSeed, simulationArgs)
+            for args, taskSeed in zip(argsList, seeds)]
+
+
+def skip_simulation_tasks(argsList, numTrials):
+    """
+    Drops the simulation tasks whose trials have already been generated, e.g.
+    by an interrupted run which is being resumed.
+    Args:
+      argsList: list of argument tuples, as returned by
+          get_simulation_tasks().
+      numTrials: int, number of trials already generated, counted from the
+          first task.
+    Returns:
+      A tuple (argsList, numSkipped), where argsList holds the remaining
+          tasks and numSkipped is the number of trials of the first remaining
+          task which have already been generated.
+    """
+    for t, args in enumerate(argsList):
+        taskTrials = len(args[1]) * args[2]
+        if numTrials < taskTrials:
+            return argsList[t:], numTrials
+        numTrials -= taskTrials
+    return list(), 0
+
+
+def split_trials_by_cost(costs, numChunks):
+    """
+    Splits a set of trials into chunks of similar total cost. Trials are
+    sorted from most to least expensive before splitting, so that each chunk
+    holds trials of similar duration.
+    Args:
+      costs: numpy array with the expected cost of each trial.
+      numChunks: int, number of chunks.
+    Returns:
+      A list of tuples (trialIndices, cost), where trialIndices is a numpy
+          array and cost is the total expected cost of the chunk.
+    """
+    order = np.argsort(-costs, kind=u"mergesort")
+    cumulativeCost = np.cumsum(costs[order])
+    totalCost = cumulativeCost[-1]
+    if totalCost > 0:
+        splits = np.searchsorted(
+            cumulativeCost,
+            totalCost * np.arange(1, numChunks) / numChunks, side=u"right")
+    else:
+        splits = (order.size * np.arange(1, numChunks)) // numChunks
+    chunks = list()
+    for trialIndices in np.split(order, splits):
+        if trialIndices.size > 0:
+            chunks.append((trialIndices, np.sum(costs[trialIndices])))
+    return chunks
+
+
+class WorkerPool(object):
+    """
+    Long-lived pool of worker processes, to be shared across the likelihood
+    computations of many models. Intended to be used as a context manager,
+    which closes and joins the workers on exit:
+
+        with WorkerPool(numThreads) as pool:
+            for model in models:
+                model.parallel_get_likelihoods(trials, pool=pool)
+
+    If a set of trials is given, it is installed in each worker once, when
+    the worker starts. Likelihoods for those trials can then be computed with
+    tasks that carry only the model and a range of trial indices:
+
+        with WorkerPool(numThreads, trials=trials) as pool:
+            for model in models:
+                model.parallel_get_likelihoods(pool=pool)
+
+    Other large objects shared by all tasks can be installed in the same way
+    through residentData, and fetched by the tasks with get_resident_data()
+    and the pool's poolId.
+    """
+    def __init__(self, numThreads=4, trials=None, chunksPerWorker=4,
+                 backend=u"process", threadBudget=None, residentData=None):
+        """
+        Args:
+          numThreads: int, number of workers in the pool.
+          trials: list of DDMTrial or aDDMTrial objects to be installed in
+              each worker.
+          chunksPerWorker: int, number of trial ranges per worker into which
+              the resident trials are split for each model.
+          backend: string, one of {'process', 'thread'}. With 'process', the
+              workers are separate processes. With 'thread', the workers are
+              threads of the current process: there is no start-up, import or
+              pickling cost, and the trials are shared without copies, but
+              the workers only run concurrently while NumPy releases the GIL.
+              For the aDDM likelihood, a time step takes about 36us with 21
+              states (3us of them in NumPy), 43us with 201 states (18us) and
+              95us with 401 states (64us). Threads therefore only overlap
+              usefully for fine state grids (stateStep of about 0.005 or
+              less), or for trial sets small enough that starting processes
+              dominates; otherwise 'process' is faster.
+          threadBudget: int, total number of cores to be used by the pool. If
+              provided, the cores are split between workers and per-worker
+              BLAS threads (see get_thread_layout()), and numThreads is
+              reduced if it exceeds the budget. Otherwise, the number of BLAS
+              threads is left unchanged.
+          residentData: dict of objects indexed by name, to be installed in
+              each worker.
+        """
+        backend = str(backend)
+        if backend != u"process" and backend != u"thread":
+            raise RuntimeError(u"Argument backend must be one of "
+                               "{process, thread}")
+        self.numThreads = numThreads
+        self.trials = trials
+        self.residentData = residentData
+        self.chunksPerWorker = chunksPerWorker
+        self.backend = backend
+        self.numBlasThreads = None
+        if threadBudget is not None:
+            self.numThreads, self.numBlasThreads = get_thread_layout(
+                numThreads, threadBudget)
+        self.poolId = next(poolIds)
+        self.pool = None
+        self.previousBlasLimits = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
+
+
+    def start(self):
+        """
+        Starts the workers, if they are not already running.
+        """
+        if self.pool is None:
+            if self.backend == u"thread":
+                # BLAS thread limits apply to the whole process, so they are
+                # set here rather than in each worker thread, and restored
+                # when the pool is closed.
+                if self.numBlasThreads is not None:
+                    self.previousBlasLimits = limit_blas_threads(
+                        self.numBlasThreads)
+                # Worker threads share the data of this pool, which is
+                # installed once under its id.
+                initialize_worker(self.poolId, self.trials,
+                                  self.residentData, None)
+                self.pool = ThreadPool(self.numThreads)
+            else:
+                self.pool = Pool(self.numThreads,
+                                 initializer=initialize_worker,
+                                 initargs=(self.poolId, self.trials,
+                                           self.residentData,
+                                           self.numBlasThreads))
+
+
+    def get_layout_description(self):
+        """
+        Returns:
+          A string describing the effective layout of workers and BLAS
+              threads.
+        """
+        workerType = u"threads" if self.backend == u"thread" else u"processes"
+        description = str(self.numThreads) + u" worker " + workerType
+        if self.numBlasThreads is None:
+            return description + u", BLAS threads not limited."
+        description += (u" x " + str(self.numBlasThreads) +
+                        u" BLAS threads each")
+        if threadpool_limits is None:
+            description += (u" (threadpoolctl not found: the limit only "
+                            "applies to BLAS libraries loaded after it is "
+                            "set)")
+        return description + u"."
+
+
+    def map(self, function, iterable, chunksize=None):
+        """
+        Applies a function to every item of an iterable using the workers,
+        starting them if needed.
+        Args:
+          function: a picklable function.
+          iterable: an iterable with the arguments for each call.
+          chunksize: int, number of items sent to a worker at a time.
+        Returns:
+          A list with the results, in the same order as the iterable.
+        """
+        self.start()
+        return self.pool.map(function, iterable, chunksize)
+
+
+    def get_resident_likelihoods(self, model, timeStep=10, stateStep=0.1):
+        """
+        Computes the likelihood of each of the trials installed in the workers
+        given a model.
+        Args:
+          model: a DDM or aDDM object.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          stateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A list of likelihoods, in the same order as the installed trials.
+        """
+        if self.trials is None:
+            raise RuntimeError(u"No trials were installed in the worker "
+                               "pool.")
+        numTrials = len(self.trials)
+        numChunks = max(1, min(numTrials,
+                               self.numThreads * self.chunksPerWorker))
+        bounds = [(numTrials * c) // numChunks for c in range(numChunks + 1)]
+        chunkLikelihoods = self.map(
+            get_resident_trial_likelihoods,
+            [(self.poolId, model, bounds[c], bounds[c + 1], timeStep,
+              stateStep) for c in range(numChunks)], chunksize=1)
+        return [likelihood for chunk in chunkLikelihoods
+                for likelihood in chunk]
+
+
+    def get_trial_costs(self, model, timeStep=10, stateStep=0.1):
+        """
+        Estimates the cost of computing the likelihood of each of the trials
+        installed in the workers.
+        Args:
+          model: a DDM or aDDM object.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          stateStep: float, to be used for binning the RDV axis.
+        Returns:
+          A numpy array with the expected cost of each trial.
+        """
+        return np.array([model.get_trial_cost(trial, timeStep, stateStep)
+                         for trial in self.trials], dtype=float)
+
+
+    def estimate_grid_runtime(self, models, timeStep=10, stateStep=0.1,
+                              numCalibrationTrials=5):
+        """
+        Predicts the wall time of get_grid_likelihoods() for a grid of models.
+        The time per unit of cost is measured by computing the likelihoods of
+        a few of the installed trials in the current process.
+        Args:
+          models: list of DDM or aDDM objects.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          stateStep: float, to be used for binning the RDV axis.
+          numCalibrationTrials: int, number of trials timed for calibration.
+        Returns:
+          A tuple (totalCost, seconds), with the expected total cost of the
+              grid and the predicted wall time in seconds.
+        """
+        if self.trials is None:
+            raise RuntimeError(u"No trials were installed in the worker "
+                               "pool.")
+        totalCost = 0
+        for model in models:
+            totalCost += np.sum(self.get_trial_costs(model, timeStep,
+                                                     stateStep))
+
+        calibrationModel = models[0]
+        calibrationTrials = [self.trials[t] for t in np.linspace(
+            0, len(self.trials) - 1,
+            min(numCalibrationTrials, len(self.trials))).astype(int)]
+        startTime = time.time()
+        for trial in calibrationTrials:
+            calibrationModel.get_trial_likelihood(trial, timeStep, stateStep)
+        elapsedTime = time.time() - startTime
+        calibrationCost = np.sum(
+            [calibrationModel.get_trial_cost(trial, timeStep, stateStep)
+             for trial in calibrationTrials])
+
+        seconds = elapsedTime / calibrationCost * totalCost / self.numThreads
+        return totalCost, seconds
+
+
+    def get_grid_likelihoods(self, models, timeStep=10, stateStep=0.1,
+                             numChunks=None):
+        """
+        Computes the likelihood of each of the trials installed in the workers
+        for every model in a grid. Work is split into units of (model, trial
+        chunk) across the whole grid, with chunks of similar expected cost
+        according to the models' get_trial_cost(). Units are sent to the
+        workers from the longest to the shortest expected duration, so that
+        workers are kept busy until the last unit completes.
+        Args:
+          models: list of DDM or aDDM objects.
+          timeStep: integer, value in milliseconds to be used for binning the
+              time axis.
+          stateStep: float, to be used for binning the RDV axis.
+          numChunks: int, number of chunks into which the trials are split
+              for each model. If not provided, the pool's number of workers
+              times chunksPerWorker is used. With numChunks=1, each unit
+              corresponds to one model with all its trials.
+        Returns:
+          A numpy array of shape (len(models), number of trials), where each
+              row contains the likelihoods for one model, in the same order as
+              the installed trials.
+        """
+        if self.trials is None:
+            raise RuntimeError(u"No trials were installed in the worker "
+                               "pool.")
+        numTrials = len(self.trials)
+        if not models:
+            return np.empty((0, numTrials))
+        costs = self.get_trial_costs(models[0], timeStep, stateStep)
+        if numChunks is None:
+            numChunks = self.numThreads * self.chunksPerWorker
+        chunks = split_trials_by_cost(costs,
+                                      max(1, min(numTrials, numChunks)))
+
+        units = list()
+        for m, model in enumerate(models):
+            for trialIndices, cost in chunks:
+                units.append((cost, m, model, trialIndices))
+        units.sort(key=lambda unit: -unit[0])
+
+        self.start()
+        likelihoods = np.empty((len(models), numTrials))
+        for m, trialIndices, unitLikelihoods in self.pool.imap_unordered(
+                get_resident_unit_likelihoods,
+                [(self.poolId, m, model, trialIndices, timeStep, stateStep)
+                 for cost, m, model, trialIndices in units]):
+            likelihoods[m, trialIndices] = unitLikelihoods
+        return likelihoods
+
+
+    def simulate_trials(self, model, trialConditions, trialsPerCondition,
+                        fixationData=None, trialsPerTask=None, seed=None,
+                        splitConditions=True, simulationArgs=None):
+        """
+        Generates artificial trials on the workers. Work is split by model,
+        trial condition and chunk of trials (see get_simulation_tasks()), and
+        each task returns its trials as a SimulationBatch, whose arrays are
+        sent back to the parent process as contiguous buffers instead of one
+        pickled trial object per trial. Tasks are sent to the workers in
+        chunks, so that fixationData is pickled once per chunk rather than
+        once per task.
+        Args:
+          model: a DDM or aDDM object, or a list of them.
+          trialConditions: list of pairs (valueLeft, valueRight).
+          trialsPerCondition: int, number of trials per trial condition and
+              model, or a list with one such number for each model.
+          fixationData: a FixationData object, required for the aDDM.
+          trialsPerTask: int, maximum number of trials of a trial condition
+              in each task.
+          seed: int or numpy SeedSequence, used to spawn the random stream of
+              each task.
+          splitConditions: boolean, whether each task covers a single trial
+              condition, or all trial conditions of a model.
+          simulationArgs: dict of additional arguments to the model's
+              simulate_conditions().
+        Returns:
+          A SimulationBatch object, ordered by model and trial condition.
+        """
+        # Imported here, since the ddm module depends on this one.
+        from .ddm import concatenate_batches
+        return concatenate_batches(list(self.iter_simulations(
+            model, trialConditions, trialsPerCondition, fixationData,
+            trialsPerTask, seed, splitConditions, simulationArgs)))
+
+
+    def iter_simulations(self, model, trialConditions, trialsPerCondition,
+                         fixationData=None, trialsPerTask=None, seed=None,
+                         splitConditions=True, simulationArgs=None,
+                         numSkippedTrials=0):
+        """
+        Generates the same artificial trials as WorkerPool.simulate_trials(),
+        but yields them one task at a time, as soon as they are ready, so
+        that they can be written out without keeping all of them in memory.
+        Args:
+          model, trialConditions, trialsPerCondition, fixationData,
+              trialsPerTask, seed, splitConditions, simulationArgs: see
+              WorkerPool.simulate_trials().
+          numSkippedTrials: int, number of trials at the start of the
+              sequence which are not generated again (e.g. because they were
+              already saved by an interrupted run). If a seed is given, the
+              remaining trials are the same as in an uninterrupted run.
+        Returns:
+          A generator of SimulationBatch objects, ordered by model and trial
+              condition.
+        """
+        argsList = get_simulation_tasks(model, trialConditions,
+                                        trialsPerCondition, fixationData,
+                                        trialsPerTask, splitConditions, seed,
+                                        simulationArgs)
+        argsList, numSkipped = skip_simulation_tasks(argsList,
+                                                     numSkippedTrials)
+        if not argsList:
+            return
+        self.start()
+        # Send tasks in chunks, as map() does, so that fixationData is not
+        # pickled once per task.
+        chunksize = max(1, len(argsList) // (4 * self.numThreads))
+        for batch in self.pool.imap(simulate_batch, argsList, chunksize):
+            if numSkipped:
+                batch = batch[numSkipped:]
+                numSkipped = 0
+            yield batch
+
+
+    def restore_blas_threads(self):
+        """
+        Restores the BLAS thread limits of the current process, if they were
+        changed for a thread pool.
+        """
+        if self.previousBlasLimits is not None:
+            restore_blas_threads(self.previousBlasLimits)
+            self.previousBlasLimits = None
+
+
+    def close(self):
+        """
+        Waits for all pending work to finish and shuts down the workers.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            residentData.pop(self.poolId, None)
+            self.restore_blas_threads()
+
+
+    def terminate(self):
+        """
+        Stops the workers immediately, discarding pending work.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            residentData.pop(self.poolId, None)
+            self.restore_blas_threads()
+
+
+class NLLEvaluator(object):
+    """
+    Callable which computes the negative log likelihood (NLL) of the trials
+    installed in the workers of a pool, given a set of model parameters.
+    Results are cached by parameter values, so that optimizers which revisit
+    the same point (e.g. during line searches or bound clipping) only pay for
+    it once.
+    """
+    def __init__(self, pool, modelClass, significantDigits=10):
+        """
+        Args:
+          pool: a WorkerPool object with the data trials installed.
+          modelClass: class of the model, e.g. DDM or aDDM. Models are created
+              as modelClass(*params).
+          significantDigits: int, number of significant digits of each
+              parameter used as the cache key. This should be large enough
+              that the small steps used by optimizers to estimate gradients
+              by finite differences are not merged.
+        """
+        self.pool = pool
+        self.modelClass = modelClass
+        self.significantDigits = significantDigits
+        self.cache = dict()
+        self.numEvaluations = 0
+        self.numCacheHits = 0
+
+
+    def __call__(self, params):
+        """
+        Args:
+          params: list of model parameters, in the order expected by the
+              model constructor.
+        Returns:
+          The NLL for the installed trials and the given model. If all
+              likelihoods are zero, infinity is returned.
+        """
+        key = tuple(float(u"%.*g" % (self.significantDigits, p))
+                    for p in params)
+        if key in self.cache:
+            self.numCacheHits += 1
+            return self.cache[key]
+
+        model = self.modelClass(*params)
+        try:
+            likelihoods = self.pool.get_grid_likelihoods([model])[0, :]
+        except:
+            print(u"An exception occurred during the likelihood "
+                  "computations for model " + str(model.params) + u".")
+            raise
+        logLikelihood = np.sum(np.log(likelihoods[likelihoods != 0]))
+        nll = -logLikelihood if logLikelihood != 0 else float("inf")
+
+        self.cache[key] = nll
+        self.numEvaluations += 1
+        return nll
+
+
+    def get_summary(self):
+        """
+        Returns:
+          A string summarizing the number of NLL evaluations performed and
+              avoided through the cache.
+        """
+        return (str(self.numEvaluations + self.numCacheHits) + u" NLL "
+                "queries: " + str(self.numEvaluations) + u" computed, " +
+                str(self.numCacheHits) + u" served from cache.")
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: parallel_test.py
+
+Unit tests for the parallel.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import os
+import threading
+import unittest
+
+from .addm import FixationData, aDDM
+from .ddm import DDM
+from .parallel import (BLAS_THREAD_VARIABLES, WorkerPool, NLLEvaluator,
+                       get_resident_data, get_resident_trials,
+                       get_thread_layout, residentData, split_trials_by_cost)
+
+
+def make_fixation_data():
+    fixations = dict()
+    for fixNumber in range(1, 4):
+        fixations[fixNumber] = np.array([200, 400, 600])
+    return FixationData(
+        probFixLeftFirst=0.5, latencies=np.array([100, 200]),
+        transitions=np.array([20, 40]), fixations=fixations,
+        fixDistType=u"simple")
+
+
+def get_worker_id(item):
+    return os.getpid()
+
+
+def get_num_resident_trials(poolId):
+    return len(get_resident_trials(poolId))
+
+
+def get_blas_variable(variable):
+    return os.environ.get(variable)
+
+
+def get_resident_value(args):
+    poolId, name = args
+    return get_resident_data(name, poolId)
+
+
+def assert_batches_equal(batch1, batch2):
+    for field in [u"RT", u"choice", u"valueLeft", u"valueRight",
+                  u"fixOffsets", u"fixItem", u"fixTime", u"fixRDV",
+                  u"uninterruptedLastFixTime"]:
+        np.testing.assert_array_equal(getattr(batch1, field),
+                                      getattr(batch2, field))
+
+
+class TestSimulateTrials(unittest.TestCase):
+    def setUp(self):
+        self.trialConditions = [(0, 0), (1, 3), (3, 1)]
+        self.fixationData = make_fixation_data()
+
+    def simulate(self, model, numThreads, backend=u"process",
+                 fixationData=None):
+        with WorkerPool(numThreads, backend=backend) as pool:
+            return pool.simulate_trials(
+                model, self.trialConditions, 50, fixationData,
+                trialsPerTask=20, seed=11)
+
+    def test_ddm_same_batches_for_any_number_of_workers(self):
+        model = DDM(d=0.006, sigma=0.07)
+        batch1 = self.simulate(model, 1)
+        batch2 = self.simulate(model, 3)
+
+        self.assertEqual(150, len(batch1))
+        assert_batches_equal(batch1, batch2)
+
+    def test_addm_same_batches_for_any_number_of_workers(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch1 = self.simulate(model, 1, fixationData=self.fixationData)
+        batch2 = self.simulate(model, 3, fixationData=self.fixationData)
+        batch3 = self.simulate(model, 3, backend=u"thread",
+                               fixationData=self.fixationData)
+
+        self.assertEqual(150, len(batch1))
+        assert_batches_equal(batch1, batch2)
+        assert_batches_equal(batch1, batch3)
+
+    def test_default_seed_gives_independent_tasks(self):
+        model = DDM(d=0.005, sigma=0.07)
+        with WorkerPool(4) as pool:
+            batch = pool.simulate_trials(model, [(1, 1)] * 8, 20,
+                                         trialsPerTask=20)
+
+        # Each task simulates one trial condition; forked workers must not
+        # repeat each other's draws.
+        rows = [tuple(batch.RT[i:i + 20]) for i in range(0, 160, 20)]
+        self.assertEqual(8, len(set(rows)))
+
+    def test_batches_ordered_by_trial_condition(self):
+        model = DDM(d=0.006, sigma=0.07)
+        batch = self.simulate(model, 3)
+
+        np.testing.assert_array_equal(
+            np.repeat([0, 1, 3], 50), batch.valueLeft)
+        np.testing.assert_array_equal(
+            np.repeat([0, 3, 1], 50), batch.valueRight)
+
+
+class TestPoolReuse(unittest.TestCase):
+    def setUp(self):
+        model = DDM(d=0.006, sigma=0.07)
+        batch = model.simulate_conditions([(0, 0), (1, 3), (3, 1)], 10,
+                                          rng=5)
+        self.trials = batch.to_trials()
+        self.models = [DDM(d=0.004, sigma=0.06), DDM(d=0.006, sigma=0.07),
+                       DDM(d=0.008, sigma=0.08)]
+
+    def test_same_workers_for_all_models(self):
+        workerIds = set()
+        with WorkerPool(2) as pool:
+            workers = pool.pool
+            for model in self.models:
+                likelihoods = model.parallel_get_likelihoods(self.trials,
+                                                             pool=pool)
+                workerIds.update(pool.map(get_worker_id, range(20)))
+
+                self.assertIs(workers, pool.pool)
+                np.testing.assert_allclose(
+                    [model.get_trial_likelihood(trial)
+                     for trial in self.trials], likelihoods)
+
+        self.assertLessEqual(len(workerIds), 2)
+        self.assertNotIn(os.getpid(), workerIds)
+
+    def test_own_pool_closed_after_call(self):
+        model = self.models[0]
+        numThreads = threading.active_count()
+        likelihoods = model.parallel_get_likelihoods(self.trials,
+                                                     numThreads=2,
+                                                     backend=u"thread")
+
+        self.assertEqual(numThreads, threading.active_count())
+        np.testing.assert_allclose(
+            [model.get_trial_likelihood(trial) for trial in self.trials],
+            likelihoods)
+
+    def test_trials_or_pool_required(self):
+        self.assertRaises(RuntimeError,
+                          self.models[0].parallel_get_likelihoods)
+
+
+class TestResidentLikelihoods(unittest.TestCase):
+    def setUp(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch = model.simulate_conditions(
+            [(0, 0), (1, 3), (3, 1)], make_fixation_data(), 5, rng=3)
+        self.trials = batch.to_trials()
+        self.model = aDDM(d=0.005, sigma=0.08, theta=0.5)
+        self.expected = [self.model.get_trial_likelihood(trial)
+                         for trial in self.trials]
+
+    def test_trials_installed_in_each_worker(self):
+        with WorkerPool(2, trials=self.trials) as pool:
+            numResidentTrials = pool.map(get_num_resident_trials,
+                                         [pool.poolId] * 8, chunksize=1)
+        self.assertEqual([len(self.trials)] * 8, numResidentTrials)
+
+    def test_likelihoods_in_trial_order(self):
+        # From a single chunk to more chunks than trials.
+        for chunksPerWorker in [1, 4, 20]:
+            with WorkerPool(2, trials=self.trials,
+                            chunksPerWorker=chunksPerWorker) as pool:
+                likelihoods = self.model.parallel_get_likelihoods(pool=pool)
+            np.testing.assert_allclose(self.expected, likelihoods)
+
+    def test_pool_without_trials(self):
+        with WorkerPool(2, backend=u"thread") as pool:
+            self.assertRaises(RuntimeError, pool.get_resident_likelihoods,
+                              self.model)
+
+
+class TestCostModel(unittest.TestCase):
+    def setUp(self):
+        self.costs = np.array([5, 1, 8, 3, 3, 9, 2, 7, 1, 4], dtype=float)
+
+    def test_chunks_cover_each_trial_once(self):
+        for numChunks in [1, 3, 10, 15]:
+            chunks = split_trials_by_cost(self.costs, numChunks)
+            trialIndices = np.concatenate([chunk[0] for chunk in chunks])
+
+            self.assertLessEqual(len(chunks), numChunks)
+            np.testing.assert_array_equal(np.arange(10),
+                                          np.sort(trialIndices))
+            for chunkIndices, cost in chunks:
+                self.assertEqual(np.sum(self.costs[chunkIndices]), cost)
+
+    def test_chunks_sorted_by_cost(self):
+        chunks = split_trials_by_cost(self.costs, 3)
+        trialIndices = np.concatenate([chunk[0] for chunk in chunks])
+
+        # Expensive trials come first, and each chunk holds at most about a
+        # third of the total cost plus its most expensive trial.
+        np.testing.assert_array_equal(np.sort(self.costs)[::-1],
+                                      self.costs[trialIndices])
+        for chunkIndices, cost in chunks:
+            self.assertLessEqual(
+                cost, np.sum(self.costs) / 3 + np.max(self.costs))
+
+    def test_zero_costs_split_by_count(self):
+        chunks = split_trials_by_cost(np.zeros(6), 3)
+        self.assertEqual([2, 2, 2], [chunk[0].size for chunk in chunks])
+
+    def test_grid_runtime_estimate(self):
+        model = DDM(d=0.006, sigma=0.07)
+        trials = model.simulate_conditions([(1, 3), (3, 1)], 5,
+                                           rng=5).to_trials()
+        models = [DDM(d=0.004, sigma=0.06), DDM(d=0.008, sigma=0.08)]
+        with WorkerPool(2, trials=trials, backend=u"thread") as pool:
+            totalCost, seconds = pool.estimate_grid_runtime(models)
+
+        expectedCost = 2 * np.sum([model.get_trial_cost(trial)
+                                   for trial in trials])
+        self.assertEqual(expectedCost, totalCost)
+        self.assertGreater(seconds, 0)
+
+    def test_grid_runtime_estimate_requires_trials(self):
+        with WorkerPool(2, backend=u"thread") as pool:
+            self.assertRaises(RuntimeError, pool.estimate_grid_runtime,
+                              [DDM(d=0.006, sigma=0.07)])
+
+
+class TestGridLikelihoods(unittest.TestCase):
+    def setUp(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch = model.simulate_conditions(
+            [(0, 0), (1, 3), (3, 1)], make_fixation_data(), 8, rng=3)
+        self.trials = batch.to_trials()
+        self.models = [aDDM(d=0.004, sigma=0.06, theta=0.3),
+                       aDDM(d=0.006, sigma=0.07, theta=0.5),
+                       aDDM(d=0.008, sigma=0.08, theta=0.7)]
+
+    def get_serial_likelihoods(self):
+        return np.array([[model.get_trial_likelihood(trial)
+                          for trial in self.trials]
+                         for model in self.models])
+
+    def test_process_pool_matches_serial(self):
+        with WorkerPool(2, trials=self.trials) as pool:
+            likelihoods = pool.get_grid_likelihoods(self.models)
+        np.testing.assert_allclose(self.get_serial_likelihoods(),
+                                   likelihoods)
+
+    def test_thread_pool_matches_serial(self):
+        with WorkerPool(2, trials=self.trials, backend=u"thread") as pool:
+            likelihoods = pool.get_grid_likelihoods(self.models, numChunks=5)
+        np.testing.assert_allclose(self.get_serial_likelihoods(),
+                                   likelihoods)
+
+    def test_empty_grid(self):
+        with WorkerPool(2, trials=self.trials) as pool:
+            likelihoods = pool.get_grid_likelihoods([])
+        self.assertEqual((0, len(self.trials)), likelihoods.shape)
+
+
+class TestThreadBackend(unittest.TestCase):
+    def setUp(self):
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        batch = model.simulate_conditions(
+            [(0, 0), (1, 3), (3, 1)], make_fixation_data(), 5, rng=3)
+        self.trials = batch.to_trials()
+        self.model = aDDM(d=0.005, sigma=0.08, theta=0.5)
+
+    def test_thread_likelihoods_match_process(self):
+        likelihoods = dict()
+        for backend in [u"process", u"thread"]:
+            with WorkerPool(2, trials=self.trials, backend=backend) as pool:
+                likelihoods[backend] = pool.get_resident_likelihoods(
+                    self.model)
+        np.testing.assert_array_equal(likelihoods[u"process"],
+                                      likelihoods[u"thread"])
+
+    def test_pools_keep_their_own_trials(self):
+        expected = [self.model.get_trial_likelihood(trial)
+                    for trial in self.trials]
+        with WorkerPool(2, trials=self.trials[:5],
+                        backend=u"thread") as pool1:
+            with WorkerPool(2, trials=self.trials,
+                            backend=u"thread") as pool2:
+                likelihoods1 = pool1.get_resident_likelihoods(self.model)
+                likelihoods2 = pool2.get_resident_likelihoods(self.model)
+        np.testing.assert_allclose(expected[:5], likelihoods1)
+        np.testing.assert_allclose(expected, likelihoods2)
+
+    def test_pools_keep_their_own_data(self):
+        with WorkerPool(2, backend=u"thread",
+                        residentData={u"value": 1}) as pool1:
+            with WorkerPool(2, backend=u"thread",
+                            residentData={u"value": 2}) as pool2:
+                values1 = pool1.map(get_resident_value,
+                                    [(pool1.poolId, u"value")] * 4)
+                values2 = pool2.map(get_resident_value,
+                                    [(pool2.poolId, u"value")] * 4)
+            self.assertNotIn(pool2.poolId, residentData)
+            self.assertIn(pool1.poolId, residentData)
+        self.assertEqual([1] * 4, values1)
+        self.assertEqual([2] * 4, values2)
+
+    def test_invalid_backend(self):
+        self.assertRaises(RuntimeError, WorkerPool, 2, backend=u"mpi")
+
+
+class TestThreadBudget(unittest.TestCase):
+    def setUp(self):
+        self.previousValues = dict((variable, os.environ.get(variable))
+                                   for variable in BLAS_THREAD_VARIABLES)
+        os.environ[u"OMP_NUM_THREADS"] = u"7"
+        os.environ.pop(u"OPENBLAS_NUM_THREADS", None)
+
+    def tearDown(self):
+        for variable, value in self.previousValues.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+    def assert_limits_restored(self):
+        self.assertEqual(u"7", os.environ.get(u"OMP_NUM_THREADS"))
+        self.assertNotIn(u"OPENBLAS_NUM_THREADS", os.environ)
+
+    def test_thread_layout(self):
+        self.assertEqual((4, 2), get_thread_layout(4, 8))
+        self.assertEqual((3, 2), get_thread_layout(3, 8))
+        self.assertEqual((4, 1), get_thread_layout(16, 4))
+        self.assertEqual((1, 4), get_thread_layout(0, 4))
+
+    def test_thread_pool_limits_restored_after_close(self):
+        with WorkerPool(4, backend=u"thread", threadBudget=8) as pool:
+            self.assertEqual((4, 2), (pool.numThreads, pool.numBlasThreads))
+            for variable in BLAS_THREAD_VARIABLES:
+                self.assertEqual(u"2", os.environ.get(variable))
+        self.assert_limits_restored()
+
+    def test_thread_pool_limits_restored_after_terminate(self):
+        try:
+            with WorkerPool(4, backend=u"thread", threadBudget=8):
+                raise ValueError(u"Optimization failed.")
+        except ValueError:
+            pass
+        self.assert_limits_restored()
+
+    def test_process_pool_limits_set_in_workers(self):
+        with WorkerPool(2, threadBudget=6) as pool:
+            values = pool.map(get_blas_variable,
+                              BLAS_THREAD_VARIABLES * 2, chunksize=1)
+            self.assert_limits_restored()
+        self.assertEqual([u"3"] * len(values), values)
+
+    def test_limits_unchanged_without_budget(self):
+        with WorkerPool(2, backend=u"thread") as pool:
+            self.assertIsNone(pool.numBlasThreads)
+            self.assert_limits_restored()
+            self.assertEqual(u"2 worker threads, BLAS threads not limited.",
+                             pool.get_layout_description())
+
+
+class TestPoolLifecycle(unittest.TestCase):
+    # Thread workers share the resident data of the main process, so it can
+    # be checked here.
+    def test_context_manager_closes_pool(self):
+        with WorkerPool(2, trials=[], backend=u"thread") as pool:
+            self.assertIsNotNone(pool.pool)
+            self.assertIn(pool.poolId, residentData)
+        self.assertIsNone(pool.pool)
+        self.assertNotIn(pool.poolId, residentData)
+
+    def test_context_manager_terminates_pool_on_error(self):
+        try:
+            with WorkerPool(2, trials=[], backend=u"thread") as pool:
+                raise ValueError(u"Optimization failed.")
+        except ValueError:
+            pass
+        self.assertIsNone(pool.pool)
+        self.assertNotIn(pool.poolId, residentData)
+
+
+class TestNLLEvaluator(unittest.TestCase):
+    def setUp(self):
+        model = DDM(d=0.006, sigma=0.07)
+        batch = model.simulate_conditions([(0, 0), (1, 3), (3, 1)], 10,
+                                          rng=5)
+        self.trials = batch.to_trials()
+
+    def test_nll_matches_serial(self):
+        model = DDM(d=0.005, sigma=0.08)
+        expected = -np.sum(np.log(
+            [model.get_trial_likelihood(trial) for trial in self.trials]))
+        with WorkerPool(2, trials=self.trials, backend=u"thread") as pool:
+            nll = NLLEvaluator(pool, DDM)([0.005, 0.08])
+        self.assertAlmostEqual(expected, nll)
+
+    def test_repeated_parameters_served_from_cache(self):
+        with WorkerPool(2, trials=self.trials, backend=u"thread") as pool:
+            evaluator = NLLEvaluator(pool, DDM, significantDigits=6)
+            nll1 = evaluator([0.005, 0.08])
+            nll2 = evaluator([0.005, 0.08])
+            nll3 = evaluator([0.005 + 1e-12, 0.08])
+            nll4 = evaluator([0.006, 0.08])
+
+        self.assertEqual(nll1, nll2)
+        self.assertEqual(nll1, nll3)
+        self.assertNotEqual(nll1, nll4)
+        self.assertEqual(2, evaluator.numEvaluations)
+        self.assertEqual(2, evaluator.numCacheHits)
+        self.assertEqual(2, len(evaluator.cache))
+        self.assertEqual(u"4 NLL queries: 2 computed, 2 served from cache.",
+                         evaluator.get_summary())
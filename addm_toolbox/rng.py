@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: rng.py
+
+Random number streams for simulations. Seeds are split into independent
+streams with numpy's SeedSequence, one per task (e.g. per trial condition or
+per model), so that results do not depend on how tasks are distributed among
+workers. When no seed is given, tasks still get independent streams,
+spawned from fresh entropy; only the serial simulators called without an rng
+draw from the global numpy.random state, as before. Streams created from a
+seed are buffered: standard normals and uniforms are pre-drawn in blocks,
+which makes the scalar draws in the simulation loops much cheaper.
+"""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+
+def get_generator(rng=None):
+    """
+    Returns a source of random numbers to be used by the simulators.
+    Args:
+      rng: None, an int seed, a numpy SeedSequence, or an existing source
+          (a numpy Generator or RandomState, or the numpy.random module).
+    Returns:
+      The numpy.random module (i.e. the global random state) if rng is None,
+          rng itself if it is an existing source, or a new BufferedGenerator
+          seeded with rng otherwise. All of these provide the choice(),
+          normal(), uniform(), multinomial() and permutation() methods.
+    """
+    if rng is None:
+        return np.random
+    if (rng is np.random or
+        isinstance(rng, (np.random.Generator, np.random.RandomState,
+                         BufferedGenerator))):
+        return rng
+    return BufferedGenerator(rng)
+
+
+def spawn_seeds(seed, numStreams):
+    """
+    Splits a seed into independent child seeds, one for each random stream.
+    Child seeds are small and can be sent to pool workers, which then create
+    their own generators with get_generator().
+    Args:
+      seed: None, an int or a numpy SeedSequence. If None, the child seeds
+          are spawned from fresh entropy from the OS, so the streams are
+          still independent of each other (forked pool workers share the
+          global random state, and would otherwise draw the same numbers),
+          but they cannot be reproduced. Spawning from the same SeedSequence
+          object more than once yields new, independent seeds each time.
+      numStreams: int, number of child seeds.
+    Returns:
+      A list of numpy SeedSequence objects.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence()
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(numStreams)
+
+
+class BufferedGenerator(object):
+    """
+    Source of random numbers based on a numpy Generator, which pre-draws
+    standard normals and uniforms in blocks and hands them out from a cursor.
+    Single draws, such as the ones made at each time step of a trial
+    simulation, then cost little more than a list lookup. Array draws go
+    straight to the underlying Generator.
+    """
+    def __init__(self, seed=None, blockSize=4096):
+        """
+        Args:
+          seed: None, an int, a numpy SeedSequence or a numpy Generator. If
+              None, the Generator is seeded with fresh entropy from the OS.
+          blockSize: int, number of values pre-drawn at a time.
+        """
+        if isinstance(seed, np.random.Generator):
+            self.generator = seed
+        else:
+            self.generator = np.random.default_rng(seed)
+        self.blockSize = blockSize
+        self.normals = list()
+        self.normalsCursor = 0
+        self.uniforms = list()
+        self.uniformsCursor = 0
+
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        """
+        Draws from a normal distribution, as numpy.random.Generator.normal().
+        """
+        if (size is not None or isinstance(loc, np.ndarray) or
+            isinstance(scale, np.ndarray)):
+            return self.generator.normal(loc, scale, size)
+        if self.normalsCursor == len(self.normals):
+            self.normals = self.generator.standard_normal(
+                self.blockSize).tolist()
+            self.normalsCursor = 0
+        value = self.normals[self.normalsCursor]
+        self.normalsCursor += 1
+        return loc + scale * value
+
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """
+        Draws from a uniform distribution, as
+        numpy.random.Generator.uniform().
+        """
+        if (size is not None or isinstance(low, np.ndarray) or
+            isinstance(high, np.ndarray)):
+            return self.generator.uniform(low, high, size)
+        if self.uniformsCursor == len(self.uniforms):
+            self.uniforms = self.generator.random(self.blockSize).tolist()
+            self.uniformsCursor = 0
+        value = self.uniforms[self.uniformsCursor]
+        self.uniformsCursor += 1
+        return low + (high - low) * value
+
+
+    def choice(self, a, size=None, replace=True, p=None):
+        """
+        Draws a random sample from a, as numpy.random.Generator.choice().
+        Single draws use the buffered uniforms; all other draws are delegated
+        to the underlying Generator.
+        """
+        if size is not None or not replace:
+            return self.generator.choice(a, size, replace, p)
+        isRange = isinstance(a, (int, np.integer))
+        numItems = a if isRange else len(a)
+        value = self.uniform()
+        if p is None:
+            index = min(int(value * numItems), numItems - 1)
+        else:
+            # Walk the cumulative probabilities; p is short in the
+            # simulators (e.g. the first fixation location).
+            index = 0
+            total = p[0]
+            while value >= total and index < numItems - 1:
+                index += 1
+                total += p[index]
+        if isRange:
+            return index
+        return a[index]
+
+
+    def multinomial(self, n, pvals, size=None):
+        """
+        Draws from a multinomial distribution, as
+        numpy.random.Generator.multinomial().
+        """
+        return self.generator.multinomial(n, pvals, size)
+
+
+    def permutation(self, x):
+        """
+        Returns a random permutation of x, as
+        numpy.random.Generator.permutation().
+        """
+        return self.generator.permutation(x)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: rng_test.py
+
+Unit tests for the rng.py module.
+"""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+import unittest
+
+from .rng import BufferedGenerator, get_generator, spawn_seeds
+
+
+def draw_sequence(rng):
+    """
+    Makes a mix of single and array draws of every kind.
+    """
+    values = list()
+    for i in range(30):
+        values.append(rng.normal(1, 2))
+        values.append(rng.uniform(-1, 1))
+        values.append(rng.choice([10, 20, 30], p=[0.2, 0.3, 0.5]))
+        values.append(rng.choice(4))
+    values.extend(rng.normal(size=5))
+    values.extend(rng.uniform(size=5))
+    values.extend(rng.choice([1, 2], size=5))
+    values.extend(rng.multinomial(10, [0.5, 0.5]))
+    values.extend(rng.permutation(5))
+    return values
+
+
+class TestBufferedGenerator(unittest.TestCase):
+    def test_same_seed_same_sequence(self):
+        values1 = draw_sequence(BufferedGenerator(42, blockSize=7))
+        values2 = draw_sequence(BufferedGenerator(42, blockSize=7))
+        values3 = draw_sequence(BufferedGenerator(43, blockSize=7))
+
+        np.testing.assert_array_equal(values1, values2)
+        self.assertFalse(np.array_equal(values1, values3))
+
+    def test_same_seed_sequence_same_sequence(self):
+        values1 = draw_sequence(BufferedGenerator(np.random.SeedSequence(5)))
+        values2 = draw_sequence(BufferedGenerator(np.random.SeedSequence(5)))
+        np.testing.assert_array_equal(values1, values2)
+
+    def test_single_draws_follow_generator_stream(self):
+        rng = BufferedGenerator(7, blockSize=5)
+        normals = [rng.normal(1, 2) for _ in range(12)]
+        uniforms = [rng.uniform(-1, 1) for _ in range(12)]
+
+        generator = np.random.default_rng(7)
+        expectedNormals = np.concatenate(
+            [generator.standard_normal(5) for _ in range(3)])[:12]
+        expectedUniforms = np.concatenate(
+            [generator.random(5) for _ in range(3)])[:12]
+        np.testing.assert_allclose(1 + 2 * expectedNormals, normals)
+        np.testing.assert_allclose(-1 + 2 * expectedUniforms, uniforms)
+
+    def test_single_choice_with_probabilities(self):
+        rng = BufferedGenerator(8)
+        samples = np.array([rng.choice([1, 2, 3], p=[0.2, 0.3, 0.5])
+                            for _ in range(20000)])
+
+        for item, prob in [(1, 0.2), (2, 0.3), (3, 0.5)]:
+            self.assertAlmostEqual(prob, np.mean(samples == item), delta=0.02)
+
+    def test_single_choice_from_range(self):
+        rng = BufferedGenerator(9)
+        samples = np.array([rng.choice(3) for _ in range(20000)])
+
+        self.assertEqual(set([0, 1, 2]), set(samples))
+        for item in range(3):
+            self.assertAlmostEqual(1 / 3, np.mean(samples == item),
+                                   delta=0.02)
+
+
+class TestGetGenerator(unittest.TestCase):
+    def test_no_seed_uses_global_state(self):
+        self.assertIs(np.random, get_generator(None))
+
+    def test_existing_source_kept(self):
+        generator = np.random.default_rng(1)
+        bufferedGenerator = BufferedGenerator(1)
+        self.assertIs(generator, get_generator(generator))
+        self.assertIs(bufferedGenerator, get_generator(bufferedGenerator))
+
+    def test_seed_creates_buffered_generator(self):
+        rng = get_generator(3)
+        self.assertIsInstance(rng, BufferedGenerator)
+        self.assertEqual(BufferedGenerator(3).normal(), rng.normal())
+
+
+class TestSpawnSeeds(unittest.TestCase):
+    def test_no_seed_gives_independent_streams(self):
+        seeds = spawn_seeds(None, 3)
+
+        self.assertEqual(3, len(seeds))
+        values = [BufferedGenerator(seed).normal() for seed in seeds]
+        self.assertEqual(3, len(set(values)))
+        otherSeed = spawn_seeds(None, 1)[0]
+        self.assertNotEqual(values[0], BufferedGenerator(otherSeed).normal())
+
+    def test_more_streams_keep_earlier_ones(self):
+        seeds1 = spawn_seeds(11, 2)
+        seeds2 = spawn_seeds(11, 4)
+
+        for seed1, seed2 in zip(seeds1, seeds2):
+            self.assertEqual(BufferedGenerator(seed1).normal(),
+                             BufferedGenerator(seed2).normal())
+        self.assertNotEqual(BufferedGenerator(seeds2[0]).normal(),
+                            BufferedGenerator(seeds2[1]).normal())
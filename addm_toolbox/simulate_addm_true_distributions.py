@@ -46,8 +46,10 @@ from builtins import range, str, zip
 from datetime import datetime
 
 from .addm import aDDM
+from .parallel import WorkerPool
+from .rng import spawn_seeds
 from .util import (load_trial_conditions_from_csv, load_data_from_csv,
-                   get_empirical_distributions, save_simulations_to_csv,
+                   get_empirical_distributions, SimulationWriter,
                    convert_item_values)
 
 
@@ -55,7 +57,9 @@ from .util import (load_trial_conditions_from_csv, load_data_from_csv,
 def main(d, sigma, theta, trialsFileName=None, expdataFileName=None,
          fixationsFileName=None, binStep=10, maxFixBin=3000, numFixDists=3,
          numIterations=3, simulationsPerCondition=800, subjectIds=[],
-         saveSimulations=False, verbose=False):
+         saveSimulations=False, verbose=False, seed=None,
+         simulationMethod=u"steps", numThreads=9, backend=u"process",
+         threadBudget=None):
     """
     Args:
       d: float, aDDM parameter for generating artificial data.
@@ -78,6 +82,17 @@ def main(d, sigma, theta, trialsFileName=None, expdataFileName=None,
       saveFigures: boolean, whether or not save figures comparing choice and RT
           curves for data and simulations.
       verbose: boolean, whether or not to increase output verbosity.
+      seed: int, seed of the random streams used to generate the
+          simulations. If not provided, the streams are seeded with fresh
+          entropy.
+      simulationMethod: string, one of {'steps', 'bridge'}, method used to
+          simulate the RDV. 'bridge' is approximate. See
+          aDDM.simulate_conditions().
+      numThreads: int, size of the pool used to generate the simulations.
+      backend: string, one of {'process', 'thread'}, type of the workers in
+          the pool. See parallel.WorkerPool.
+      threadBudget: int, total number of cores to be used by the pool,
+          split between workers and per-worker BLAS threads.
     """
     # Load trial conditions.
     if not trialsFileName:
@@ -129,117 +144,120 @@ def main(d, sigma, theta, trialsFileName=None, expdataFileName=None,
                     empiricalFixDist[numFix][valueDiff][bin] / sumBins)
 
     model = aDDM(d, sigma, theta)
-    for it in range(numIterations):
-        if verbose:
-            print(u"Iteration " + str(it + 1) + u"/" + str(numIterations))
-        # Generate simulations using the current empirical distributions and
-        # the model parameters.
-        simulTrials = list()
-        for (valueLeft, valueRight) in trialConditions:
-            for s in range(simulationsPerCondition):
-                try:
-                    simulTrials.append(
-                        model.simulate_trial(
-                            valueLeft, valueRight, fixationData,
-                            numFixDists=numFixDists,
-                            fixationDist=empiricalFixDist, timeBins=bins))
-                except:
-                    print(u"An exception occurred while generating "
-                          "artificial trial " + str(s) + u" for condition (" +
-                          str(valueLeft) + u", " + str(valueRight) +
-                          u") (iteration " + str(it) + u").")
-                    raise
+    # One seed per iteration, plus one for the final simulations.
+    iterationSeeds = spawn_seeds(seed, numIterations + 1)
+    with WorkerPool(numThreads, backend=backend,
+                    threadBudget=threadBudget) as pool:
+        for it in range(numIterations):
+            if verbose:
+                print(u"Iteration " + str(it + 1) + u"/" + str(numIterations))
+            # Generate simulations using the current empirical distributions
+            # and the model parameters.
+            try:
+                simulTrials = pool.simulate_trials(
+                    model, trialConditions, simulationsPerCondition,
+                    fixationData, seed=iterationSeeds[it],
+                    simulationArgs=dict(numFixDists=numFixDists,
+                                        fixationDist=empiricalFixDist,
+                                        timeBins=bins,
+                                        simulationMethod=simulationMethod))
+            except:
+                print(u"An exception occurred while generating artificial "
+                      "trials (iteration " + str(it) + u").")
+                raise
 
-        countLastFix = dict()
-        countTotal = dict()
-        for numFix in range(1, numFixDists + 1):
-            countLastFix[numFix] = dict()
-            countTotal[numFix] = dict()
-            for valueDiff in range(-3,4):
-                countLastFix[numFix][valueDiff] = dict()
-                countTotal[numFix][valueDiff] = dict()
-                for bin in bins:
-                    countLastFix[numFix][valueDiff][bin] = 0
-                    countTotal[numFix][valueDiff][bin] = 0
-
-        for trial in simulTrials:
-            # Count all item fixations, except last.
-            fixUnfixValueDiffs = {
-                1: trial.valueLeft - trial.valueRight,
-                2: trial.valueRight - trial.valueLeft}
-            lastItemFixSkipped = False
-            numFix = 1
-            for item, time in zip(reversed(trial.fixItem),
-                                  reversed(trial.fixTime)):
-                if not lastItemFixSkipped and (item == 1 or item == 2):
-                    # Count last fixation (only if it was to an item).
-                    bin = binStep * min(
-                        (trial.uninterruptedLastFixTime // binStep) + 1,
-                        len(bins))
-                    vDiff = fixUnfixValueDiffs[item]
-                    countLastFix[numFix][vDiff][bin] += 1
-                    countTotal[numFix][vDiff][bin] += 1
-                    lastItemFixSkipped = True
-                    continue
-                if item == 1 or item == 2:
-                    # Count item fixations other than the last one.
-                    bin = binStep * min((time // binStep) + 1, len(bins))
-                    vDiff = fixUnfixValueDiffs[item]
-                    countTotal[numFix][vDiff][bin] += 1
-                    if numFix < numFixDists:
-                        numFix += 1
-
-        # Obtain true distributions of fixations.
-        trueFixDist = dict()
-        for numFix in range(1, numFixDists + 1):
-            trueFixDist[numFix] = dict()
-            for valueDiff in range(-3,4):
-                trueFixDist[numFix][valueDiff] = dict()
-                for bin in bins:
-                    probNotLastFix = 1
-                    if countTotal[numFix][valueDiff][bin] > 0:
-                        probNotLastFix = 1 - (
-                            countLastFix[numFix][valueDiff][bin] /
-                            countTotal[numFix][valueDiff][bin])
-                    if probNotLastFix == 0:
-                        trueFixDist[numFix][valueDiff][bin] = (
-                            empiricalFixDist[numFix][valueDiff][bin])
-                    else:
-                        trueFixDist[numFix][valueDiff][bin] = (
-                            empiricalFixDist[numFix][valueDiff][bin] /
-                            probNotLastFix)
-        # Normalize the distributions.
-        for numFix in range(1, numFixDists + 1):
-            for valueDiff in range(-3,4):
-                sumBins = sum(list(trueFixDist[numFix][valueDiff].values()))
-                if sumBins > 0:
+            countLastFix = dict()
+            countTotal = dict()
+            for numFix in range(1, numFixDists + 1):
+                countLastFix[numFix] = dict()
+                countTotal[numFix] = dict()
+                for valueDiff in range(-3,4):
+                    countLastFix[numFix][valueDiff] = dict()
+                    countTotal[numFix][valueDiff] = dict()
                     for bin in bins:
-                        trueFixDist[numFix][valueDiff][bin] = (
-                            trueFixDist[numFix][valueDiff][bin] /
-                            sumBins)
+                        countLastFix[numFix][valueDiff][bin] = 0
+                        countTotal[numFix][valueDiff][bin] = 0
 
-        # Update empirical distributions using the current true distributions.
-        empiricalFixDist = trueFixDist
+            for trial in simulTrials:
+                # Count all item fixations, except last.
+                fixUnfixValueDiffs = {
+                    1: trial.valueLeft - trial.valueRight,
+                    2: trial.valueRight - trial.valueLeft}
+                lastItemFixSkipped = False
+                numFix = 1
+                for item, time in zip(reversed(trial.fixItem),
+                                      reversed(trial.fixTime)):
+                    if not lastItemFixSkipped and (item == 1 or item == 2):
+                        # Count last fixation (only if it was to an item).
+                        bin = binStep * min(
+                            (trial.uninterruptedLastFixTime // binStep) + 1,
+                            len(bins))
+                        vDiff = fixUnfixValueDiffs[item]
+                        countLastFix[numFix][vDiff][bin] += 1
+                        countTotal[numFix][vDiff][bin] += 1
+                        lastItemFixSkipped = True
+                        continue
+                    if item == 1 or item == 2:
+                        # Count item fixations other than the last one.
+                        bin = binStep * min((time // binStep) + 1, len(bins))
+                        vDiff = fixUnfixValueDiffs[item]
+                        countTotal[numFix][vDiff][bin] += 1
+                        if numFix < numFixDists:
+                            numFix += 1
 
-    # Generate final simulations.
-    simulTrials = list()
-    for (valueLeft, valueRight) in trialConditions:
-        for s in range(simulationsPerCondition):
-            try:
-                simulTrials.append(
-                    model.simulate_trial(
-                        valueLeft, valueRight, fixationData,
-                        numFixDists=numFixDists,
-                        fixationDist=empiricalFixDist, timeBins=bins))
-            except:
-                print(u"An exception occurred while generating "
-                      "artificial trial " + str(s) + u" for condition (" +
-                      str(valueLeft) + u", " + str(valueRight) +
-                      u") in the final simulations generation.")
-                raise
+            # Obtain true distributions of fixations.
+            trueFixDist = dict()
+            for numFix in range(1, numFixDists + 1):
+                trueFixDist[numFix] = dict()
+                for valueDiff in range(-3,4):
+                    trueFixDist[numFix][valueDiff] = dict()
+                    for bin in bins:
+                        probNotLastFix = 1
+                        if countTotal[numFix][valueDiff][bin] > 0:
+                            probNotLastFix = 1 - (
+                                countLastFix[numFix][valueDiff][bin] /
+                                countTotal[numFix][valueDiff][bin])
+                        if probNotLastFix == 0:
+                            trueFixDist[numFix][valueDiff][bin] = (
+                                empiricalFixDist[numFix][valueDiff][bin])
+                        else:
+                            trueFixDist[numFix][valueDiff][bin] = (
+                                empiricalFixDist[numFix][valueDiff][bin] /
+                                probNotLastFix)
+            # Normalize the distributions.
+            for numFix in range(1, numFixDists + 1):
+                for valueDiff in range(-3,4):
+                    sumBins = sum(
+                        list(trueFixDist[numFix][valueDiff].values()))
+                    if sumBins > 0:
+                        for bin in bins:
+                            trueFixDist[numFix][valueDiff][bin] = (
+                                trueFixDist[numFix][valueDiff][bin] /
+                                sumBins)
+
+            # Update empirical distributions using the current true
+            # distributions.
+            empiricalFixDist = trueFixDist
 
-    if saveSimulations:
-        currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
-        save_simulations_to_csv(simulTrials,
-                                u"simul_expdata_" + currTime + u".csv",
-                                u"simul_fixations_" + currTime + u".csv")
+        if saveSimulations:
+            # Generate final simulations, saving batches as they arrive from
+            # the workers.
+            currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
+            with SimulationWriter(
+                    u"simul_expdata_" + currTime + u".csv",
+                    u"simul_fixations_" + currTime + u".csv") as writer:
+                try:
+                    for batch in pool.iter_simulations(
+                            model, trialConditions, simulationsPerCondition,
+                            fixationData, seed=iterationSeeds[-1],
+                            simulationArgs=dict(
+                                numFixDists=numFixDists,
+                                fixationDist=empiricalFixDist,
+                                timeBins=bins,
+                                simulationMethod=simulationMethod)):
+                        writer.write(batch)
+                except:
+                    print(u"An exception occurred while generating "
+                          "artificial trials in the final simulations "
+                          "generation.")
+                    raise
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: surrogate.py
+
+Surrogate model of the negative log-likelihood (NLL) surface, for use with
+continuous optimizers. A radial basis function interpolant is fitted to NLL
+values computed on a sparse design over the parameter space, and refined by
+adding points near the minima of the interpolant. Optimizers can then query
+the cheap surrogate, with the true NLL evaluated only to confirm candidates.
+"""
+
+from __future__ import absolute_import, division
+
+import numpy as np
+
+from builtins import range, str
+from scipy.interpolate import Rbf
+from scipy.optimize import minimize
+
+from .rng import get_generator
+
+
+class NLLSurrogate(object):
+    """
+    Implementation of a radial basis function surrogate for an NLL function.
+    """
+    def __init__(self, nllFunction, bounds, rbfFunction=u"thin_plate",
+                 verbose=False):
+        """
+        Args:
+          nllFunction: function which takes a list of parameters and returns
+              the true NLL for those parameters.
+          bounds: list of pairs (lowerBound, upperBound), one for each
+              parameter, in the same order expected by nllFunction.
+          rbfFunction: string, radial basis function to be used by the
+              interpolant. Must be one of the functions accepted by
+              scipy.interpolate.Rbf.
+          verbose: boolean, whether or not to increase output verbosity.
+        """
+        self.nllFunction = nllFunction
+        self.bounds = np.array(bounds, dtype=float)
+        self.rbfFunction = rbfFunction
+        self.verbose = verbose
+        self.points = list()
+        self.values = list()
+        self.interpolant = None
+        self.trendDegree = None
+        self.trendCoefficients = None
+
+
+    def _to_unit(self, params):
+        """
+        Maps parameters from the search bounds onto the unit hypercube, so that
+        all dimensions have comparable scales in the interpolant.
+        """
+        lower = self.bounds[:, 0]
+        upper = self.bounds[:, 1]
+        return (np.array(params, dtype=float) - lower) / (upper - lower)
+
+
+    def _from_unit(self, unitParams):
+        lower = self.bounds[:, 0]
+        upper = self.bounds[:, 1]
+        return lower + np.array(unitParams, dtype=float) * (upper - lower)
+
+
+    def _get_trend_features(self, unitPoints, degree):
+        """
+        Builds the polynomial features of the trend for points in the unit
+        hypercube: a constant, the parameters, and for degree 2 all products
+        of pairs of parameters.
+        """
+        unitPoints = np.atleast_2d(unitPoints)
+        features = [np.ones(unitPoints.shape[0])]
+        if degree >= 1:
+            features.extend(unitPoints.T)
+        if degree >= 2:
+            numParams = unitPoints.shape[1]
+            features.extend([unitPoints[:, i] * unitPoints[:, j]
+                             for i in range(numParams)
+                             for j in range(i, numParams)])
+        return np.array(features).T
+
+
+    def fit(self):
+        """
+        Fits the interpolant to all NLL values computed so far. A polynomial
+        trend (quadratic, or linear when there are too few points) is fitted
+        by least squares, and the radial basis functions interpolate what is
+        left. The surrogate is then exact for quadratic surfaces, which the
+        NLL resembles near its minimum. Infinite values (models under
+        which the data is impossible) are replaced by the largest finite value
+        observed, which keeps the surface smooth.
+        """
+        values = np.array(self.values, dtype=float)
+        finite = np.isfinite(values)
+        if not np.any(finite):
+            raise RuntimeError(u"All NLL values in the surrogate design are "
+                               "infinite.")
+        values[~finite] = np.max(values[finite])
+        unitPoints = np.array([self._to_unit(p) for p in self.points])
+        self.trendDegree = 0
+        for degree in [2, 1]:
+            numFeatures = self._get_trend_features(unitPoints[:1],
+                                                   degree).shape[1]
+            if len(values) >= 2 * numFeatures:
+                self.trendDegree = degree
+                break
+        features = self._get_trend_features(unitPoints, self.trendDegree)
+        self.trendCoefficients = np.linalg.lstsq(features, values,
+                                                 rcond=None)[0]
+        residuals = values - np.dot(features, self.trendCoefficients)
+        self.interpolant = Rbf(*(list(unitPoints.T) + [residuals]),
+                               function=self.rbfFunction)
+
+
+    def add_points(self, points, refit=True):
+        """
+        Evaluates the true NLL at the given points and adds them to the
+        design. Points which are already in the design are not re-evaluated.
+        Args:
+          points: list of parameter lists.
+          refit: boolean, whether or not to refit the interpolant afterwards.
+        Returns:
+          A list with the true NLL value at each point.
+        """
+        values = list()
+        for params in points:
+            # Points already in the design are not re-evaluated, since
+            # duplicates make the interpolation matrix singular.
+            unitParams = self._to_unit(params)
+            existing = [i for i, p in enumerate(self.points)
+                        if np.allclose(self._to_unit(p), unitParams)]
+            if existing:
+                values.append(self.values[existing[0]])
+                continue
+            try:
+                value = self.nllFunction(list(params))
+            except:
+                print(u"An exception occurred while evaluating the NLL for "
+                      "surrogate design point " + str(list(params)) + u".")
+                raise
+            if isinstance(value, tuple):
+                value = value[0]
+            self.points.append(np.array(params, dtype=float))
+            self.values.append(value)
+            values.append(value)
+        if refit:
+            self.fit()
+        return values
+
+
+    def build_design(self, numPoints, rng=None):
+        """
+        Evaluates the true NLL on a Latin hypercube design over the search
+        bounds, and fits the interpolant.
+        Args:
+          numPoints: int, number of design points.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        """
+        rng = get_generator(rng)
+        numParams = self.bounds.shape[0]
+        unitPoints = np.empty((numPoints, numParams))
+        for p in range(numParams):
+            unitPoints[:, p] = ((rng.permutation(numPoints) +
+                                 rng.uniform(size=numPoints)) / numPoints)
+        if self.verbose:
+            print(u"Evaluating " + str(numPoints) + u" surrogate design "
+                  "points...")
+        self.add_points([self._from_unit(u) for u in unitPoints])
+
+
+    def __call__(self, params):
+        """
+        Evaluates the surrogate NLL.
+        Args:
+          params: list of parameters, in the same order as the bounds.
+        Returns:
+          The interpolated NLL value.
+        """
+        unitParams = self._to_unit(params)
+        trend = np.dot(self._get_trend_features(unitParams, self.trendDegree),
+                       self.trendCoefficients)
+        return float(trend[0] + self.interpolant(*unitParams))
+
+
+    def get_best_point(self):
+        """
+        Returns:
+          A tuple (params, nll) with the design point with the lowest true NLL.
+        """
+        bestIndex = int(np.argmin(self.values))
+        return list(self.points[bestIndex]), self.values[bestIndex]
+
+
+    def get_surrogate_minimum(self, numStarts=3):
+        """
+        Locally minimizes the surrogate, starting from the design points with
+        the lowest true NLL.
+        Args:
+          numStarts: int, number of starting points.
+        Returns:
+          The parameters of the lowest surrogate minimum found.
+        """
+        bestParams = None
+        bestValue = float("inf")
+        for index in np.argsort(self.values)[:numStarts]:
+            result = minimize(self, self.points[index], method=u"L-BFGS-B",
+                              bounds=self.bounds)
+            if result.fun < bestValue:
+                bestValue = result.fun
+                bestParams = result.x
+        return list(bestParams)
+
+
+    def refine(self, numRefinements, numStarts=3, minDistance=0.01,
+               localRadius=0.05, rng=None):
+        """
+        Refines the surrogate near its minima. At each iteration, the true NLL
+        is computed at the minimum of the surrogate and the point is added to
+        the design. If the minimum coincides with an existing design point, a
+        random point in its neighborhood is evaluated instead.
+        Args:
+          numRefinements: int, number of refinement iterations.
+          numStarts: int, number of starting points for the local minimization
+              of the surrogate.
+          minDistance: float, distance in the unit hypercube below which a
+              candidate is considered to coincide with an existing point.
+          localRadius: float, radius in the unit hypercube of the neighborhood
+              used to sample a new point when the candidate coincides with an
+              existing point.
+          rng: source of random numbers, as accepted by
+              rng.get_generator(). If not provided, the global numpy
+              random state is used.
+        Returns:
+          A tuple (params, nll) with the design point with the lowest true NLL.
+        """
+        rng = get_generator(rng)
+        for i in range(numRefinements):
+            candidate = self._to_unit(self.get_surrogate_minimum(numStarts))
+            unitPoints = np.array([self._to_unit(p) for p in self.points])
+            distances = np.sqrt(np.sum((unitPoints - candidate) ** 2, axis=1))
+            if np.min(distances) < minDistance:
+                candidate = np.clip(
+                    candidate + rng.uniform(
+                        -localRadius, localRadius, candidate.size), 0, 1)
+            self.add_points([self._from_unit(candidate)])
+            if self.verbose:
+                print(u"Surrogate refinement " + str(i) + u": true NLL " +
+                      str(self.values[-1]) + u" at " +
+                      str(list(self.points[-1])) + u".")
+        return self.get_best_point()
+
+
+    def confirm(self, params):
+        """
+        Evaluates the true NLL at a candidate found by querying the surrogate,
+        and adds the candidate to the design.
+        Args:
+          params: list of parameters, in the same order as the bounds.
+        Returns:
+          The true NLL at the candidate.
+        """
+        return self.add_points([params])[0]
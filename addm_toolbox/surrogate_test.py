@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Copyright (C) 2017, California Institute of Technology
+
+This file is part of addm_toolbox.
+
+addm_toolbox is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+addm_toolbox is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with addm_toolbox. If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+Module: surrogate_test.py
+
+Unit tests for the surrogate.py module.
+"""
+
+from __future__ import absolute_import
+
+import numpy as np
+import unittest
+
+from .surrogate import NLLSurrogate
+
+
+def quadratic_nll(params):
+    """
+    Known NLL surface, with its minimum at (0.3, 0.6).
+    """
+    return 100 + 50 * (params[0] - 0.3) ** 2 + 20 * (params[1] - 0.6) ** 2
+
+
+class TestSurrogateSeeding(unittest.TestCase):
+    def test_seeded_design_reproducible(self):
+        surrogate1 = NLLSurrogate(quadratic_nll, [(0, 1), (0, 1)])
+        surrogate1.build_design(10, rng=3)
+        surrogate1.refine(3, rng=4)
+        surrogate2 = NLLSurrogate(quadratic_nll, [(0, 1), (0, 1)])
+        surrogate2.build_design(10, rng=3)
+        surrogate2.refine(3, rng=4)
+
+        np.testing.assert_array_equal(surrogate1.points, surrogate2.points)
+        np.testing.assert_array_equal(surrogate1.values, surrogate2.values)
+
+    def test_design_is_latin_hypercube(self):
+        surrogate = NLLSurrogate(quadratic_nll, [(0, 2), (10, 20)])
+        surrogate.build_design(8, rng=5)
+        unitPoints = np.array([surrogate._to_unit(p)
+                               for p in surrogate.points])
+
+        # Each parameter has exactly one design point in each of the 8
+        # equally sized strata of its range.
+        for p in range(2):
+            np.testing.assert_array_equal(
+                np.arange(8), np.sort(np.floor(unitPoints[:, p] * 8)))
+
+
+class TestSurrogateFit(unittest.TestCase):
+    def setUp(self):
+        self.numEvaluations = 0
+
+    def count_quadratic_nll(self, params):
+        self.numEvaluations += 1
+        return quadratic_nll(params)
+
+    def test_interpolant_reproduces_quadratic(self):
+        surrogate = NLLSurrogate(quadratic_nll, [(0, 1), (0, 1)])
+        surrogate.build_design(40, rng=6)
+
+        rng = np.random.default_rng(7)
+        for params in rng.uniform(0.1, 0.9, (20, 2)):
+            self.assertAlmostEqual(quadratic_nll(params), surrogate(params))
+
+    def test_refine_adds_points_near_minimum(self):
+        surrogate = NLLSurrogate(quadratic_nll, [(0, 1), (0, 1)])
+        surrogate.build_design(15, rng=8)
+        bestDesignPoint, bestDesignValue = surrogate.get_best_point()
+        bestParams, bestValue = surrogate.refine(5, rng=9)
+
+        self.assertEqual(20, len(surrogate.points))
+        distances = [np.hypot(p[0] - 0.3, p[1] - 0.6)
+                     for p in surrogate.points[15:]]
+        self.assertLess(min(distances), 0.05)
+        self.assertLess(bestValue, bestDesignValue)
+        self.assertEqual(quadratic_nll(bestParams), bestValue)
+
+    def test_confirm_uses_true_nll(self):
+        surrogate = NLLSurrogate(self.count_quadratic_nll, [(0, 1), (0, 1)])
+        surrogate.build_design(10, rng=10)
+        self.assertEqual(10, self.numEvaluations)
+
+        params = [0.45, 0.35]
+        self.assertEqual(quadratic_nll(params), surrogate.confirm(params))
+        self.assertEqual(11, self.numEvaluations)
+        np.testing.assert_array_equal(params, surrogate.points[-1])
+        # A confirmed point is not evaluated again.
+        self.assertEqual(quadratic_nll(params), surrogate.confirm(params))
+        self.assertEqual(11, self.numEvaluations)
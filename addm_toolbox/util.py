@@ -32,6 +32,7 @@ import csv
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import pandas as pd
 
 from builtins import range, str, zip
@@ -40,6 +41,14 @@ from io import open
 from matplotlib.backends.backend_pdf import PdfPages
 
 from .addm import FixationData, aDDMTrial, aDDM
+from .ddm import SimulationBatch, get_batch_from_trials
+from .rng import get_generator
+
+
+# Columns of the CSV files where simulations are saved.
+EXPDATA_COLUMNS = [u"parcode", u"trial", u"rt", u"choice", u"item_left",
+                   u"item_right"]
+FIXATIONS_COLUMNS = [u"parcode", u"trial", u"fix_item", u"fix_time"]
 
 
 def convert_item_values(value):
@@ -314,38 +323,193 @@ def save_simulations_to_csv(trials, expdataFileName, fixationsFileName):
     simul_fixations.csv, each row corresponds to a fixation, with columns
     parcode, trial, fix_item and fix_time.
     Args:
-      trials: a list of aDDMTrial objects.
+      trials: a SimulationBatch object with fixations, or a list of aDDMTrial
+          objects.
     """
-    expdata = pd.DataFrame()
-    fixations = pd.DataFrame()
-    for t, trial in enumerate(trials):
-        expdata = expdata.append(
-            {u"parcode": 0, u"trial": t, u"rt": trial.RT, 
-             u"choice": trial.choice, u"item_left": trial.valueLeft,
-             u"item_right": trial.valueRight},
-            ignore_index=True)
-
-        for item, time in zip(trial.fixItem, trial.fixTime):
-            fixations = fixations.append(
-                {u"parcode": 0, u"trial": t, u"fix_item": item,
-                 u"fix_time": time},
-                ignore_index=True)
+    with SimulationWriter(expdataFileName, fixationsFileName) as writer:
+        writer.write(trials)
 
-    try:
-        expdata.to_csv(
-            expdataFileName, sep=",", index=False, float_format=u"%d",
-            columns=[u"parcode", u"trial", u"rt", u"choice", u"item_left",
-                     u"item_right"])
-    except:
-        print(u"Failed to save experimental data to CSV file.")
-        raise
-    try:
-        fixations.to_csv(
-            fixationsFileName, sep=",", index=False, float_format=u"%d",
-            columns=[u"parcode", u"trial", u"fix_item", u"fix_time"])
-    except:
-        print(u"Failed to save fixations to CSV file.")
-        raise
+
+def truncate_simulations_file(fileName, numTrials=None):
+    """
+    Truncates a CSV file written by a SimulationWriter after its last
+    complete row, so that a partially written row (e.g. from an interrupted
+    run) is discarded. Rows are assumed to be sorted by trial.
+    Args:
+      fileName: string, path of the CSV file.
+      numTrials: int, if provided, rows from trial numTrials onwards are
+          discarded as well.
+    Returns:
+      The number of rows left in the file, not counting the header, or -1 if
+          the file did not have a complete header (in which case it is
+          emptied).
+    """
+    size = 0
+    numRows = -1
+    with open(fileName, u"rb") as csvFile:
+        for line in csvFile:
+            if not line.endswith(b"\n"):
+                break
+            if (numRows >= 0 and numTrials is not None and
+                int(line.split(b",")[1]) >= numTrials):
+                break
+            size += len(line)
+            numRows += 1
+    with open(fileName, u"r+b") as csvFile:
+        csvFile.truncate(size)
+    return numRows
+
+
+class SimulationWriter(object):
+    """
+    Writes simulations to the CSV files used by save_simulations_to_csv(),
+    one batch at a time. Each batch is flushed to disk as soon as it is
+    written, so simulation loops can stream their results without keeping
+    them in memory:
+
+        with SimulationWriter(expdataFileName, fixationsFileName) as writer:
+            for batch in pool.iter_simulations(model, trialConditions, 100,
+                                               fixationData):
+                writer.write(batch)
+
+    The fixations of a batch are written before its trials, so the trials
+    file always marks how far a run got. An interrupted run can be resumed by
+    opening the same files with resume=True and skipping the first
+    writer.numTrials trials.
+    """
+    def __init__(self, expdataFileName, fixationsFileName, resume=False):
+        """
+        Args:
+          expdataFileName: string, path of the trials CSV file.
+          fixationsFileName: string, path of the fixations CSV file.
+          resume: boolean, whether to append to existing files instead of
+              overwriting them. Rows left incomplete by an interrupted run
+              are discarded.
+        """
+        self.expdataFileName = expdataFileName
+        self.fixationsFileName = fixationsFileName
+        self.numTrials = 0
+        mode = u"w"
+        if (resume and os.path.isfile(expdataFileName) and
+            os.path.isfile(fixationsFileName)):
+            numTrials = truncate_simulations_file(expdataFileName)
+            if (numTrials >= 0 and
+                truncate_simulations_file(fixationsFileName, numTrials) >= 0):
+                self.numTrials = numTrials
+                mode = u"a"
+        self.expdataFile = open(expdataFileName, mode)
+        self.fixationsFile = open(fixationsFileName, mode)
+        if mode == u"w":
+            self.expdataFile.write(u",".join(EXPDATA_COLUMNS) + u"\n")
+            self.fixationsFile.write(u",".join(FIXATIONS_COLUMNS) + u"\n")
+            self.flush()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+
+    def write(self, trials):
+        """
+        Appends a set of simulated trials to the files. Trials are numbered
+        after the ones already written.
+        Args:
+          trials: a SimulationBatch object with fixations, or a list of
+              aDDMTrial objects.
+        """
+        if not isinstance(trials, SimulationBatch):
+            trials = get_batch_from_trials(trials)
+        trialIds = self.numTrials + np.arange(len(trials))
+        fixations = pd.DataFrame(
+            {u"parcode": 0,
+             u"trial": np.repeat(trialIds, np.diff(trials.fixOffsets)),
+             u"fix_item": trials.fixItem, u"fix_time": trials.fixTime})
+        expdata = pd.DataFrame(
+            {u"parcode": 0, u"trial": trialIds, u"rt": trials.RT,
+             u"choice": trials.choice, u"item_left": trials.valueLeft,
+             u"item_right": trials.valueRight})
+
+        try:
+            fixations.to_csv(
+                self.fixationsFile, sep=",", header=False, index=False,
+                float_format=u"%d", columns=FIXATIONS_COLUMNS)
+            self.fixationsFile.flush()
+        except:
+            print(u"Failed to save fixations to CSV file.")
+            raise
+        try:
+            expdata.to_csv(
+                self.expdataFile, sep=",", header=False, index=False,
+                float_format=u"%d", columns=EXPDATA_COLUMNS)
+            self.expdataFile.flush()
+        except:
+            print(u"Failed to save experimental data to CSV file.")
+            raise
+        self.numTrials += len(trials)
+
+
+    def flush(self):
+        """
+        Flushes both files to disk.
+        """
+        self.fixationsFile.flush()
+        self.expdataFile.flush()
+
+
+    def close(self):
+        """
+        Closes both files.
+        """
+        self.fixationsFile.close()
+        self.expdataFile.close()
+
+
+def predict_distributions(model, trialConditions, fixationData=None,
+                          maxRT=10000, timeStep=10, approxStateStep=0.1,
+                          numFixationSamples=100, rng=None):
+    """
+    Obtains the choice and response time distributions predicted by a model
+    for a set of trial conditions, by propagating the distribution of the RDV
+    forward in time instead of generating simulations.
+    Args:
+      model: a DDM or aDDM object.
+      trialConditions: list of pairs corresponding to the different trial
+          conditions. Each pair contains the values of left and right items.
+      fixationData: a FixationData object, used to sample the fixation
+          sequences over which aDDM predictions are averaged. Required for
+          aDDM objects only.
+      maxRT: integer, maximum response time in milliseconds covered by the
+          distributions.
+      timeStep: integer, value in milliseconds to be used for binning the
+          time axis.
+      approxStateStep: float, to be used for binning the RDV axis.
+      numFixationSamples: integer, number of fixation sequences per trial
+          condition (aDDM only).
+      rng: source of random numbers used to sample the fixation sequences,
+          as accepted by rng.get_generator(). If not provided, the global
+          numpy random state is used.
+    Returns:
+      A dict indexed by trial condition, where each entry is a
+          ChoiceRTDistribution object.
+    """
+    rng = get_generator(rng)
+    predictions = dict()
+    for (valueLeft, valueRight) in trialConditions:
+        if isinstance(model, aDDM):
+            predictions[(valueLeft, valueRight)] = model.predict_distribution(
+                valueLeft, valueRight, fixationData,
+                numFixationSamples=numFixationSamples, maxRT=maxRT,
+                timeStep=timeStep, approxStateStep=approxStateStep, rng=rng)
+        else:
+            predictions[(valueLeft, valueRight)] = model.predict_distribution(
+                valueLeft, valueRight, maxRT=maxRT, timeStep=timeStep,
+                approxStateStep=approxStateStep)
+    return predictions
 
 
 def generate_choice_curves(dataTrials, simulTrials, pdfPages,
@@ -355,8 +519,9 @@ def generate_choice_curves(dataTrials, simulTrials, pdfPages,
     Args:
       dataTrials: a list of DDMTrial objects corresponding to the experimental
           data.
-      simulTrials: a list of DDMTrial objects corresponding to the
-          simulations.
+      simulTrials: a SimulationBatch object or a list of DDMTrial objects
+          corresponding to the simulations, or a dict of ChoiceRTDistribution
+          objects as returned by predict_distributions().
       pdfPages: matplotlib.backends.backend_pdf.PdfPages object.
       valueDiffRange: a numpy array corresponding to the value differences to
           be used in the x axis of the choice plot; should be sorted in
@@ -388,22 +553,37 @@ def generate_choice_curves(dataTrials, simulTrials, pdfPages,
     countTotal = np.zeros(numValueDiffs)
     countLeftChosen = np.zeros(numValueDiffs)
 
-    for trial in simulTrials:
-        valueDiff = trial.valueLeft - trial.valueRight
-        idx = (np.abs(valueDiffRange - valueDiff)).argmin()
-        countTotal[idx] += 1
-        if trial.choice == -1:  # Choice was left.
-            countLeftChosen[idx] += 1
-
-    stdProbLeftChosen = np.zeros(numValueDiffs)
-    probLeftChosen = np.zeros(numValueDiffs)
-    for i in range(numValueDiffs):
-        probLeftChosen[i] = countLeftChosen[i] / countTotal[i]
-        stdProbLeftChosen[i] = np.sqrt(
-            (probLeftChosen[i] * (1 - probLeftChosen[i])) / countTotal[i])
-
-    plt.errorbar(valueDiffRange, probLeftChosen, yerr=stdProbLeftChosen,
-                 color=colors[5], label=u"Simulations")
+    if isinstance(simulTrials, dict):
+        # Predicted distributions: average the choice probabilities of all
+        # trial conditions with the same value difference.
+        for distribution in simulTrials.values():
+            valueDiff = distribution.valueLeft - distribution.valueRight
+            idx = (np.abs(valueDiffRange - valueDiff)).argmin()
+            countTotal[idx] += 1
+            countLeftChosen[idx] += distribution.get_choice_probability()
+        with np.errstate(divide=u"ignore", invalid=u"ignore"):
+            probLeftChosen = countLeftChosen / countTotal
+        plt.plot(valueDiffRange, probLeftChosen, color=colors[5],
+                 label=u"Predictions")
+    else:
+        if not isinstance(simulTrials, SimulationBatch):
+            simulTrials = get_batch_from_trials(simulTrials)
+        valueDiffs = simulTrials.valueLeft - simulTrials.valueRight
+        idxs = np.abs(valueDiffRange[np.newaxis, :] -
+                      valueDiffs[:, np.newaxis]).argmin(axis=1)
+        countTotal = np.bincount(idxs, minlength=numValueDiffs)
+        countLeftChosen = np.bincount(
+            idxs, weights=(simulTrials.choice == -1), minlength=numValueDiffs)
+
+        stdProbLeftChosen = np.zeros(numValueDiffs)
+        probLeftChosen = np.zeros(numValueDiffs)
+        for i in range(numValueDiffs):
+            probLeftChosen[i] = countLeftChosen[i] / countTotal[i]
+            stdProbLeftChosen[i] = np.sqrt(
+                (probLeftChosen[i] * (1 - probLeftChosen[i])) / countTotal[i])
+
+        plt.errorbar(valueDiffRange, probLeftChosen, yerr=stdProbLeftChosen,
+                     color=colors[5], label=u"Simulations")
     plt.xlabel(u"Value difference")
     plt.ylabel(u"P(choose left)")
     plt.legend(loc=u"upper left")
@@ -419,8 +599,9 @@ def generate_rt_curves(dataTrials, simulTrials, pdfPages,
     Args:
       dataTrials: a list of DDMTrial objects corresponding to the experimental
           data.
-      simulTrials: a list of DDMTrial objects corresponding to the
-          simulations.
+      simulTrials: a SimulationBatch object or a list of DDMTrial objects
+          corresponding to the simulations, or a dict of ChoiceRTDistribution
+          objects as returned by predict_distributions().
       pdfPages: matplotlib.backends.backend_pdf.PdfPages object.
       valueDiffRange: a numpy array corresponding to the value differences to
           be used in the x axis of the choice plot; should be sorted in
@@ -452,20 +633,38 @@ def generate_rt_curves(dataTrials, simulTrials, pdfPages,
     for valueDiff in valueDiffRange:
         RTsPerValueDiff[valueDiff] = list()
 
-    for trial in simulTrials:
-        valueDiff = trial.valueLeft - trial.valueRight
-        RTsPerValueDiff[valueDiff].append(trial.RT)
+    if isinstance(simulTrials, dict):
+        # Predicted distributions: average the mean response times of all
+        # trial conditions with the same value difference.
+        for distribution in simulTrials.values():
+            valueDiff = distribution.valueLeft - distribution.valueRight
+            RTsPerValueDiff[valueDiff].append(distribution.get_mean_rt())
 
-    meanRTs = np.zeros(numValueDiffs)
-    stdRTs = np.zeros(numValueDiffs)
-    for valueDiff in valueDiffRange:
-        idx = (np.abs(valueDiffRange - valueDiff)).argmin()
-        meanRTs[idx] = np.mean(RTsPerValueDiff[valueDiff])
-        stdRTs[idx] = (np.std(RTsPerValueDiff[valueDiff]) /
-                       np.sqrt(len(RTsPerValueDiff[valueDiff])))
+        meanRTs = np.zeros(numValueDiffs)
+        for valueDiff in valueDiffRange:
+            idx = (np.abs(valueDiffRange - valueDiff)).argmin()
+            meanRTs[idx] = np.mean(RTsPerValueDiff[valueDiff])
 
-    plt.errorbar(valueDiffRange, meanRTs, yerr=stdRTs, label=u"Simulations",
+        plt.plot(valueDiffRange, meanRTs, label=u"Predictions",
                  color=colors[5])
+    else:
+        if not isinstance(simulTrials, SimulationBatch):
+            simulTrials = get_batch_from_trials(simulTrials)
+        valueDiffs = simulTrials.valueLeft - simulTrials.valueRight
+        for valueDiff in valueDiffRange:
+            RTsPerValueDiff[valueDiff] = simulTrials.RT[
+                valueDiffs == valueDiff]
+
+        meanRTs = np.zeros(numValueDiffs)
+        stdRTs = np.zeros(numValueDiffs)
+        for valueDiff in valueDiffRange:
+            idx = (np.abs(valueDiffRange - valueDiff)).argmin()
+            meanRTs[idx] = np.mean(RTsPerValueDiff[valueDiff])
+            stdRTs[idx] = (np.std(RTsPerValueDiff[valueDiff]) /
+                           np.sqrt(len(RTsPerValueDiff[valueDiff])))
+
+        plt.errorbar(valueDiffRange, meanRTs, yerr=stdRTs,
+                     label=u"Simulations", color=colors[5])
     plt.xlabel(u"Value difference")
     plt.ylabel(u"Response time")
     plt.legend(loc=u"upper left")
@@ -34,10 +34,12 @@ import unittest
 
 from datetime import datetime
 
-from .addm import aDDMTrial
+from .addm import FixationData, aDDMTrial, aDDM
+from .ddm import DDM
 from .util import (load_trial_conditions_from_csv,
                    load_data_from_csv, save_simulations_to_csv,
-                   convert_item_values)
+                   convert_item_values, predict_distributions,
+                   truncate_simulations_file, SimulationWriter)
 
 
 class TestLoadTrialConditions(unittest.TestCase):
@@ -176,3 +178,158 @@ class TestSaveSimulationsToCSV(unittest.TestCase):
 
         os.remove(expdataFileName)
         os.remove(fixationsFileName)
+
+
+class TestSimulationWriter(unittest.TestCase):
+    def setUp(self):
+        currTime = datetime.now().strftime(u"%Y-%m-%d_%H:%M:%S")
+        self.expdataFileName = u"writer_expdata_" + currTime + u".csv"
+        self.fixationsFileName = u"writer_fixations_" + currTime + u".csv"
+        self.trials = [
+            aDDMTrial(RT=100, choice=1, valueLeft=1, valueRight=0,
+                      fixItem=[1, 2], fixTime=[50, 50]),
+            aDDMTrial(RT=200, choice=-1, valueLeft=2, valueRight=1,
+                      fixItem=[1, 2, 1], fixTime=[100, 50, 50]),
+            aDDMTrial(RT=300, choice=1, valueLeft=0, valueRight=3,
+                      fixItem=[2], fixTime=[300])]
+
+    def tearDown(self):
+        for fileName in [self.expdataFileName, self.fixationsFileName]:
+            if os.path.isfile(fileName):
+                os.remove(fileName)
+
+    def read_files(self):
+        with open(self.expdataFileName, u"r") as expdataFile:
+            expdata = expdataFile.read()
+        with open(self.fixationsFileName, u"r") as fixationsFile:
+            fixations = fixationsFile.read()
+        return expdata, fixations
+
+    def test_write_matches_save_simulations_to_csv(self):
+        with SimulationWriter(self.expdataFileName,
+                              self.fixationsFileName) as writer:
+            writer.write(self.trials[:2])
+            writer.write(self.trials[2:])
+            self.assertEqual(3, writer.numTrials)
+        written = self.read_files()
+
+        save_simulations_to_csv(self.trials, self.expdataFileName,
+                                self.fixationsFileName)
+        self.assertEqual(self.read_files(), written)
+
+    def test_fixations_written_before_trials(self):
+        class FailingFile(object):
+            def write(self, data):
+                raise IOError(u"Disk full.")
+
+        writer = SimulationWriter(self.expdataFileName,
+                                  self.fixationsFileName)
+        expdataFile = writer.expdataFile
+        writer.expdataFile = FailingFile()
+        self.assertRaises(IOError, writer.write, self.trials[:1])
+        writer.expdataFile = expdataFile
+        writer.close()
+
+        expdata, fixations = self.read_files()
+        self.assertEqual(u"parcode,trial,rt,choice,item_left,item_right\n",
+                         expdata)
+        self.assertEqual(u"parcode,trial,fix_item,fix_time\n"
+                         u"0,0,1,50\n0,0,2,50\n", fixations)
+
+    def test_truncate_partial_row(self):
+        with SimulationWriter(self.expdataFileName,
+                              self.fixationsFileName) as writer:
+            writer.write(self.trials)
+        with open(self.expdataFileName, u"a") as expdataFile:
+            expdataFile.write(u"0,3,40")
+
+        self.assertEqual(3, truncate_simulations_file(self.expdataFileName))
+        self.assertEqual(2, truncate_simulations_file(
+            self.fixationsFileName, numTrials=1))
+        expdata, fixations = self.read_files()
+        self.assertTrue(expdata.endswith(u"0,2,300,1,0,3\n"))
+        self.assertEqual(u"parcode,trial,fix_item,fix_time\n"
+                         u"0,0,1,50\n0,0,2,50\n", fixations)
+
+    def test_resume_after_interrupted_write(self):
+        save_simulations_to_csv(self.trials, self.expdataFileName,
+                                self.fixationsFileName)
+        complete = self.read_files()
+
+        # Simulate a run interrupted while writing the fixations of the
+        # second batch: the trials file only has the first batch.
+        with SimulationWriter(self.expdataFileName,
+                              self.fixationsFileName) as writer:
+            writer.write(self.trials[:1])
+        with open(self.fixationsFileName, u"a") as fixationsFile:
+            fixationsFile.write(u"0,1,1,100\n0,1,2,")
+
+        with SimulationWriter(self.expdataFileName, self.fixationsFileName,
+                              resume=True) as writer:
+            self.assertEqual(1, writer.numTrials)
+            writer.write(self.trials[writer.numTrials:])
+        self.assertEqual(complete, self.read_files())
+
+    def test_resume_without_files(self):
+        with SimulationWriter(self.expdataFileName, self.fixationsFileName,
+                              resume=True) as writer:
+            self.assertEqual(0, writer.numTrials)
+            writer.write(self.trials[:1])
+        expdata, _ = self.read_files()
+        self.assertEqual(u"parcode,trial,rt,choice,item_left,item_right\n"
+                         u"0,0,100,1,1,0\n", expdata)
+
+
+class TestPredictDistributions(unittest.TestCase):
+    def test_predict_distributions_ddm(self):
+        model = DDM(d=0.006, sigma=0.07)
+        predictions = predict_distributions(model, [(1, 1), (3, 0)])
+
+        self.assertAlmostEqual(
+            0, predictions[(1, 1)].get_prob_undecided(), places=2)
+        self.assertAlmostEqual(
+            0.5, predictions[(1, 1)].get_choice_probability())
+        self.assertGreater(predictions[(3, 0)].get_choice_probability(), 0.9)
+        self.assertLess(predictions[(3, 0)].get_mean_rt(),
+                        predictions[(1, 1)].get_mean_rt())
+
+    def test_predict_distributions_addm(self):
+        fixations = dict()
+        for fixNumber in range(1, 4):
+            fixations[fixNumber] = dict()
+            for valueDiff in range(-3, 4):
+                fixations[fixNumber][valueDiff] = np.array([200, 400, 600])
+        fixationData = FixationData(
+            probFixLeftFirst=0.5, latencies=np.array([100, 200]),
+            transitions=np.array([20, 40]), fixations=fixations,
+            fixDistType=u"fixation")
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        predictions = predict_distributions(
+            model, [(2, 1)], fixationData=fixationData, numFixationSamples=10)
+
+        distribution = predictions[(2, 1)]
+        self.assertEqual(distribution.probLeft.size,
+                         distribution.probRight.size)
+        self.assertAlmostEqual(0, distribution.get_prob_undecided(), places=2)
+        self.assertGreater(distribution.get_choice_probability(), 0.5)
+
+    def test_predict_distributions_addm_seeded(self):
+        fixations = dict()
+        for fixNumber in range(1, 4):
+            fixations[fixNumber] = np.array([200, 400, 600])
+        fixationData = FixationData(
+            probFixLeftFirst=0.5, latencies=np.array([100, 200]),
+            transitions=np.array([20, 40]), fixations=fixations,
+            fixDistType=u"simple")
+        model = aDDM(d=0.006, sigma=0.07, theta=0.4)
+        predictions1 = predict_distributions(
+            model, [(2, 1)], fixationData=fixationData, numFixationSamples=5,
+            maxRT=3000, rng=7)
+        predictions2 = predict_distributions(
+            model, [(2, 1)], fixationData=fixationData, numFixationSamples=5,
+            maxRT=3000, rng=7)
+
+        np.testing.assert_array_equal(predictions1[(2, 1)].probLeft,
+                                      predictions2[(2, 1)].probLeft)
+        np.testing.assert_array_equal(predictions1[(2, 1)].probRight,
+                                      predictions2[(2, 1)].probRight)
@@ -43,6 +43,7 @@ setup(name="addm_toolbox",
           "bin/addm_genetic_algorithm",
           "bin/addm_simulate_true_distributions",
           "bin/addm_cis_trans_fit",
+          "bin/addm_worker",
       ],
       test_suite="nose.collector",
       tests_require=["nose"],
@@ -54,5 +55,8 @@ setup(name="addm_toolbox",
           "pandas",
           "scipy",
       ],
+      extras_require={
+          "threadpoolctl": ["threadpoolctl"],
+      },
       include_package_data=True,
       zip_safe=False)